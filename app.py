@@ -5,33 +5,84 @@ import hashlib
 import base64
 import uuid
 import random
-from flask import Flask, request, Response
-from redis import Redis
-from tasks import process_message
-from logger import log
+import functools
+from flask import Flask, request, Response, jsonify
+from pipeline import ENTRY_TASK, ENTRY_QUEUE
+from tasks import task_args
+from dedup import filter_new_messages
+from enqueue import enqueue_batch
+from webhook_stream import NotAnArray, SignedFieldReader
+from logger import log, log_files, iter_logs, parse_since
+from tracing import recent_traces
+from profiler import (
+    profiled, profiler, start_session, stop_session, current_session, last_session_id, session_processes,
+    collapsed_stacks,
+)
+from startup import Lazy
+from redis_client import get_redis
+from metrics import WEBHOOK_LATENCY, WEBHOOK_BATCH_SIZE, WEBHOOK_MESSAGES, ENQUEUE_FAILURES, render as render_metrics
 from celery_worker import celery  # 🔄 nouvelle import
 
 API_KEY = os.getenv("API_KEY")
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
-LOG_FILE = "/tmp/log.txt"
+BATCH_ENQUEUE = os.getenv("BATCH_ENQUEUE", "true").lower() == "true"
+EARLY_DEDUP = os.getenv("EARLY_DEDUP", "true").lower() == "true"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # routes /admin/* désactivées sans jeton
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or ADMIN_TOKEN  # jeton de scrape de /metrics (Prometheus)
+
+# ⏱️ Délai aléatoire avant la réponse (0/0 : immédiate, pour les tests de charge)
+REPLY_DELAY_MIN = int(os.getenv("REPLY_DELAY_MIN", "60"))
+REPLY_DELAY_MAX = int(os.getenv("REPLY_DELAY_MAX", "180"))
+
+# 🚿 Lecture en flux du webhook (HMAC et JSON incrémentaux, mise en file par lots)
+STREAMING_WEBHOOK = os.getenv("STREAMING_WEBHOOK", "true").lower() == "true"
+WEBHOOK_MAX_PAYLOAD = int(os.getenv("WEBHOOK_MAX_PAYLOAD", str(10 * 1024 * 1024)))
+WEBHOOK_SPOOL_MEMORY = int(os.getenv("WEBHOOK_SPOOL_MEMORY", str(1024 * 1024)))
+WEBHOOK_STREAM_BATCH = int(os.getenv("WEBHOOK_STREAM_BATCH", "500"))
+STREAM_READ_SIZE = 64 * 1024
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = WEBHOOK_MAX_PAYLOAD
+
+# ✅ Connexion Redis (pool partagé du process, créé au premier usage)
+redis_conn = Lazy(get_redis)
+
+
+def token_required(expected):
+    """Jeton exigé dans l'en-tête X-Admin-Token ou `Authorization: Bearer` ; route fermée sans jeton configuré"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = request.headers.get("X-Admin-Token", "")
+            authorization = request.headers.get("Authorization", "")
+            if authorization.startswith("Bearer "):
+                token = authorization[len("Bearer "):]
+            if not expected or not hmac.compare_digest(token.encode(), expected.encode()):
+                log(f"❌ Accès admin refusé : {request.path}", level="WARNING")
+                return "Accès refusé", 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
 
-# ✅ Connexion Redis
-REDIS_URL = os.getenv("REDIS_URL")
-redis_conn = Redis.from_url(REDIS_URL)
+
+admin_only = token_required(ADMIN_TOKEN)
 
 @app.route('/sms_auto_reply', methods=['POST'])
+@WEBHOOK_LATENCY.time()
+@profiled("sms_auto_reply")
 def sms_auto_reply():
     request_id = str(uuid.uuid4())[:8]
     log(f"\n📩 [{request_id}] Nouvelle requête POST reçue")
 
+    if STREAMING_WEBHOOK and BATCH_ENQUEUE and request.mimetype == "application/x-www-form-urlencoded":
+        return sms_auto_reply_streaming(request_id)
+
     messages_raw = request.form.get("messages")
     if not messages_raw:
         log(f"[{request_id}] ❌ Champ 'messages' manquant")
         return "messages manquants", 400
 
-    log(f"[{request_id}] 🔎 messages brut : {messages_raw}")
+    log(f"[{request_id}] 🔎 messages brut : {messages_raw}", level="DEBUG")
 
     # ✅ Signature
     if not DEBUG_MODE:
@@ -52,7 +103,7 @@ def sms_auto_reply():
     # ✅ Parsing JSON
     try:
         messages = json.loads(messages_raw)
-        log(f"[{request_id}] ✔️ messages parsés : {messages}")
+        log(f"[{request_id}] ✔️ messages parsés : {messages}", level="DEBUG")
     except json.JSONDecodeError as e:
         log(f"[{request_id}] ❌ JSON invalide : {e}")
         return "Format JSON invalide", 400
@@ -60,26 +111,228 @@ def sms_auto_reply():
     if not isinstance(messages, list):
         log(f"[{request_id}] ❌ Format JSON non liste")
         return "Liste attendue", 400
+    WEBHOOK_BATCH_SIZE.observe(len(messages))
+
+    # 🧹 Filtrage anticipé : numéros archivés, messages déjà traités, doublons
+    skipped = {}
+    if EARLY_DEDUP:
+        pending, skipped = filter_new_messages(redis_conn, messages)
+        if len(pending) < len(messages):
+            log(f"[{request_id}] 🧹 {len(messages) - len(pending)} message(s) écarté(s) : {skipped}")
+    else:
+        pending = list(enumerate(messages))
+    for reason, count in skipped.items():
+        if count:
+            WEBHOOK_MESSAGES.labels(reason).inc(count)
+
+    # ✅ Mise en file Celery avec délai aléatoire (REPLY_DELAY_MIN à REPLY_DELAY_MAX sec, 60 à 180 par défaut)
+    if BATCH_ENQUEUE:
+        return enqueue_messages_batch(request_id, pending, skipped)
 
-    # ✅ Mise en file Celery avec délai aléatoire (60 à 180 sec)
-    for i, msg in enumerate(messages):
+    for i, msg in pending:
         try:
-            delay = random.randint(60, 180)
+            delay = random.randint(REPLY_DELAY_MIN, REPLY_DELAY_MAX)
             log(f"[{request_id}] ⏱️ Mise en file message {i} avec délai {delay}s")
-            result = process_message.apply_async(args=[json.dumps(msg)], countdown=delay)
+            result = ENTRY_TASK.apply_async(args=message_args(msg), countdown=delay,
+                                                 headers={"request_id": request_id})
             log(f"[{request_id}] ✅ Job {i} Celery ID : {result.id}")
+            WEBHOOK_MESSAGES.labels("queued").inc()
         except Exception as e:
             log(f"[{request_id}] ❌ Erreur Celery file {i} : {e}")
+            WEBHOOK_MESSAGES.labels("failed").inc()
+            ENQUEUE_FAILURES.inc()
 
     log(f"[{request_id}] 🏁 Tous les messages sont en file")
     return "OK", 200
 
+def message_args(msg):
+    """Seuls numéro, ID et device voyagent dans la tâche"""
+    if not isinstance(msg, dict):
+        return [json.dumps(msg)]  # rejeté par le worker comme avant
+    return task_args(msg.get("number"), msg.get("ID"), msg.get("deviceID"))
+
+def enqueue_messages_batch(request_id, pending, skipped):
+    """Toute la requête en un seul pipeline Redis, échecs rapportés message par message.
+
+    `pending` : liste de (index dans la requête, message).
+    """
+    queued, failed = enqueue_pending(request_id, pending)
+    log(f"[{request_id}] 🏁 {queued}/{len(pending)} messages en file (pipeline unique)")
+    return jsonify({"status": "OK", "queued": queued, "skipped": skipped, "failed": failed}), 200
+
+def enqueue_jobs(pending):
+    """(arguments, délai) de chaque message à mettre en file"""
+    return [(message_args(msg), random.randint(REPLY_DELAY_MIN, REPLY_DELAY_MAX)) for _, msg in pending]
+
+def enqueue_pending(request_id, pending):
+    """Un pipeline Redis pour `pending` ; retourne (nombre en file, échecs)"""
+    jobs = enqueue_jobs(pending)
+    results = enqueue_batch(redis_conn, ENTRY_TASK.name, jobs, queue=ENTRY_QUEUE,
+                            headers={"request_id": request_id})
+    return record_enqueue_results(request_id, pending, results)
+
+def record_enqueue_results(request_id, pending, results):
+    """Journalise et compte les échecs de mise en file ; retourne (nombre en file, échecs)"""
+    failed = []
+    for (i, _), (task_id, error) in zip(pending, results):
+        if error is not None:
+            log(f"[{request_id}] ❌ Erreur Celery file {i} : {error}", level="ERROR")
+            failed.append({"index": i, "error": str(error)})
+
+    queued = len(pending) - len(failed)
+    WEBHOOK_MESSAGES.labels("queued").inc(queued)
+    if failed:
+        WEBHOOK_MESSAGES.labels("failed").inc(len(failed))
+        ENQUEUE_FAILURES.inc(len(failed))
+    return queued, failed
+
+def sms_auto_reply_streaming(request_id):
+    """Variante en flux de /sms_auto_reply, sans copie complète du payload en mémoire.
+
+    Le champ `messages` est décodé au fil de la lecture, haché (HMAC
+    incrémental), validé par le parseur JSON incrémental et recopié dans un
+    tampon (en mémoire jusqu'à WEBHOOK_SPOOL_MEMORY, sur disque au-delà).
+    Rien n'est mis en file avant la vérification de la signature, qui couvre
+    tout le payload ; le tampon est ensuite relu élément par élément et mis en
+    file par lots de WEBHOOK_STREAM_BATCH messages.
+    """
+    if request.content_length and request.content_length > WEBHOOK_MAX_PAYLOAD:
+        log(f"[{request_id}] ❌ Payload trop volumineux ({request.content_length} octets)")
+        return "Payload trop volumineux", 413
+
+    signature = request.headers.get("X-SG-SIGNATURE")
+    if not DEBUG_MODE and not signature:
+        log(f"[{request_id}] ❌ Signature manquante")
+        return "Signature requise", 403
+
+    with SignedFieldReader("messages", None if DEBUG_MODE else API_KEY, WEBHOOK_SPOOL_MEMORY) as reader:
+        received = 0
+        while True:
+            chunk = request.stream.read(STREAM_READ_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+            if received > WEBHOOK_MAX_PAYLOAD:
+                log(f"[{request_id}] ❌ Payload trop volumineux (> {WEBHOOK_MAX_PAYLOAD} octets)")
+                return "Payload trop volumineux", 413
+            reader.feed(chunk)
+        reader.close()
+
+        if reader.empty:
+            log(f"[{request_id}] ❌ Champ 'messages' manquant")
+            return "messages manquants", 400
+        log(f"[{request_id}] 🔎 messages : {reader.size} octets lus en flux", level="DEBUG")
+
+        # ✅ Signature
+        if not DEBUG_MODE:
+            if not reader.verify(signature):
+                log(f"[{request_id}] ❌ Signature invalide (reçue: {signature})")
+                return "Signature invalide", 403
+            log(f"[{request_id}] ✅ Signature valide")
+
+        # ✅ Parsing JSON (validé pendant la lecture)
+        try:
+            count = reader.validate()
+        except NotAnArray:
+            log(f"[{request_id}] ❌ Format JSON non liste")
+            return "Liste attendue", 400
+        except ValueError as e:
+            log(f"[{request_id}] ❌ JSON invalide : {e}")
+            return "Format JSON invalide", 400
+        WEBHOOK_BATCH_SIZE.observe(count)
+
+        # ✅ Relecture élément par élément, filtrage et mise en file par lots
+        skipped = {"archived": 0, "duplicate": 0, "invalid": 0}
+        seen = set()
+        queued, failed, start = 0, [], 0
+        for batch in reader.batches(WEBHOOK_STREAM_BATCH, STREAM_READ_SIZE):
+            if EARLY_DEDUP:
+                pending, counts = filter_new_messages(redis_conn, batch, start=start, seen=seen)
+                for reason, reason_count in counts.items():
+                    skipped[reason] += reason_count
+            else:
+                pending = list(enumerate(batch, start))
+            batch_queued, batch_failed = enqueue_pending(request_id, pending)
+            queued += batch_queued
+            failed.extend(batch_failed)
+            start += len(batch)
+
+    for reason, count in skipped.items():
+        if count:
+            WEBHOOK_MESSAGES.labels(reason).inc(count)
+    if sum(skipped.values()):
+        log(f"[{request_id}] 🧹 {sum(skipped.values())} message(s) écarté(s) : {skipped}")
+    log(f"[{request_id}] 🏁 {queued}/{count} messages en file (lecture en flux)")
+    return jsonify({"status": "OK", "queued": queued, "skipped": skipped, "failed": failed}), 200
+
 @app.route('/logs')
 def logs():
-    if not os.path.exists(LOG_FILE):
+    if not log_files():
         return Response("Aucun log", mimetype='text/plain')
-    with open(LOG_FILE, 'r', encoding='utf-8') as f:
-        return Response(f.read(), mimetype='text/plain')
+
+    tail = request.args.get("tail", type=int)
+    since = request.args.get("since")
+    request_id_filter = request.args.get("request_id")
+    try:
+        since = parse_since(since) if since else None
+    except ValueError:
+        return "Paramètre since invalide (epoch ou ISO 8601)", 400
+    if tail is not None and tail < 0:
+        return "Paramètre tail invalide", 400
+
+    # 🚿 Réponse en streaming : le fichier n'est jamais chargé en entier
+    return Response(iter_logs(since=since, request_id=request_id_filter, tail=tail), mimetype='text/plain')
+
+@app.route('/metrics')
+@token_required(METRICS_TOKEN)
+def metrics():
+    # 📈 Agrégé sur tous les process (gunicorn, Celery) via PROMETHEUS_MULTIPROC_DIR
+    body, content_type = render_metrics(redis_conn)
+    return Response(body, content_type=content_type)
+
+@app.route('/traces')
+@admin_only
+def traces():
+    # 🐢 Messages lents (au-delà de TRACE_SLOW_THRESHOLD) avec le détail de leurs étapes
+    limit = request.args.get("limit", default=50, type=int)
+    min_ms = request.args.get("min_ms", type=float)
+    if limit is None or limit <= 0:
+        return "Paramètre limit invalide", 400
+    return jsonify(recent_traces(redis_conn, limit=limit, request_id=request.args.get("request_id"),
+                                 min_duration_ms=min_ms))
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+@admin_only
+def admin_profile():
+    # 🔥 Profilage à la demande de process_message et /sms_auto_reply, dans tous les process
+    if request.method == "POST":
+        seconds = request.args.get("seconds", default=60, type=float)
+        invocations = request.args.get("invocations", default=0, type=int)
+        if seconds is None or seconds <= 0 or invocations is None or invocations < 0:
+            return "Paramètres seconds / invocations invalides", 400
+        session = start_session(redis_conn, seconds, invocations)
+        log(f"🔥 Session de profilage {session['id']} publiée ({seconds:.0f}s, {invocations or 'tous les'} appels)")
+        return jsonify(session), 201
+    if request.method == "DELETE":
+        return jsonify({"stopped": stop_session(redis_conn)})
+    session = current_session(redis_conn)
+    session_id = request.args.get("session") or (session or {}).get("id") or last_session_id(redis_conn)
+    return jsonify({"active": session, "session": session_id,
+                    "processes": session_processes(redis_conn, session_id) if session_id else {},
+                    "poll_interval": profiler.poll_interval})
+
+@app.route('/admin/profile/download')
+@admin_only
+def admin_profile_download():
+    # 📥 Piles au format collapsed (flamegraph.pl, speedscope), tous process confondus ou un seul
+    session_id = request.args.get("session") or last_session_id(redis_conn)
+    process = request.args.get("process")
+    text = collapsed_stacks(redis_conn, session_id, process) if session_id else None
+    if text is None:
+        return "Profil introuvable", 404
+    filename = f"{session_id}-{process or 'all'}.collapsed"
+    return Response(text, mimetype='text/plain',
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000)
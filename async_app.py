@@ -0,0 +1,163 @@
+"""Point d'entrée asynchrone du webhook (aiohttp), alternative à `app.py` sous gunicorn sync.
+
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+
+Routes `/sms_auto_reply` et `/logs`, mêmes signature, codes et corps de
+réponse que l'app Flask (réglages repris de `app.py`). Le corps est lu en
+flux (`webhook_stream.SignedFieldReader`) et la mise en file passe par un
+client redis.asyncio : un worker sert de nombreuses requêtes à la fois au
+lieu d'être bloqué par chacune.
+"""
+import uuid
+import asyncio
+import itertools
+from aiohttp import web
+from redis_client import create_async_redis
+from logger import log, log_files, iter_logs, parse_since
+from dedup import filter_new_messages_async
+from enqueue import enqueue_batch_async
+from pipeline import ENTRY_TASK, ENTRY_QUEUE
+from webhook_stream import NotAnArray, SignedFieldReader
+from metrics import WEBHOOK_LATENCY, WEBHOOK_BATCH_SIZE, WEBHOOK_MESSAGES
+from app import (
+    API_KEY, DEBUG_MODE, EARLY_DEDUP, STREAM_READ_SIZE, WEBHOOK_MAX_PAYLOAD,
+    WEBHOOK_SPOOL_MEMORY, WEBHOOK_STREAM_BATCH, enqueue_jobs, record_enqueue_results,
+)
+
+LOG_LINES_PER_READ = 500
+
+
+async def sms_auto_reply(request):
+    with WEBHOOK_LATENCY.time():
+        request_id = str(uuid.uuid4())[:8]
+        log(f"\n📩 [{request_id}] Nouvelle requête POST reçue (async)")
+        return await handle_webhook(request, request_id)
+
+
+async def handle_webhook(request, request_id):
+    if request.content_length and request.content_length > WEBHOOK_MAX_PAYLOAD:
+        log(f"[{request_id}] ❌ Payload trop volumineux ({request.content_length} octets)")
+        return web.Response(text="Payload trop volumineux", status=413)
+
+    signature = request.headers.get("X-SG-SIGNATURE")
+    if not DEBUG_MODE and not signature:
+        log(f"[{request_id}] ❌ Signature manquante")
+        return web.Response(text="Signature requise", status=403)
+
+    with SignedFieldReader("messages", None if DEBUG_MODE else API_KEY, WEBHOOK_SPOOL_MEMORY) as reader:
+        if request.content_type == "application/x-www-form-urlencoded":
+            received = 0
+            async for chunk in request.content.iter_chunked(STREAM_READ_SIZE):
+                received += len(chunk)
+                if received > WEBHOOK_MAX_PAYLOAD:
+                    log(f"[{request_id}] ❌ Payload trop volumineux (> {WEBHOOK_MAX_PAYLOAD} octets)")
+                    return web.Response(text="Payload trop volumineux", status=413)
+                reader.feed(chunk)
+            reader.close()
+        else:
+            # multipart : aiohttp extrait le champ (taille bornée par client_max_size)
+            value = (await request.post()).get("messages")
+            if isinstance(value, str) and value:
+                reader.feed_value(value.encode())
+
+        if reader.empty:
+            log(f"[{request_id}] ❌ Champ 'messages' manquant")
+            return web.Response(text="messages manquants", status=400)
+
+        # ✅ Signature
+        if not DEBUG_MODE:
+            if not reader.verify(signature):
+                log(f"[{request_id}] ❌ Signature invalide (reçue: {signature})")
+                return web.Response(text="Signature invalide", status=403)
+            log(f"[{request_id}] ✅ Signature valide")
+
+        # ✅ Parsing JSON (validé pendant la lecture)
+        try:
+            count = reader.validate()
+        except NotAnArray:
+            log(f"[{request_id}] ❌ Format JSON non liste")
+            return web.Response(text="Liste attendue", status=400)
+        except ValueError as e:
+            log(f"[{request_id}] ❌ JSON invalide : {e}")
+            return web.Response(text="Format JSON invalide", status=400)
+        WEBHOOK_BATCH_SIZE.observe(count)
+
+        # ✅ Filtrage et mise en file par lots, un pipeline redis.asyncio par lot
+        redis_conn = request.app["redis"]
+        skipped = {"archived": 0, "duplicate": 0, "invalid": 0}
+        seen = set()
+        queued, failed, start = 0, [], 0
+        for batch in reader.batches(WEBHOOK_STREAM_BATCH, STREAM_READ_SIZE):
+            if EARLY_DEDUP:
+                pending, counts = await filter_new_messages_async(redis_conn, batch, start=start, seen=seen)
+                for reason, reason_count in counts.items():
+                    skipped[reason] += reason_count
+            else:
+                pending = list(enumerate(batch, start))
+            results = await enqueue_batch_async(redis_conn, ENTRY_TASK.name, enqueue_jobs(pending),
+                                                queue=ENTRY_QUEUE, headers={"request_id": request_id})
+            batch_queued, batch_failed = record_enqueue_results(request_id, pending, results)
+            queued += batch_queued
+            failed.extend(batch_failed)
+            start += len(batch)
+
+    for reason, reason_count in skipped.items():
+        if reason_count:
+            WEBHOOK_MESSAGES.labels(reason).inc(reason_count)
+    if sum(skipped.values()):
+        log(f"[{request_id}] 🧹 {sum(skipped.values())} message(s) écarté(s) : {skipped}")
+    log(f"[{request_id}] 🏁 {queued}/{count} messages en file (async)")
+    return web.json_response({"status": "OK", "queued": queued, "skipped": skipped, "failed": failed})
+
+
+async def logs(request):
+    if not log_files():
+        return web.Response(text="Aucun log")
+
+    try:
+        tail = int(request.query["tail"]) if "tail" in request.query else None
+    except ValueError:
+        tail = None  # comme `type=int` de Flask : valeur ignorée
+    since = request.query.get("since")
+    try:
+        since = parse_since(since) if since else None
+    except ValueError:
+        return web.Response(text="Paramètre since invalide (epoch ou ISO 8601)", status=400)
+    if tail is not None and tail < 0:
+        return web.Response(text="Paramètre tail invalide", status=400)
+
+    # 🚿 Lecture des fichiers dans un thread, par paquets de lignes, envoyés au fil de l'eau
+    response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+    await response.prepare(request)
+    lines = iter_logs(since=since, request_id=request.query.get("request_id"), tail=tail)
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, lambda: "".join(itertools.islice(lines, LOG_LINES_PER_READ)))
+        if not chunk:
+            break
+        await response.write(chunk.encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def _open_redis(application):
+    application["redis"] = create_async_redis()
+
+
+async def _close_redis(application):
+    await application["redis"].close()
+
+
+def create_app():
+    application = web.Application(client_max_size=WEBHOOK_MAX_PAYLOAD)
+    application.router.add_post("/sms_auto_reply", sms_auto_reply)
+    application.router.add_get("/logs", logs)
+    application.on_startup.append(_open_redis)
+    application.on_cleanup.append(_close_redis)
+    return application
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    web.run_app(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,355 @@
+"""Moteur d'exécution asyncio pour process_message.
+
+Consomme la même file Redis que le worker Celery (messages au format kombu,
+voir `enqueue.build_task_message`) mais traite jusqu'à
+ASYNC_WORKER_CONCURRENCY messages en parallèle sur une boucle d'événements :
+réservation / validation Redis via `redis.asyncio`, envoi du SMS via aiohttp.
+La résolution du nom (cache, MySQL, API de contacts) reste synchrone et part
+dans un pool de threads borné.
+
+    python async_worker.py
+
+Fiabilité : chaque message est déplacé atomiquement (BRPOPLPUSH) dans une
+liste `async_worker:processing:{nom}` et n'en sort qu'une fois traité. Au
+démarrage puis toutes les ASYNC_REAP_INTERVAL secondes, les listes des
+workers dont le battement de cœur a expiré sont remises en file. Les messages
+illisibles ou d'une tâche inconnue vont dans `async_worker:dead:{file}`.
+Un message à ETA pas encore dû part dans le ZSET `delayed:{file}` sans
+occuper de place ; l'ordonnanceur le remet en file à l'échéance, ou le worker
+lui-même (même script Lua) quand aucun ordonnanceur ne tourne.
+Les résultats de tâche ne sont pas stockés (process_message ne renvoie rien).
+"""
+import os
+import time
+import signal
+import socket
+import asyncio
+import functools
+import contextvars
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from logger import log, shutdown_logging
+from claim import AsyncConversationClaims
+from enqueue import decode_task_message, enqueue_batch_async
+from scheduler import (
+    MOVE_DUE_LUA, SCHEDULER_BATCH_SIZE, SCHEDULER_POLL_INTERVAL, delayed_key, scheduler_enabled_async,
+)
+from metrics import PROCESS_MESSAGES, stage, start_exporter
+from tracing import trace, current_trace, save_async
+from profiler import profiled
+from http_client import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_SIZE
+from db_pool import DB_POOL_SIZE
+from redis_client import create_async_redis
+from celery_worker import celery
+import tasks
+
+ASYNC_WORKER_QUEUE = os.getenv("ASYNC_WORKER_QUEUE") or celery.conf.task_default_queue
+ASYNC_WORKER_CONCURRENCY = int(os.getenv("ASYNC_WORKER_CONCURRENCY", "100"))
+ASYNC_WORKER_NAME = os.getenv("ASYNC_WORKER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+ASYNC_NAME_THREADS = int(os.getenv("ASYNC_NAME_THREADS", str(DB_POOL_SIZE)))
+ASYNC_HTTP_POOL_SIZE = int(os.getenv("ASYNC_HTTP_POOL_SIZE", str(max(HTTP_POOL_SIZE, 100))))
+ASYNC_SHUTDOWN_TIMEOUT = float(os.getenv("ASYNC_SHUTDOWN_TIMEOUT", "30"))
+ASYNC_REAP_INTERVAL = float(os.getenv("ASYNC_REAP_INTERVAL", "60"))
+
+PROCESSING_KEY = "async_worker:processing:{}"
+ALIVE_KEY = "async_worker:alive:{}"
+DEAD_LETTER_KEY = "async_worker:dead:{}"
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TTL = 30
+
+
+class AsyncWorker:
+    """Boucle de consommation : un sémaphore borne les messages en vol"""
+
+    def __init__(self, redis_conn, queue=ASYNC_WORKER_QUEUE, concurrency=ASYNC_WORKER_CONCURRENCY,
+                 name=ASYNC_WORKER_NAME):
+        self.redis_conn = redis_conn
+        self.queue = queue
+        self.name = name
+        self.processing_key = PROCESSING_KEY.format(name)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.claims = AsyncConversationClaims(redis_conn)
+        self._move_due = redis_conn.register_script(MOVE_DUE_LUA)
+        self.executor = ThreadPoolExecutor(max_workers=ASYNC_NAME_THREADS, thread_name_prefix="contact-name")
+        self.handlers = {tasks.process_message.name: self.process_message}
+        self.session = None
+        self.in_flight = set()
+        self.stopping = asyncio.Event()
+        self.counters = {"done": 0, "failed": 0, "requeued": 0, "dead": 0, "delayed": 0}
+
+    async def run(self):
+        import aiohttp
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASYNC_HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+        )
+        heartbeat = asyncio.create_task(self._heartbeat())
+        delivery = asyncio.create_task(self._deliver_due())
+        try:
+            await self._beat()
+            await self.recover_orphans()
+            log(f"⚡ Worker async {self.name} prêt : file {self.queue}, {self.concurrency} messages en parallèle")
+            await self._consume()
+        finally:
+            await self._drain()
+            heartbeat.cancel()
+            delivery.cancel()
+            await self.session.close()
+            self.executor.shutdown(wait=False)
+            await self.redis_conn.delete(ALIVE_KEY.format(self.name))
+            log(f"⚡ Worker async {self.name} arrêté : {self.counters}")
+
+    def stop(self):
+        self.stopping.set()
+
+    async def recover_orphans(self, include_self=True):
+        """Remet en file les messages des workers async disparus en cours de traitement.
+
+        `include_self` : au démarrage, reprend aussi la liste d'une exécution
+        précédente sous le même nom ; jamais pendant le service (messages en vol).
+        """
+        recovered = 0
+        async for key in self.redis_conn.scan_iter(match=PROCESSING_KEY.format("*")):
+            key = key.decode() if isinstance(key, bytes) else key
+            owner = key[len(PROCESSING_KEY.format("")):]
+            if owner == self.name:
+                if not include_self:
+                    continue
+            elif await self.redis_conn.exists(ALIVE_KEY.format(owner)):
+                continue
+            while await self.redis_conn.rpoplpush(key, self.queue) is not None:
+                recovered += 1
+        if recovered:
+            log(f"♻️ {recovered} message(s) orphelin(s) remis en file {self.queue}", level="WARNING")
+        return recovered
+
+    async def _consume(self):
+        while not self.stopping.is_set():
+            await self.semaphore.acquire()
+            try:
+                raw = await self.redis_conn.brpoplpush(self.queue, self.processing_key, timeout=1)
+            except Exception as e:
+                self.semaphore.release()
+                log(f"❌ Lecture de la file {self.queue} impossible : {e}", level="ERROR")
+                await asyncio.sleep(1)
+                continue
+            if raw is None:
+                self.semaphore.release()
+                continue
+            task = asyncio.create_task(self._handle(raw))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _handle(self, raw):
+        """Exécute un message puis l'acquitte (le retire de la liste de traitement)"""
+        ack, current = True, None
+        try:
+            try:
+                headers, args, kwargs = decode_task_message(raw)
+            except Exception as e:
+                ack = False
+                await self.dead_letter(raw, f"message illisible : {e}")
+                return
+            handler = self.handlers.get(headers.get("task"))
+            if handler is None:
+                # Le remettre dans la même file le ferait relire aussitôt par ce worker
+                ack = False
+                await self.dead_letter(raw, f"tâche {headers.get('task')} non gérée par le worker async")
+                return
+            delay = _eta_delay(headers.get("eta"))
+            if delay > 0:
+                # Pas d'attente en mémoire ni de place occupée : retour à l'échéance via le ZSET
+                ack = False
+                await self.defer(raw, delay)
+                return
+            with trace(headers.get("task"), request_id=headers.get("request_id")) as current:
+                await handler(*args, **kwargs)
+            self.counters["done"] += 1
+        except asyncio.CancelledError:
+            # Arrêt forcé : le message reste dans la liste de traitement
+            ack = False
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            PROCESS_MESSAGES.labels("error").inc()
+            log(f"💥 Worker async : message en échec : {e}", level="ERROR")
+        finally:
+            self.semaphore.release()
+            if current is not None and current.slow:
+                await save_async(self.redis_conn, current)
+            if ack:
+                try:
+                    await self.redis_conn.lrem(self.processing_key, 1, raw)
+                except Exception as e:
+                    log(f"⚠️ Acquittement impossible : {e}", level="WARNING")
+
+    async def dead_letter(self, raw, reason):
+        """Sort le message de la liste de traitement vers `async_worker:dead:{file}`"""
+        pipe = self.redis_conn.pipeline(transaction=True)
+        pipe.lpush(DEAD_LETTER_KEY.format(self.queue), raw)
+        pipe.lrem(self.processing_key, 1, raw)
+        await pipe.execute()
+        self.counters["dead"] += 1
+        log(f"☠️ Worker async : {reason}, message mis de côté dans {DEAD_LETTER_KEY.format(self.queue)}",
+            level="ERROR")
+
+    async def defer(self, raw, delay):
+        """Déplace un message à ETA dans le ZSET de l'ordonnanceur, qui le remettra en file à l'échéance"""
+        pipe = self.redis_conn.pipeline(transaction=True)
+        pipe.zadd(delayed_key(self.queue), {raw: time.time() + delay})
+        pipe.lrem(self.processing_key, 1, raw)
+        await pipe.execute()
+        self.counters["delayed"] += 1
+
+    async def process_message(self, *args):
+        """Même déroulé que `tasks.process_message`, avec des appels non bloquants"""
+        parsed = tasks.parse_message(*args)
+        if parsed is None:
+            return
+        number, msg_id, device_id = parsed
+        msg_id_short = tasks.short_id(msg_id)
+
+        token = None
+        try:
+            with stage("claim"):
+                status, step, token = await self.claims.claim(number, msg_id, device_id)
+            if status != "ok":
+                PROCESS_MESSAGES.labels(status).inc()
+            if status == "archived":
+                log(f"🗃️ [{msg_id_short}] Numéro archivé, ignoré.")
+                return
+            if status == "processed":
+                log(f"🔁 [{msg_id_short}] Message déjà traité, ignoré.")
+                return
+            if status == "claimed":
+                token = None
+                log(f"🔒 [{msg_id_short}] Numéro en cours de traitement, nouvel essai dans {tasks.CLAIM_RETRY_DELAY}s.")
+                await self.schedule_retry(tasks.task_args(number, msg_id, device_id), tasks.CLAIM_RETRY_DELAY)
+                self.counters["requeued"] += 1
+                return
+            if step != 0:
+                log(f"🗃️ [{msg_id_short}] Conversation déjà traitée, ignoré.")
+                PROCESS_MESSAGES.labels("already_handled").inc()
+                return
+
+            loop = asyncio.get_running_loop()
+            with stage("contact_lookup"):
+                # copy_context : les spans du thread s'accrochent à la trace du message ;
+                # seule partie profilée ici (la boucle asyncio ne l'est pas, voir profiler)
+                lookup = functools.partial(contextvars.copy_context().run,
+                                           profiled("contact_lookup")(tasks.get_contact_name), number)
+                contact_name = await loop.run_in_executor(self.executor, lookup)
+            with stage("send"):
+                await self.send_single_message(number, tasks.build_reply(contact_name or "default"), device_id)
+            with stage("commit"):
+                await self.claims.commit(number, msg_id, token)
+            token = None
+            PROCESS_MESSAGES.labels("sent").inc()
+            log(f"✅ [{msg_id_short}] Réponse envoyée et conversation archivée.")
+        finally:
+            if token is not None:
+                try:
+                    await self.claims.release(number, token)
+                except Exception as e:
+                    log(f"⚠️ [{msg_id_short}] Libération de la réservation impossible : {e}", level="WARNING")
+
+    async def schedule_retry(self, args, countdown):
+        """Remise en file différée : ZSET de l'ordonnanceur s'il tourne, sinon ETA"""
+        current = current_trace()
+        headers = {"request_id": current.request_id} if current and current.request_id else None
+        _, error = (await enqueue_batch_async(
+            self.redis_conn, tasks.process_message.name, [(args, countdown)], queue=self.queue, headers=headers))[0]
+        if error is not None:
+            raise error
+
+    async def send_single_message(self, number, message, device_slot):
+        """POST vers send.php, jamais rejoué (comme `tasks.send_request`)"""
+        log(f"📦 Envoi à {number} via SIM {device_slot}")
+        try:
+            async with self.session.post(f"{tasks.SERVER}/services/send.php", data={
+                'number': number,
+                'message': message,
+                'devices': device_slot,
+                'type': 'mms',
+                'prioritize': 1,
+                'key': tasks.API_KEY,
+            }) as response:
+                data = await response.json(content_type=None)
+                return data.get("data")
+        except Exception as e:
+            log(f"❌ Erreur POST : {e}", level="ERROR")
+            return None
+
+    async def _deliver_due(self):
+        """Remet en file les messages différés dus quand aucun ordonnanceur ne le fait"""
+        while True:
+            await asyncio.sleep(SCHEDULER_POLL_INTERVAL)
+            try:
+                if not await scheduler_enabled_async(self.redis_conn):
+                    await self._move_due(keys=[delayed_key(self.queue), self.queue],
+                                         args=[time.time(), SCHEDULER_BATCH_SIZE])
+            except Exception as e:
+                log(f"⚠️ Livraison des messages différés impossible : {e}", level="WARNING")
+                await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        next_reap = time.monotonic() + ASYNC_REAP_INTERVAL
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._beat()
+            except Exception as e:
+                log(f"⚠️ Battement de cœur impossible : {e}", level="WARNING")
+            if time.monotonic() >= next_reap:
+                next_reap = time.monotonic() + ASYNC_REAP_INTERVAL
+                try:
+                    await self.recover_orphans(include_self=False)
+                except Exception as e:
+                    log(f"⚠️ Reprise des messages orphelins impossible : {e}", level="WARNING")
+
+    async def _beat(self):
+        await self.redis_conn.set(ALIVE_KEY.format(self.name), int(time.time()), ex=HEARTBEAT_TTL)
+
+    async def _drain(self):
+        if not self.in_flight:
+            return
+        log(f"⏳ Attente de {len(self.in_flight)} message(s) en vol…")
+        done, pending = await asyncio.wait(self.in_flight, timeout=ASYNC_SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Restés dans la liste de traitement : repris au prochain démarrage
+            log(f"⚠️ {len(pending)} message(s) interrompu(s), repris au prochain démarrage", level="WARNING")
+
+
+def _eta_delay(eta):
+    if not eta:
+        return 0
+    due = datetime.fromisoformat(eta)
+    if due.tzinfo is None:
+        due = due.replace(tzinfo=timezone.utc)
+    return max(0.0, (due - datetime.now(timezone.utc)).total_seconds())
+
+
+async def main():
+    tasks._init_worker_db_pool()  # même initialisation qu'un process enfant Celery
+    tasks.start_index_refresher()
+    start_exporter(redis_conn=tasks.redis_conn)
+    redis_conn = create_async_redis()
+    worker = AsyncWorker(redis_conn)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await redis_conn.close()
+        tasks.stop_index_refresher()
+        tasks._close_worker_clients()
+        shutdown_logging()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+"""Benchmark : /sms_auto_reply sous gunicorn sync (app.py) contre aiohttp (async_app.py).
+
+Même nombre de workers gunicorn pour les deux déploiements ; un client
+aiohttp envoie des requêtes signées (numéros tous différents) avec une forte
+concurrence et mesure requêtes/s et latences p50/p99. Les messages sont mis
+en file sans être consommés. Nécessite un Redis local et vide la base
+utilisée : ne pas pointer vers la production.
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_async_webhook.py --concurrency 200
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import socket
+import asyncio
+import hashlib
+import argparse
+import subprocess
+import urllib.parse
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("LOG_CONSOLE", "false")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+API_KEY = "bench-key"
+SERVERS = {
+    "sync": ["app:app"],
+    "async": ["async_app:app", "--worker-class", "aiohttp.GunicornWebWorker"],
+}
+
+
+def signed_body(request_index, batch):
+    messages = json.dumps([
+        {"ID": request_index * batch + i + 1, "number": f"+336{request_index * batch + i:08d}", "deviceID": 1,
+         "message": "Bonjour, je voudrais un rendez-vous"}
+        for i in range(batch)
+    ])
+    signature = base64.b64encode(hmac.new(API_KEY.encode(), messages.encode(), hashlib.sha256).digest()).decode()
+    return urllib.parse.urlencode({"messages": messages}).encode(), signature
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"serveur absent sur le port {port}")
+
+
+async def load(url, requests, batch, concurrency):
+    import aiohttp
+
+    bodies = [signed_body(i, batch) for i in range(requests)]
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for item in bodies:
+        queue.put_nowait(item)
+
+    async def client(session):
+        nonlocal errors
+        while not queue.empty():
+            body, signature = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers={
+                        "X-SG-SIGNATURE": signature, "Content-Type": "application/x-www-form-urlencoded"}) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000  # noqa: E731
+    return requests / elapsed, p(0.5), p(0.99), errors
+
+
+def run(server, args, env, redis_conn):
+    redis_conn.flushdb()
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", *SERVERS[server], "-c", "gunicorn.conf.py",
+         "-b", f"127.0.0.1:{port}", "-w", str(args.workers), "--backlog", "2048"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/sms_auto_reply"
+        asyncio.run(load(url, min(50, args.requests), args.batch, 10))  # échauffement
+        redis_conn.flushdb()
+        return asyncio.run(load(url, args.requests, args.batch, args.concurrency))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=5, help="messages par requête")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2, help="workers gunicorn")
+    parser.add_argument("--servers", default="sync,async")
+    args = parser.parse_args()
+
+    from redis import Redis
+
+    env = {**os.environ, "API_KEY": API_KEY, "LOG_LEVEL": "WARNING", "DEBUG_MODE": "false"}
+    redis_conn = Redis.from_url(os.environ["REDIS_URL"])
+    print(f"{args.requests} requêtes de {args.batch} messages, {args.concurrency} clients, "
+          f"{args.workers} workers gunicorn")
+    print(f"{'serveur':>8} | {'débit':>12} | {'p50':>9} | {'p99':>9} | erreurs")
+    for server in args.servers.split(","):
+        rate, p50, p99, errors = run(server, args, env, redis_conn)
+        print(f"{server:>8} | {rate:7.0f} req/s | {p50:6.1f} ms | {p99:6.1f} ms | {errors}")
+    redis_conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
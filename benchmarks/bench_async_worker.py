@@ -0,0 +1,121 @@
+"""Benchmark : débit de process_message, worker Celery prefork contre worker async.
+
+Une passerelle factice locale (latence réglable) remplace send.php ; les noms
+de contacts sont préchargés dans le cache Redis pour que seule la partie
+I/O Redis + HTTP soit mesurée. Chaque moteur traite N messages mis en file
+sans délai sur une file dédiée, jusqu'à ce que tous les numéros soient archivés.
+Nécessite un Redis local et vide la base utilisée : ne pas pointer vers la production.
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_async_worker.py --messages 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("LOG_CONSOLE", "false")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from redis import Redis  # noqa: E402
+from contact_cache import ContactNameCache  # noqa: E402
+from dedup import store as dedup_store  # noqa: E402
+from enqueue import enqueue_batch  # noqa: E402
+
+QUEUE = "bench_async"
+
+
+class FakeGateway(BaseHTTPRequestHandler):
+    latency = 0.2
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.latency)
+        body = b'{"data": {"queued": true}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_gateway(latency):
+    FakeGateway.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGateway)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def prepare(redis_conn, count):
+    redis_conn.flushdb()
+    cache = ContactNameCache(redis_conn)
+    jobs = []
+    for i in range(count):
+        number = f"+3361{i:07d}"
+        cache.set(number, f"contact{i}")
+        jobs.append(([json.dumps({"ID": i + 1, "number": number, "deviceID": 1, "message": "Bonjour"})], None))
+    for i in range(0, count, 1000):
+        enqueue_batch(redis_conn, "process_message", jobs[i:i + 1000], queue=QUEUE)
+
+
+def archived(redis_conn):
+    return sum(redis_conn.scard(key) for key in dedup_store.archive_keys())
+
+
+def run(engine, count, concurrency, env, redis_conn, timeout):
+    prepare(redis_conn, count)
+    if engine == "celery":
+        cmd = [sys.executable, "-m", "celery", "-A", "celery_worker", "worker", "-Q", QUEUE,
+               "-P", "prefork", "-c", str(concurrency), "--loglevel=warning",
+               "--without-mingle", "--without-gossip", "--without-heartbeat"]
+    else:
+        cmd = [sys.executable, "async_worker.py"]
+        env = {**env, "ASYNC_WORKER_QUEUE": QUEUE, "ASYNC_WORKER_CONCURRENCY": str(concurrency)}
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Le chrono démarre au premier message traité : le temps de démarrage n'est pas compté
+        deadline = time.monotonic() + timeout
+        while archived(redis_conn) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        start, first = time.perf_counter(), archived(redis_conn)
+        while archived(redis_conn) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        done = archived(redis_conn)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+    return done, (done - first) / elapsed if elapsed else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2, help="latence de la passerelle factice (s)")
+    parser.add_argument("--celery-concurrency", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--async-concurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    gateway = start_gateway(args.latency)
+    env = {**os.environ, "SERVER": f"http://127.0.0.1:{gateway.server_port}", "API_KEY": "bench",
+           "SECOND_MESSAGE_LINK": "example.org", "LOG_LEVEL": "WARNING"}
+    redis_conn = Redis.from_url(os.environ["REDIS_URL"])
+
+    print(f"{args.messages} messages, passerelle à {args.latency * 1000:.0f} ms")
+    for engine, concurrency in (("celery", args.celery_concurrency), ("async", args.async_concurrency)):
+        done, rate = run(engine, args.messages, concurrency, env, redis_conn, args.timeout)
+        print(f"{engine:>7} (concurrence {concurrency:>4}) : {rate:8.1f} msg/s  ({done}/{args.messages} traités)")
+    redis_conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark : profils CELERY_PROFILE du worker Celery.
+
+Pour chaque profil, le worker est lancé sans -P ni -c (pool et concurrence
+viennent du profil) sur une file dédiée, avec la passerelle factice et les
+noms préchargés de bench_async_worker. Mesure le débit, le pic de RSS du
+worker (process principal + enfants) et le nombre de clés de résultats
+`celery-task-meta-*` laissées dans Redis.
+Nécessite un Redis local et vide la base utilisée : ne pas pointer vers la production.
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_celery_profiles.py --messages 2000
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from bench_async_worker import QUEUE, ROOT, archived, prepare, start_gateway
+from bench_scheduler import tree_rss_mb
+
+from redis import Redis
+from celery_profiles import PROFILES
+
+
+def result_keys(redis_conn):
+    return sum(1 for _ in redis_conn.scan_iter("celery-task-meta-*", count=1000))
+
+
+def run(profile, count, env, redis_conn, timeout):
+    prepare(redis_conn, count)
+    cmd = [sys.executable, "-m", "celery", "-A", "celery_worker", "worker", "-Q", QUEUE,
+           "--loglevel=warning", "--without-mingle", "--without-gossip", "--without-heartbeat"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**env, "CELERY_PROFILE": profile},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    peak = 0.0
+    try:
+        deadline = time.monotonic() + timeout
+        while archived(redis_conn) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        start, first = time.perf_counter(), archived(redis_conn)
+        while archived(redis_conn) < count and time.monotonic() < deadline:
+            peak = max(peak, tree_rss_mb(proc.pid))
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        done = archived(redis_conn)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+    return done, (done - first) / elapsed if elapsed else 0.0, peak, result_keys(redis_conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2, help="latence de la passerelle factice (s)")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    gateway = start_gateway(args.latency)
+    env = {**os.environ, "SERVER": f"http://127.0.0.1:{gateway.server_port}", "API_KEY": "bench",
+           "SECOND_MESSAGE_LINK": "example.org", "LOG_LEVEL": "WARNING"}
+    env.pop("CELERY_CONCURRENCY", None)
+    env.pop("CELERY_PREFETCH_MULTIPLIER", None)
+    redis_conn = Redis.from_url(os.environ["REDIS_URL"])
+
+    print(f"{args.messages} messages, passerelle à {args.latency * 1000:.0f} ms")
+    print(f"{'profil':>12} | {'débit':>12} | {'pic RSS':>9} | {'résultats':>9}")
+    for profile in args.profiles.split(","):
+        done, rate, peak, results = run(profile, args.messages, env, redis_conn, args.timeout)
+        print(f"{profile:>12} | {rate:6.1f} msg/s | {peak:6.0f} Mo | {results:>9}"
+              f"  ({done}/{args.messages} traités)")
+    redis_conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Benchmark : cascade historique de 4 requêtes vs recherche indexée ContactNumberIndex.
+
+Table Contact synthétique dans SQLite (en mémoire), 1M de contacts par défaut :
+    python benchmarks/bench_contact_lookup.py [--contacts 1000000] [--lookups 200]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from contact_index import LOOKUP_SQL, index_contacts, lookup_contact  # noqa: E402
+
+# Cascade telle qu'elle existait dans tasks.get_contact_name_from_db
+LEGACY_QUERIES = [
+    "SELECT name, number FROM Contact WHERE number = %s LIMIT 1",
+    "SELECT name, number FROM Contact WHERE number = %s LIMIT 1",
+    "SELECT name, number FROM Contact WHERE REPLACE(REPLACE(REPLACE(number, '+', ''), ' ', ''), '-', '') = %s LIMIT 1",
+    "SELECT name, number FROM Contact WHERE number LIKE %s LIMIT 1",
+]
+
+
+class SqliteCursor:
+    """Adapte un curseur sqlite3 à l'API pymysql/DictCursor utilisée par contact_index"""
+
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace("%s", "?"), params)
+
+    def executemany(self, sql, params):
+        self._cursor.executemany(sql.replace("%s", "?").replace("REPLACE INTO", "INSERT OR REPLACE INTO"), params)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [dict(row) for row in self._cursor.fetchall()]
+
+
+def format_number(i):
+    """Mélange de formats tels qu'on les trouve dans Contact"""
+    national = f"6{i:08d}"
+    style = i % 4
+    if style == 0:
+        return f"+33{national}"
+    if style == 1:
+        return f"0{national[:1]} {national[1:3]} {national[3:5]} {national[5:7]} {national[7:]}"
+    if style == 2:
+        return f"+33 {national[:1]}-{national[1:3]}-{national[3:5]}-{national[5:7]}-{national[7:]}"
+    return f"33{national}"
+
+
+def build_database(contacts):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE Contact (ID INTEGER PRIMARY KEY, name TEXT, number TEXT, "
+                 "contactsListID INTEGER, subscribed INTEGER)")
+    conn.execute("CREATE INDEX idx_contact_number ON Contact (number)")
+    conn.execute("CREATE TABLE ContactNumberIndex (contactID INTEGER PRIMARY KEY, "
+                 "number_normalized TEXT NOT NULL)")
+    conn.execute("CREATE INDEX idx_number_normalized ON ContactNumberIndex (number_normalized)")
+    conn.executemany(
+        "INSERT INTO Contact (ID, name, number, contactsListID, subscribed) VALUES (?, ?, ?, ?, 1)",
+        ((i, f"client{i}", format_number(i), i % 50) for i in range(1, contacts + 1)),
+    )
+    conn.commit()
+    return conn
+
+
+def legacy_lookup(cursor, number):
+    normalized_number = str(number).strip().replace("+", "").replace(" ", "").replace("-", "")
+    params = [[number], [normalized_number], [normalized_number], [f"%{normalized_number}%"]]
+    for query, query_params in zip(LEGACY_QUERIES, params):
+        cursor.execute(query, query_params)
+        result = cursor.fetchone()
+        if result and result.get("name"):
+            return result
+    return None
+
+
+def measure(label, lookup, cursor, numbers):
+    timings = []
+    found = 0
+    for number in numbers:
+        start = time.perf_counter()
+        if lookup(cursor, number):
+            found += 1
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{label:<22} trouvés {found:>5}/{len(numbers)}  "
+          f"moy {statistics.mean(timings):8.3f} ms  p50 {timings[len(timings) // 2]:8.3f} ms  p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--contacts", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    conn = build_database(args.contacts)
+    print(f"Table Contact : {args.contacts} lignes en {time.perf_counter() - start:.1f}s")
+
+    cursor = SqliteCursor(conn)
+    start = time.perf_counter()
+    indexed = index_contacts(cursor, after_id=0)
+    conn.commit()
+    print(f"Backfill ContactNumberIndex : {indexed} lignes en {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(42)
+    # Numéros reçus au format E.164 alors que la DB mélange les formats, plus 10 % d'inconnus
+    numbers = []
+    for _ in range(args.lookups):
+        if rng.random() < 0.1:
+            numbers.append(f"+447{rng.randrange(10**9):09d}")
+        else:
+            numbers.append(f"+33{6}{rng.randrange(1, args.contacts + 1):08d}")
+
+    measure("cascade 4 requêtes", legacy_lookup, cursor, numbers)
+    measure("index normalisé", lookup_contact, cursor, numbers)
+    print(f"Requête indexée : {LOOKUP_SQL}")
+
+
+if __name__ == '__main__':
+    main()
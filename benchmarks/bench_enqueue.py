@@ -0,0 +1,60 @@
+"""Benchmark : latence du webhook /sms_auto_reply selon la taille du lot.
+
+Compare la mise en file message par message (apply_async) et le pipeline
+Redis unique (BATCH_ENQUEUE). Nécessite un Redis local :
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_enqueue.py
+Les files de la base Redis utilisée sont vidées : ne pas pointer vers la production.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ["DEBUG_MODE"] = "true"  # pas de signature pour le benchmark
+os.environ.setdefault("LOG_CONSOLE", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as webapp  # noqa: E402
+
+
+def make_messages(count, offset=0):
+    return [
+        {"ID": offset + i, "number": f"+3361{offset + i:07d}", "deviceID": 1, "message": "Bonjour"}
+        for i in range(count)
+    ]
+
+
+def run(batch_enqueue, batch_size, repeats):
+    webapp.BATCH_ENQUEUE = batch_enqueue
+    client = webapp.app.test_client()
+    timings = []
+    for r in range(repeats):
+        payload = {"messages": json.dumps(make_messages(batch_size, r * batch_size))}
+        start = time.perf_counter()
+        response = client.post("/sms_auto_reply", data=payload)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.data
+        webapp.redis_conn.delete(webapp.celery.conf.task_default_queue)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1,10,50,100,500")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'lot':>6} | {'apply_async p50':>16} {'p99':>9} | {'pipeline p50':>13} {'p99':>9} | gain")
+    for size in (int(s) for s in args.sizes.split(",")):
+        old_p50, old_p99 = run(False, size, args.repeats)
+        new_p50, new_p99 = run(True, size, args.repeats)
+        print(f"{size:>6} | {old_p50:>13.2f} ms {old_p99:>6.2f} ms | {new_p50:>10.2f} ms {new_p99:>6.2f} ms "
+              f"| x{old_p50 / new_p50:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark : coût de `profiler.profiled` hors session et pendant une session.
+
+Compare un appel nu, le même appel dans une section profilée sans session
+(cas de la production), et pendant une session d'échantillonnage locale.
+Le thread de lecture de la session tourne pendant la mesure, toutes les
+PROFILE_POLL_INTERVAL secondes (0,05 s ici, bien plus souvent qu'en production).
+Échoue (code 1) si le surcoût hors session dépasse --max-off-overhead-us par
+appel. Redis n'est pas nécessaire (la lecture de la session échoue sans bruit) :
+    python benchmarks/bench_profiler.py [--calls 200000]
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("LOG_CONSOLE", "false")
+os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:1/0")  # injoignable : pas de session distante
+os.environ.setdefault("REDIS_CONNECT_TIMEOUT", "0.05")
+os.environ.setdefault("REDIS_RETRIES", "0")
+os.environ.setdefault("PROFILE_DIR", "/tmp/bench_profiles")
+os.environ.setdefault("PROFILE_POLL_INTERVAL", "0.05")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from profiler import profiled, profiler  # noqa: E402
+
+
+def work(n):
+    """Petit travail CPU (~quelques µs), comme une étape courte de process_message"""
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+
+@profiled("bench")
+def work_decorated(n):
+    return work(n)
+
+
+def work_with(n):
+    with profiled("bench"):
+        return work(n)
+
+
+def per_call_us(func, calls, n):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func(n)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def best_of(func, calls, n, repeat=5):
+    return min(per_call_us(func, calls, n) for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--work", type=int, default=20, help="itérations de la boucle de travail par appel")
+    parser.add_argument("--max-off-overhead-us", type=float, default=5.0,
+                        help="seuil (process_message dure plusieurs ms)")
+    args = parser.parse_args()
+
+    profiler.enabled()  # démarre le thread de lecture de la session, qui tourne pendant toute la mesure
+    time.sleep(3 * profiler.poll_interval)
+    assert profiler.session is None
+
+    bare = best_of(work, args.calls, args.work)
+    rows = [("appel nu", bare)]
+    off = {}
+    for label, func in (("décorateur", work_decorated), ("bloc with", work_with)):
+        off[label] = best_of(func, args.calls, args.work)
+        rows.append((f"{label}, hors session", off[label]))
+
+    profiler.start({"id": "bench", "seconds": 0, "invocations": 0})
+    on = best_of(work_decorated, args.calls // 4, args.work, repeat=3)
+    samples = profiler.samples
+    path = profiler.finish()
+    rows.append(("décorateur, en session", on))
+
+    print(f"{args.calls} appels, travail de {args.work} itérations")
+    print(f"{'cas':<24} | {'par appel':>10} | {'surcoût':>9}")
+    for label, value in rows:
+        print(f"{label:<24} | {value:7.2f} µs | {value - bare:6.2f} µs")
+    print(f"session : {samples} échantillons → {path}")
+
+    worst = max(off.values()) - bare
+    if worst > args.max_off_overhead_us:
+        print(f"❌ surcoût hors session {worst:.2f} µs > {args.max_off_overhead_us} µs")
+        sys.exit(1)
+    print(f"✅ surcoût hors session {worst:.2f} µs ≤ {args.max_off_overhead_us} µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark : mémoire du worker Celery avec 100k tâches différées en attente.
+
+Mode ETA : les 100k messages `countdown` sont dans la file ; le worker les
+tire tous et les garde en mémoire jusqu'à l'échéance.
+Mode ZSET : les mêmes messages attendent dans `delayed:{file}` ; la file de
+travail est vide et le RSS du worker ne bouge pas.
+Le pic de RSS de chaque mode est comparé à celui d'un worker à vide : échoue
+(code 1) si le mode ZSET dépasse le worker à vide de plus de --max-growth-mb,
+ou si le mode ETA ne la dépasse pas d'au moins deux fois ce seuil (mesure non
+probante : le worker n'a pas tiré les tâches).
+Mesure ensuite la vitesse de livraison de l'ordonnanceur une fois tout dû.
+Nécessite un Redis local et vide la base utilisée : ne pas pointer vers la production.
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_scheduler.py --jobs 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("LOG_CONSOLE", "false")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from redis import Redis  # noqa: E402
+import scheduler  # noqa: E402
+from enqueue import enqueue_batch  # noqa: E402
+
+QUEUE = "bench_scheduler"
+
+
+def tree_rss_mb(pid):
+    """RSS cumulé d'un process et de ses enfants (Linux, /proc)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
+def fill(redis_conn, count, use_zset):
+    redis_conn.flushdb()
+    scheduler.DELAY_SCHEDULER = "true" if use_zset else "false"
+    jobs = [([json.dumps({"ID": i + 1, "number": f"+3361{i:07d}", "deviceID": 1})], 3600) for i in range(count)]
+    for i in range(0, count, 1000):
+        enqueue_batch(redis_conn, "process_message", jobs[i:i + 1000], queue=QUEUE)
+
+
+def worker_memory(redis_conn, count, use_zset, settle):
+    fill(redis_conn, count, use_zset)
+    cmd = [sys.executable, "-m", "celery", "-A", "celery_worker", "worker", "-Q", QUEUE, "-c", "2",
+           "--loglevel=warning", "--without-mingle", "--without-gossip", "--without-heartbeat"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    samples = []
+    try:
+        deadline = time.monotonic() + settle
+        while time.monotonic() < deadline:
+            time.sleep(1)
+            samples.append(tree_rss_mb(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+    return samples[0], max(samples), redis_conn.llen(QUEUE)
+
+
+def delivery_rate(redis_conn, count):
+    fill(redis_conn, count, use_zset=True)
+    sched = scheduler.DelayScheduler(redis_conn, queues=[QUEUE])
+    start = time.perf_counter()
+    now = time.time() + 3600  # tout est dû
+    while sched.tick(now):
+        pass
+    elapsed = time.perf_counter() - start
+    return redis_conn.llen(QUEUE), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100000)
+    parser.add_argument("--settle", type=float, default=30, help="durée d'observation du worker (s)")
+    parser.add_argument("--max-growth-mb", type=float, default=20.0,
+                        help="croissance tolérée du pic de RSS en mode ZSET par rapport au worker à vide")
+    args = parser.parse_args()
+    redis_conn = Redis.from_url(os.environ["REDIS_URL"])
+
+    print(f"{args.jobs} tâches différées d'une heure, worker Celery -c 2")
+    peaks = {}
+    for label, count, use_zset in (("vide", 0, False), ("ETA", args.jobs, False), ("ZSET", args.jobs, True)):
+        first, peaks[label], left = worker_memory(redis_conn, count, use_zset, args.settle)
+        print(f"{label:>5} : RSS {first:7.1f} Mo au démarrage → pic {peaks[label]:7.1f} Mo "
+              f"({left} messages encore dans la file Redis)")
+
+    moved, elapsed = delivery_rate(redis_conn, args.jobs)
+    print(f"Livraison : {moved} messages en {elapsed:.2f} s ({moved / elapsed:,.0f} msg/s, "
+          f"lots de {scheduler.SCHEDULER_BATCH_SIZE})")
+    redis_conn.flushdb()
+
+    eta_growth = peaks["ETA"] - peaks["vide"]
+    zset_growth = peaks["ZSET"] - peaks["vide"]
+    print(f"Croissance du pic par rapport au worker à vide : ETA {eta_growth:+.1f} Mo, ZSET {zset_growth:+.1f} Mo")
+    if zset_growth > args.max_growth_mb:
+        print(f"❌ mode ZSET : {zset_growth:.1f} Mo > {args.max_growth_mb} Mo")
+        sys.exit(1)
+    if eta_growth < 2 * args.max_growth_mb:
+        print(f"❌ mode ETA à peine plus gourmand ({eta_growth:.1f} Mo) : les tâches ne sont pas tirées, "
+              f"mesure non probante")
+        sys.exit(1)
+    print(f"✅ mode ZSET : {zset_growth:.1f} Mo ≤ {args.max_growth_mb} Mo")
+
+
+if __name__ == '__main__':
+    main()
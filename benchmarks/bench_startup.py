@@ -0,0 +1,103 @@
+"""Benchmark : temps entre le lancement du process et « prêt à servir ».
+
+Web : import de `app` puis première requête traitée par Flask.
+Worker : import de `celery_worker` et des modules de tâches, puis le signal
+worker_process_init (ce que fait chaque process enfant avant de consommer).
+Chaque mesure part d'un interpréteur neuf. `--baseline REV` mesure aussi une
+autre révision git (extraite dans un dossier temporaire) pour comparer :
+    python benchmarks/bench_startup.py --baseline HEAD~1
+`--celery` lance en plus un vrai `celery worker` (Redis requis) et attend « ready ».
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+WEB = """
+import app
+app.app.test_client().get("/__ready__")
+print("READY", flush=True)
+"""
+
+WORKER = """
+from celery_worker import celery
+from celery.signals import worker_process_init
+celery.loader.import_default_modules()
+worker_process_init.send(sender=None)
+print("READY", flush=True)
+"""
+
+
+def time_to_ready(cmd, cwd, env, marker, timeout=120):
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in proc.stdout:
+            if marker in line:
+                return (time.perf_counter() - start) * 1000
+            if time.perf_counter() - start > timeout:
+                break
+        return None
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def measure(label, cwd, env, repeats, with_celery):
+    rows = []
+    for name, snippet in (("web", WEB), ("worker", WORKER)):
+        runs = [time_to_ready([sys.executable, "-c", snippet], cwd, env, "READY") for _ in range(repeats)]
+        rows.append((name, runs))
+    if with_celery:
+        cmd = [sys.executable, "-m", "celery", "-A", "celery_worker", "worker",
+               "--pool=solo", "--loglevel=info", "--without-mingle", "--without-gossip"]
+        runs = [time_to_ready(cmd, cwd, env, "ready.") for _ in range(repeats)]
+        rows.append(("celery worker", runs))
+
+    for name, runs in rows:
+        ok = [r for r in runs if r is not None]
+        if not ok:
+            print(f"{label:>10} | {name:<14} | jamais prêt (voir la sortie du process)")
+            continue
+        print(f"{label:>10} | {name:<14} | p50 {statistics.median(ok):8.1f} ms | max {max(ok):8.1f} ms "
+              f"| {len(ok)}/{len(runs)} prêts")
+
+
+def extract_revision(rev):
+    target = tempfile.mkdtemp(prefix="bench_startup_")
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, check=True, capture_output=True).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", help="révision git à comparer (ex. HEAD~1)")
+    parser.add_argument("--celery", action="store_true", help="mesure aussi un vrai `celery worker`")
+    parser.add_argument("--mode", choices=("lazy", "eager"), default="lazy", help="STARTUP_MODE")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("REDIS_URL", "redis://localhost:6379/15")
+    env.setdefault("LOG_CONSOLE", "false")
+    env["STARTUP_MODE"] = args.mode
+
+    measure("courant", ROOT, env, args.repeats, args.celery)
+    if args.baseline:
+        baseline = extract_revision(args.baseline)
+        try:
+            measure(args.baseline, baseline, env, args.repeats, args.celery)
+        finally:
+            shutil.rmtree(baseline, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
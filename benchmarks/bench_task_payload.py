@@ -0,0 +1,90 @@
+"""Benchmark : taille et coût (dé)codage des messages process_message.
+
+Ancien format : le message complet du webhook en JSON, sérialisé une seconde
+fois par Celery. Nouveau format : (numéro, ID, device), en json ou msgpack.
+Mesure les octets poussés dans le broker (enveloppe kombu comprise), le temps
+de construction du message (`build_task_message`) et celui de décodage côté
+worker (`decode_task_message` + lecture des champs). Sans Redis :
+    python benchmarks/bench_task_payload.py [--messages 20000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ.setdefault("LOG_CONSOLE", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from celery_worker import celery  # noqa: E402
+from enqueue import build_task_message, decode_task_message  # noqa: E402
+
+
+def webhook_message(i):
+    """Message tel que la passerelle le poste (champs inutilisés compris)"""
+    return {
+        "ID": 10_000_000 + i, "number": f"+3361{i:07d}", "deviceID": 1 + i % 4, "simSlot": i % 2,
+        "userID": 1, "groupID": None, "status": "Received", "type": "sms", "resultCode": None,
+        "errorCode": None, "sentDate": "2024-05-02T10:15:30+02:00", "deliveredDate": None,
+        "expiryDate": None, "schedule": None, "retries": 0,
+        "message": "Bonjour, je voudrais un rendez-vous pour la semaine prochaine si possible, merci",
+    }
+
+
+def legacy_args(msg):
+    return [json.dumps(msg)]
+
+
+def compact_args(msg):
+    return [msg["number"], msg["ID"], msg["deviceID"]]
+
+
+def legacy_fields(args):
+    msg = json.loads(args[0])
+    return msg.get("number"), msg.get("ID"), msg.get("deviceID")
+
+
+def compact_fields(args):
+    return tuple(args)
+
+
+def measure(messages, serializer, make_args, read_fields):
+    celery.conf.task_serializer = serializer
+    start = time.perf_counter()
+    encoded = [build_task_message("process_message", make_args(msg))[2] for msg in messages]
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for raw in encoded:
+        _headers, args, _kwargs = decode_task_message(raw)
+        read_fields(args)
+    decode = time.perf_counter() - start
+
+    body = sum(len(json.loads(raw)["body"]) for raw in encoded) / len(encoded)
+    size = sum(len(raw.encode()) for raw in encoded) / len(encoded)
+    return size, body, encode / len(messages) * 1e6, decode / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    messages = [webhook_message(i) for i in range(args.messages)]
+    cases = [("JSON complet, json", "json", legacy_args, legacy_fields),
+             ("compact, json", "json", compact_args, compact_fields)]
+    try:
+        import msgpack  # noqa: F401
+        cases.append(("compact, msgpack", "msgpack", compact_args, compact_fields))
+    except ImportError:
+        print("(msgpack absent : pip install msgpack pour le comparer)")
+
+    print(f"{args.messages} messages")
+    print(f"{'format':<20} | {'message':>9} | {'corps b64':>9} | {'encodage':>10} | {'décodage':>10}")
+    for label, serializer, make_args, read_fields in cases:
+        size, body, encode, decode = measure(messages, serializer, make_args, read_fields)
+        print(f"{label:<20} | {size:7.0f} o | {body:7.0f} o | {encode:7.1f} µs | {decode:7.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
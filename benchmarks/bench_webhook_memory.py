@@ -0,0 +1,80 @@
+"""Benchmark : pic de RSS de /sms_auto_reply selon la taille du payload.
+
+Compare la lecture classique (request.form + json.loads + dumps de debug) et
+la lecture en flux (STREAMING_WEBHOOK). Chaque mesure tourne dans un process
+neuf : pic de RSS pendant la requête moins le pic atteint avant (corps de la
+requête déjà en mémoire dans les deux cas). Nécessite un Redis local ; les
+files de la base utilisée sont vidées : ne pas pointer vers la production.
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_webhook_memory.py
+"""
+import os
+import sys
+import json
+import hmac
+import base64
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import urllib.parse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+API_KEY = "bench-key"
+
+CHILD = """
+import gc, sys, json, resource
+import app as webapp
+body = open(sys.argv[1], "rb").read()
+signature = sys.argv[2]
+client = webapp.app.test_client()
+headers = {"X-SG-SIGNATURE": signature, "Content-Type": "application/x-www-form-urlencoded"}
+gc.collect()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+response = client.post("/sms_auto_reply", data=body, headers=headers)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+webapp.redis_conn.delete(webapp.celery.conf.task_default_queue, "delayed:" + webapp.celery.conf.task_default_queue)
+print(json.dumps({"status": response.status_code, "delta_kb": after - before}))
+"""
+
+
+def write_payload(count, directory):
+    messages = json.dumps([
+        {"ID": 10_000_000 + i, "number": f"+3361{i:07d}", "deviceID": 1,
+         "message": "Bonjour, je voudrais un rendez-vous pour la semaine prochaine"}
+        for i in range(count)
+    ])
+    signature = base64.b64encode(hmac.new(API_KEY.encode(), messages.encode(), hashlib.sha256).digest()).decode()
+    path = os.path.join(directory, f"payload_{count}.txt")
+    with open(path, "wb") as f:
+        f.write(urllib.parse.urlencode({"messages": messages}).encode())
+    return path, signature, len(messages)
+
+
+def measure(path, signature, streaming, log_level):
+    env = {**os.environ, "API_KEY": API_KEY, "STREAMING_WEBHOOK": "true" if streaming else "false",
+           "LOG_LEVEL": log_level, "LOG_CONSOLE": "false", "WEBHOOK_MAX_PAYLOAD": str(1 << 30)}
+    env.setdefault("REDIS_URL", "redis://localhost:6379/15")
+    out = subprocess.run([sys.executable, "-c", CHILD, path, signature], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    assert result["status"] == 200, result
+    return result["delta_kb"] / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000,100000", help="messages par requête")
+    parser.add_argument("--log-level", default="DEBUG", help="DEBUG reproduit les dumps de payload")
+    args = parser.parse_args()
+
+    print(f"{'messages':>9} {'payload':>9} | {'classique':>10} | {'en flux':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (int(s) for s in args.sizes.split(",")):
+            path, signature, size = write_payload(count, directory)
+            legacy = measure(path, signature, False, args.log_level)
+            streaming = measure(path, signature, True, args.log_level)
+            print(f"{count:>9} {size / 2**20:>6.1f} Mo | +{legacy:>7.1f} Mo | +{streaming:>7.1f} Mo")
+
+
+if __name__ == '__main__':
+    main()
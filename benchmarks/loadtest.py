@@ -0,0 +1,349 @@
+"""Test de charge de bout en bout : webhook → file → worker(s) → passerelle.
+
+Rien de la production n'est appelé :
+- passerelle factice locale : /services/send.php et /services/contact.php
+  (annuaire de contacts), latence et taux d'erreur réglables
+- table Contact dans un fichier SQLite (ContactNumberIndex compris), branchée
+  dans le pool MySQL des workers ; latence par requête réglable
+- générateur de trafic : requêtes /sms_auto_reply signées comme X-SG-SIGNATURE
+
+L'app tourne sous gunicorn, les workers Celery en process séparés. Pour chaque
+mode (process_message monolithique, pipeline par étapes) : débit, latences
+p50/p99 du webhook et de bout en bout (requête → arrivée à send.php), et
+opérations Redis par message (INFO total_commands_processed, polling des
+workers compris).
+
+Scénario « recherche lente » : `--db-latency 0.2 --cached-ratio 0.8` (80 % de
+noms en cache, les autres coûtent un aller-retour DB lent).
+Nécessite un Redis local et vide la base utilisée : ne pas pointer vers la production.
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/loadtest.py --requests 200 --batch 10
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import random
+import socket
+import hashlib
+import sqlite3
+import argparse
+import tempfile
+import functools
+import threading
+import subprocess
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("LOG_CONSOLE", "false")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from bench_contact_lookup import SqliteCursor  # noqa: E402
+
+API_KEY = "loadtest-key"
+STAGE_CONCURRENCY = "validate=1,resolve=4,send=2,commit=1"
+
+
+# 📡 Passerelle factice
+
+class FakeGateway(BaseHTTPRequestHandler):
+    latency = 0.05
+    error_rate = 0.0
+    contacts = {}       # numéro → nom connu de l'API
+    sends = {}          # numéro → perf_counter du premier envoi reçu
+    hits = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode())
+        path = urllib.parse.urlparse(self.path).path
+        if self.latency:
+            time.sleep(self.latency)
+        if path == "/services/send.php":
+            with self.lock:
+                FakeGateway.hits += 1
+                self.sends.setdefault(form.get("number", [""])[0], time.perf_counter())
+        if random.random() < self.error_rate:
+            return self._reply(500, b"erreur injectee", "text/plain")
+        if path == "/services/send.php":
+            return self._reply(200, b'{"data": {"queued": true}}')
+        if path == "/services/contact.php":
+            number = form.get("number", [None])[0]
+            if number is None:
+                data = [{"number": n, "name": name} for n, name in self.contacts.items()]
+            else:
+                data = {"number": number, "name": self.contacts.get(number, "")}
+            return self._reply(200, json.dumps({"data": data}).encode())
+        self._reply(404, b"", "text/plain")
+
+    def _reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_gateway(latency, error_rate):
+    FakeGateway.latency = latency
+    FakeGateway.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGateway)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# 🛢️ Table Contact dans SQLite
+
+class SlowCursor(SqliteCursor):
+    """Curseur SQLite avec un aller-retour réseau simulé par requête"""
+
+    def __init__(self, conn, latency):
+        super().__init__(conn)
+        self.latency = latency
+
+    def execute(self, sql, params=()):
+        if self.latency:
+            time.sleep(self.latency)
+        super().execute(sql, params)
+
+
+class SqliteConnection:
+    """Ce que le pool attend d'une connexion pymysql : cursor(), ping(), close()"""
+
+    def __init__(self, path, latency):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self.latency = latency
+
+    @contextmanager
+    def cursor(self):
+        yield SlowCursor(self._conn, self.latency)
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+
+def build_contact_db(path, numbers):
+    from contact_index import index_contacts
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE Contact (ID INTEGER PRIMARY KEY, name TEXT, number TEXT)")
+    conn.execute("CREATE TABLE ContactNumberIndex (contactID INTEGER PRIMARY KEY, number_normalized TEXT NOT NULL)")
+    conn.execute("CREATE INDEX idx_number_normalized ON ContactNumberIndex (number_normalized)")
+    conn.executemany("INSERT INTO Contact (ID, name, number) VALUES (?, ?, ?)",
+                     ((i + 1, f"db{i}", number) for i, number in enumerate(numbers)))
+    index_contacts(SqliteCursor(conn), after_id=0)
+    conn.commit()
+    conn.close()
+
+
+def run_worker(db_path, db_latency, argv):
+    """Worker Celery dont le pool MySQL ouvre la base SQLite (process `worker` du harness)"""
+    import db_pool
+    import tasks
+    from celery_worker import celery
+
+    tasks.init_pool = functools.partial(db_pool.init_pool, connect=lambda: SqliteConnection(db_path, db_latency))
+    celery.worker_main(["worker", *argv])
+
+
+# 📨 Générateur de trafic
+
+def signed_request(url, messages):
+    payload = json.dumps(messages)
+    signature = base64.b64encode(hmac.new(API_KEY.encode(), payload.encode(), hashlib.sha256).digest()).decode()
+    return urllib.request.Request(url, data=urllib.parse.urlencode({"messages": payload}).encode(), headers={
+        "X-SG-SIGNATURE": signature, "Content-Type": "application/x-www-form-urlencoded"})
+
+
+def post(url, messages, started):
+    start = time.perf_counter()
+    for msg in messages:
+        started[msg["number"]] = start
+    with urllib.request.urlopen(signed_request(url, messages), timeout=60) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(condition, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def port_open(port):
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+class Scenario:
+    """Numéros du test : en cache Redis, en base SQLite, ou connus seulement de l'API"""
+
+    def __init__(self, messages, cached_ratio, api_ratio, seed=42):
+        rng = random.Random(seed)
+        self.numbers = [f"+3361{i:07d}" for i in range(messages)]
+        self.cached, self.db, self.api = [], [], []
+        for number in self.numbers:
+            draw = rng.random()
+            if draw < cached_ratio:
+                self.cached.append(number)
+            elif draw < cached_ratio + api_ratio:
+                self.api.append(number)
+            else:
+                self.db.append(number)
+
+
+def run(mode, scenario, args, env, redis_conn, db_path):
+    from contact_cache import ContactNameCache
+    from celery_worker import PIPELINE_QUEUES
+
+    redis_conn.flushdb()
+    cache = ContactNameCache(redis_conn)
+    for number in scenario.cached:
+        cache.set(number, f"cache{number[-4:]}")
+    FakeGateway.contacts = {number: f"api{number[-4:]}" for number in scenario.api}
+
+    port = free_port()
+    env = {**env, "STAGED_PIPELINE": "true" if mode == "pipeline" else "false"}
+    if mode == "pipeline":
+        stages = dict(item.split("=") for item in args.stage_concurrency.split(","))
+        workers = [(PIPELINE_QUEUES[stage], int(count)) for stage, count in stages.items()]
+    else:
+        workers = [("celery", args.concurrency)]
+
+    procs = [subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app", "-c", "gunicorn.conf.py",
+         "-b", f"127.0.0.1:{port}", "-w", str(args.web_workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    for queue, concurrency in workers:
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker", "--db", db_path, "--db-latency", str(args.db_latency),
+             "--", "-Q", queue, "-c", str(concurrency), "-n", f"{queue}@loadtest", "--loglevel=warning",
+             "--without-mingle", "--without-gossip", "--without-heartbeat"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    url = f"http://127.0.0.1:{port}/sms_auto_reply"
+    try:
+        if not wait_until(lambda: port_open(port), 30):
+            raise RuntimeError("gunicorn n'a pas démarré")
+        # Échauffement : un message par le chemin le plus long (nom inconnu du cache)
+        FakeGateway.sends.clear()
+        post(url, [{"ID": 1, "number": "+33699999999", "deviceID": 1, "message": "Bonjour"}], {})
+        if not wait_until(lambda: FakeGateway.sends, 60):
+            raise RuntimeError("les workers ne traitent rien")
+        FakeGateway.sends.clear()
+        FakeGateway.hits = 0
+
+        batches = [[{"ID": 1000 + i, "number": number, "deviceID": 1, "message": "Bonjour"}
+                    for i, number in enumerate(scenario.numbers[start:start + args.batch], start)]
+                   for start in range(0, len(scenario.numbers), args.batch)]
+        started = {}
+        ops_before = redis_conn.info("stats")["total_commands_processed"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            webhook = list(pool.map(lambda batch: post(url, batch, started), batches))
+        wait_until(lambda: len(FakeGateway.sends) >= len(scenario.numbers), args.timeout, 0.02)
+        done = dict(FakeGateway.sends)
+        elapsed = (max(done.values()) if done else time.perf_counter()) - start
+        ops = redis_conn.info("stats")["total_commands_processed"] - ops_before
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=60)
+
+    end_to_end = [done[number] - started[number] for number in done if number in started]
+    return {
+        "sent": len(done),
+        "rate": len(done) / elapsed if elapsed > 0 else 0.0,
+        "webhook_p50": percentile(webhook, 0.5) * 1000,
+        "webhook_p99": percentile(webhook, 0.99) * 1000,
+        "e2e_p50": percentile(end_to_end, 0.5) * 1000,
+        "e2e_p99": percentile(end_to_end, 0.99) * 1000,
+        "redis_ops": ops / len(done) if done else 0.0,
+    }
+
+
+def main():
+    if sys.argv[1:2] == ["worker"]:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--db", required=True)
+        parser.add_argument("--db-latency", type=float, default=0.0)
+        args, celery_args = parser.parse_known_args(sys.argv[2:])
+        return run_worker(args.db, args.db_latency, [a for a in celery_args if a != "--"])
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="monolithic,pipeline")
+    parser.add_argument("--requests", type=int, default=200, help="requêtes webhook")
+    parser.add_argument("--batch", type=int, default=10, help="messages par requête")
+    parser.add_argument("--clients", type=int, default=8, help="requêtes webhook simultanées")
+    parser.add_argument("--web-workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8, help="process du worker monolithique")
+    parser.add_argument("--stage-concurrency", default=STAGE_CONCURRENCY, help="process par étape du pipeline")
+    parser.add_argument("--gateway-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="part de réponses 500 de la passerelle")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="latence par requête SQL (s)")
+    parser.add_argument("--cached-ratio", type=float, default=0.5, help="part des noms déjà en cache")
+    parser.add_argument("--api-ratio", type=float, default=0.1, help="part des numéros absents de la DB")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    from redis import Redis
+
+    scenario = Scenario(args.requests * args.batch, args.cached_ratio, args.api_ratio)
+    gateway = start_gateway(args.gateway_latency, args.error_rate)
+    env = {**os.environ, "SERVER": f"http://127.0.0.1:{gateway.server_port}", "API_KEY": API_KEY,
+           "SECOND_MESSAGE_LINK": "example.org", "LOG_LEVEL": "WARNING", "DEBUG_MODE": "false",
+           "REPLY_DELAY_MIN": "0", "REPLY_DELAY_MAX": "0", "DELAY_SCHEDULER": "false"}
+    redis_conn = Redis.from_url(os.environ["REDIS_URL"])
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "contacts.sqlite")
+        build_contact_db(db_path, scenario.cached + scenario.db)
+        print(f"{len(scenario.numbers)} messages ({args.requests} requêtes × {args.batch}) : "
+              f"{len(scenario.cached)} en cache, {len(scenario.db)} en DB ({args.db_latency * 1000:.0f} ms/requête), "
+              f"{len(scenario.api)} via l'API ; passerelle {args.gateway_latency * 1000:.0f} ms, "
+              f"{args.error_rate:.0%} d'erreurs")
+        print(f"{'mode':>11} | {'débit':>12} | {'webhook p50/p99':>17} | {'bout en bout p50/p99':>21} | "
+              f"{'ops Redis/msg':>13}")
+        for mode in args.modes.split(","):
+            r = run(mode, scenario, args, env, redis_conn, db_path)
+            print(f"{mode:>11} | {r['rate']:6.1f} msg/s | {r['webhook_p50']:6.0f} / {r['webhook_p99']:6.0f} ms | "
+                  f"{r['e2e_p50']:8.0f} / {r['e2e_p99']:8.0f} ms | {r['redis_ops']:13.1f}"
+                  f"  ({r['sent']}/{len(scenario.numbers)} envoyés)")
+    redis_conn.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Profils de performance du worker Celery, choisis par CELERY_PROFILE.
+
+process_message est presque uniquement de l'I/O (Redis, MySQL, HTTP) et
+personne ne lit son résultat : hors `legacy`, aucun backend de résultats,
+ack tardif (un message n'est retiré de la file qu'une fois traité) et
+visibility_timeout au-delà du plus long délai de tâche.
+
+- throughput  : prefork large, prefetch élevé — débit maximal par machine
+- low-memory  : un seul process en threads, prefetch 1, pool broker réduit
+- low-latency : prefork, prefetch 1 (pas de message bloqué derrière un lent)
+- legacy      : réglages d'origine (résultats stockés dans Redis, ack immédiat)
+
+CELERY_CONCURRENCY et CELERY_PREFETCH_MULTIPLIER surchargent le profil.
+
+`legacy` reste le profil par défaut : avec l'ack tardif, un worker tué entre
+l'envoi du SMS (send.php, non idempotent) et la validation de la réservation
+fait rejouer le message, donc renvoyer le SMS une fois la réservation
+expirée. Les autres profils s'activent explicitement (CELERY_PROFILE).
+"""
+import os
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Doit dépasser le plus long countdown encore en ETA (180 s) et CLAIM_TTL
+VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "3600"))
+
+_COMMON = {
+    "task_ignore_result": True,
+    "task_store_errors_even_if_ignored": False,
+    "task_track_started": False,
+    "task_acks_late": True,
+    "task_reject_on_worker_lost": True,
+    "worker_disable_rate_limits": True,
+    "broker_transport_options": {"visibility_timeout": VISIBILITY_TIMEOUT},
+}
+
+PROFILES = {
+    "throughput": {
+        **_COMMON,
+        "worker_pool": "prefork",
+        "worker_concurrency": max(4, CPU_COUNT * 4),
+        "worker_prefetch_multiplier": 8,
+        "broker_pool_limit": 20,
+        "worker_max_tasks_per_child": 10000,
+    },
+    "low-memory": {
+        **_COMMON,
+        "worker_pool": "threads",
+        "worker_concurrency": 8,
+        "worker_prefetch_multiplier": 1,
+        "broker_pool_limit": 4,
+    },
+    "low-latency": {
+        **_COMMON,
+        "worker_pool": "prefork",
+        "worker_concurrency": max(2, CPU_COUNT * 2),
+        "worker_prefetch_multiplier": 1,
+        "broker_pool_limit": 10,
+    },
+    "legacy": {
+        "task_ignore_result": False,
+        "task_track_started": True,
+        "result_expires": 86400,
+    },
+}
+
+DEFAULT_PROFILE = "legacy"  # comportement d'origine tant qu'on ne choisit pas un profil
+
+
+def profile_settings(name, redis_url):
+    """Réglages `celery.conf` du profil, plus `result_backend` (None : pas de résultats)"""
+    if name not in PROFILES:
+        raise ValueError(f"CELERY_PROFILE inconnu : {name} (profils : {', '.join(PROFILES)})")
+    settings = dict(PROFILES[name])
+    settings["result_backend"] = None if settings["task_ignore_result"] else redis_url
+    if os.getenv("CELERY_CONCURRENCY"):
+        settings["worker_concurrency"] = int(os.getenv("CELERY_CONCURRENCY"))
+    if os.getenv("CELERY_PREFETCH_MULTIPLIER"):
+        settings["worker_prefetch_multiplier"] = int(os.getenv("CELERY_PREFETCH_MULTIPLIER"))
+    return settings
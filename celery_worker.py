@@ -1,37 +1,74 @@
 import os
 from celery import Celery
-from logger import log
+from celery.signals import worker_init, worker_process_shutdown, worker_shutdown
+from logger import log, shutdown_logging
+from celery_profiles import DEFAULT_PROFILE, profile_settings
+from redis_client import REDIS_URL, celery_settings
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CELERY_PROFILE = os.getenv("CELERY_PROFILE", DEFAULT_PROFILE).lower()
 
-# 🔒 Gérer SSL si rediss:// est utilisé
-ssl_options = {}
-if REDIS_URL.startswith("rediss://"):
-    ssl_options = {
-        "ssl_cert_reqs": "none"  # Pour Upstash, aucun certificat requis
-    }
+# ⚙️ Profil de performance (pool, prefetch, acks, backend de résultats…)
+profile = profile_settings(CELERY_PROFILE, REDIS_URL)
+result_backend = profile.pop("result_backend")
+
+# 🪜 Pipeline par étapes (pipeline.py) : une file, donc un worker dimensionnable, par étape
+STAGED_PIPELINE = os.getenv("STAGED_PIPELINE", "false").lower() == "true"
+PIPELINE_STAGES = ("validate", "resolve", "send", "commit")
+PIPELINE_QUEUES = {stage: os.getenv(f"PIPELINE_{stage.upper()}_QUEUE", f"sms_{stage}") for stage in PIPELINE_STAGES}
+
+# 📦 Sérialisation des messages de tâche : json (défaut) ou msgpack (plus compact).
+# Les deux formats sont toujours acceptés : on peut basculer sans vider les files.
+CELERY_TASK_SERIALIZER = os.getenv("CELERY_TASK_SERIALIZER", "json").lower()
+if CELERY_TASK_SERIALIZER == "msgpack":
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        log("⚠️ CELERY_TASK_SERIALIZER=msgpack mais le paquet msgpack est absent : json utilisé", level="WARNING")
+        CELERY_TASK_SERIALIZER = "json"
+
+# 🔒 SSL (rediss://), plafond de connexions, timeouts et health checks : mêmes
+# réglages que les clients de redis_client.py, pour le broker comme pour les résultats
+redis_settings = celery_settings(REDIS_URL, profile.pop("broker_transport_options", None))
+if not result_backend:
+    redis_settings["redis_backend_use_ssl"] = None
 
 # ✅ Initialisation de Celery
 celery = Celery(
     "sms_auto_reply",
     broker=REDIS_URL,
-    backend=REDIS_URL,
-    include=["tasks"]
+    backend=result_backend,
+    include=["tasks", "pipeline"]
 )
 
 celery.conf.update(
     timezone="UTC",
     enable_utc=True,
-    task_track_started=True,
-    task_serializer="json",
-    accept_content=["json"],
+    task_serializer=CELERY_TASK_SERIALIZER,
+    accept_content=["json", "msgpack"],
     result_serializer="json",
-    broker_use_ssl=ssl_options if REDIS_URL.startswith("rediss://") else None,
-    redis_backend_use_ssl=ssl_options if REDIS_URL.startswith("rediss://") else None,
+    **redis_settings,
+    **profile,
 )
 
+# 🧹 Vider la file de logs à l'arrêt (process enfants et process principal)
+@worker_process_shutdown.connect
+def _flush_logs_child(**kwargs):
+    shutdown_logging()
+
+@worker_shutdown.connect
+def _flush_logs_main(**kwargs):
+    shutdown_logging()
+
+# 📈 Exporteur Prometheus du worker (process principal, agrège les process enfants)
+@worker_init.connect
+def _start_metrics_exporter(**kwargs):
+    from redis_client import get_redis
+    from metrics import start_exporter
+    start_exporter(redis_conn=get_redis())
+
 # ✅ Log au démarrage
 try:
-    log("✅ Celery initialisé avec succès (broker & backend Redis)")
+    log(f"✅ Celery initialisé avec succès (broker Redis, profil {CELERY_PROFILE}, "
+        f"résultats {'Redis' if result_backend else 'ignorés'})")
 except Exception as e:
     print(f"❌ Erreur init Celery : {e}")
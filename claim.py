@@ -0,0 +1,136 @@
+import os
+import time
+import uuid
+from dedup import store as dedup_store
+
+# ⏳ Durée de vie d'une réservation (couvre la résolution du nom + l'envoi)
+CLAIM_TTL = int(os.getenv("CLAIM_TTL", "600"))
+
+# KEYS : sets d'archive (n_archive), sets processed du jour (n_processed), conv:{number}, claim:{number}
+# ARGV : number, "{number}:{ID}", device_id, token, ttl, n_archive, n_processed
+CLAIM_LUA = """
+local n_archive = tonumber(ARGV[6])
+local n_processed = tonumber(ARGV[7])
+for i = 1, n_archive do
+    if redis.call('SISMEMBER', KEYS[i], ARGV[1]) == 1 then
+        return {'archived', ''}
+    end
+end
+for i = n_archive + 1, n_archive + n_processed do
+    if redis.call('SISMEMBER', KEYS[i], ARGV[2]) == 1 then
+        return {'processed', ''}
+    end
+end
+local conv = KEYS[n_archive + n_processed + 1]
+local claim = KEYS[n_archive + n_processed + 2]
+if not redis.call('SET', claim, ARGV[4], 'NX', 'EX', tonumber(ARGV[5])) then
+    return {'claimed', ''}
+end
+redis.call('HSET', conv, 'device', ARGV[3])
+return {'ok', redis.call('HGET', conv, 'step') or '0'}
+"""
+
+# KEYS : set d'archive du jour, set processed du jour, conv:{number}, claim:{number}[, filtre de Bloom du jour]
+# ARGV : number, "{number}:{ID}", token, expiration processed, expiration archive (0 = jamais), bits du filtre…
+# La réponse est partie : on marque même si la réservation a expiré entre-temps
+COMMIT_LUA = """
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('EXPIREAT', KEYS[2], ARGV[4])
+redis.call('SADD', KEYS[1], ARGV[1])
+if tonumber(ARGV[5]) > 0 then
+    redis.call('EXPIREAT', KEYS[1], ARGV[5])
+end
+if KEYS[5] then
+    for i = 6, #ARGV do
+        redis.call('SETBIT', KEYS[5], ARGV[i], 1)
+    end
+    redis.call('EXPIREAT', KEYS[5], ARGV[4])
+end
+redis.call('DEL', KEYS[3])
+if redis.call('GET', KEYS[4]) == ARGV[3] then
+    redis.call('DEL', KEYS[4])
+    return 1
+end
+return 0
+"""
+
+# KEYS : claim:{number} — ARGV : token
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ConversationClaims:
+    """Protocole réserver / valider / libérer par numéro, en scripts Lua (EVALSHA).
+
+    Les clés d'archive et de messages traités viennent de `dedup.store`.
+    `claim` vérifie atomiquement l'archivage et le message déjà traité, pose
+    la réservation `claim:{number}` (SET NX EX) et enregistre le device.
+    `commit` marque le message traité, archive le numéro et supprime la
+    conversation. Deux appels Redis par message, et une seule réponse par
+    numéro même si des webhooks dupliqués sont traités en parallèle.
+    """
+
+    def __init__(self, redis_conn, ttl=CLAIM_TTL):
+        self.ttl = ttl
+        self._claim = redis_conn.register_script(CLAIM_LUA)
+        self._commit = redis_conn.register_script(COMMIT_LUA)
+        self._release = redis_conn.register_script(RELEASE_LUA)
+
+    def claim(self, number, msg_id, device_id):
+        """Retourne (statut, étape, jeton). statut : ok / archived / processed / claimed"""
+        token, keys, args = self._claim_request(number, msg_id, device_id)
+        return self._claim_result(self._claim(keys=keys, args=args), token)
+
+    def commit(self, number, msg_id, token):
+        """Retourne True si la réservation était encore détenue"""
+        keys, args = self._commit_request(number, msg_id, token)
+        return bool(self._commit(keys=keys, args=args))
+
+    def release(self, number, token):
+        return bool(self._release(keys=[f"claim:{number}"], args=[token]))
+
+    def _claim_request(self, number, msg_id, device_id):
+        token = uuid.uuid4().hex
+        archive_keys = dedup_store.archive_keys()
+        processed_keys = dedup_store.processed_keys()
+        keys = archive_keys + processed_keys + [f"conv:{number}", f"claim:{number}"]
+        args = [number, dedup_store.member(number, msg_id), device_id, token, self.ttl,
+                len(archive_keys), len(processed_keys)]
+        return token, keys, args
+
+    @staticmethod
+    def _claim_result(reply, token):
+        status, step = reply
+        status = status.decode() if isinstance(status, bytes) else status
+        step = int(step) if status == "ok" else None
+        return status, step, token
+
+    def _commit_request(self, number, msg_id, token):
+        now = time.time()
+        member = dedup_store.member(number, msg_id)
+        keys = [dedup_store.archive_keys(now)[0], dedup_store.processed_keys(now)[0],
+                f"conv:{number}", f"claim:{number}"]
+        args = [number, member, token, dedup_store.processed_expire_at(now), dedup_store.archive_expire_at(now)]
+        if dedup_store.bloom:
+            keys.append(dedup_store.bloom_keys(now)[0])
+            args.extend(dedup_store.bloom_offsets(member))
+        return keys, args
+
+
+class AsyncConversationClaims(ConversationClaims):
+    """Mêmes scripts et mêmes clés, pour un client `redis.asyncio`"""
+
+    async def claim(self, number, msg_id, device_id):
+        token, keys, args = self._claim_request(number, msg_id, device_id)
+        return self._claim_result(await self._claim(keys=keys, args=args), token)
+
+    async def commit(self, number, msg_id, token):
+        keys, args = self._commit_request(number, msg_id, token)
+        return bool(await self._commit(keys=keys, args=args))
+
+    async def release(self, number, token):
+        return bool(await self._release(keys=[f"claim:{number}"], args=[token]))
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from logger import log
+from phone import normalize_number
+from metrics import CONTACT_CACHE_LOOKUPS
+
+# ⚙️ Configuration du cache des noms de contacts
+CONTACT_CACHE_SIZE = int(os.getenv("CONTACT_CACHE_SIZE", "10000"))
+CONTACT_CACHE_TTL = int(os.getenv("CONTACT_CACHE_TTL", "86400"))
+CONTACT_CACHE_NEGATIVE_TTL = int(os.getenv("CONTACT_CACHE_NEGATIVE_TTL", "900"))
+CONTACT_CACHE_REDIS_KEY = os.getenv("CONTACT_CACHE_REDIS_KEY", "contact_names")  # préfixe des clés
+CONTACT_CACHE_STATS_EVERY = int(os.getenv("CONTACT_CACHE_STATS_EVERY", "100"))
+
+
+class ContactNameCache:
+    """Cache à deux niveaux des noms de contacts.
+
+    Niveau 1 : LRU borné avec TTL dans chaque process worker.
+    Niveau 2 : une clé Redis partagée par numéro, `contact_names:{numéro E.164}`
+    (valeur "<expiration>|<nom>", SET ... EX : Redis supprime seul les entrées
+    expirées). Un nom vide signifie "aucun nom trouvé" (cache négatif, TTL
+    plus court). L'ancien hash `contact_names`, qui ne se vidait jamais, peut
+    être supprimé (DEL contact_names).
+    """
+
+    def __init__(self, redis_conn=None, max_size=CONTACT_CACHE_SIZE, ttl=CONTACT_CACHE_TTL,
+                 negative_ttl=CONTACT_CACHE_NEGATIVE_TTL, redis_key=CONTACT_CACHE_REDIS_KEY):
+        self.redis_conn = redis_conn
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.redis_key = redis_key
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "redis_errors": 0,
+        }
+
+    def get(self, number):
+        """Retourne (trouvé, nom). `nom` vaut None pour une entrée négative."""
+        key = normalize_number(number) or str(number)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, name = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._count_hit("local_hits", name)
+                    return True, name
+                del self._entries[key]
+                self.counters["expirations"] += 1
+
+        entry = self._redis_get(key, now)
+        if entry is not None:
+            expires_at, name = entry
+            self._store_local(key, expires_at, name)
+            with self._lock:
+                self._count_hit("redis_hits", name)
+            return True, name
+
+        with self._lock:
+            self.counters["misses"] += 1
+            misses = self.counters["misses"]
+        CONTACT_CACHE_LOOKUPS.labels("miss").inc()
+        self._maybe_log_stats(misses)
+        return False, None
+
+    def set(self, number, name):
+        """Mémorise un nom (ou son absence si `name` est vide)."""
+        key = normalize_number(number) or str(number)
+        name = name or None
+        ttl = self.ttl if name else self.negative_ttl
+        expires_at = time.time() + ttl
+        self._store_local(key, expires_at, name)
+        if self.redis_conn is None:
+            return
+        try:
+            self.redis_conn.set(self._redis_key(key), f"{expires_at:.0f}|{name or ''}", ex=ttl)
+        except Exception as e:
+            with self._lock:
+                self.counters["redis_errors"] += 1
+            log(f"⚠️ Cache contacts : écriture Redis impossible : {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _count_hit(self, counter, name):
+        """À appeler sous `self._lock`"""
+        self.counters[counter] += 1
+        CONTACT_CACHE_LOOKUPS.labels(counter.replace("_hits", "_hit")).inc()
+        if name is None:
+            self.counters["negative_hits"] += 1
+
+    def _store_local(self, key, expires_at, name):
+        with self._lock:
+            self._entries[key] = (expires_at, name)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def _redis_get(self, key, now):
+        if self.redis_conn is None:
+            return None
+        try:
+            raw = self.redis_conn.get(self._redis_key(key))
+        except Exception as e:
+            with self._lock:
+                self.counters["redis_errors"] += 1
+            log(f"⚠️ Cache contacts : lecture Redis impossible : {e}")
+            return None
+        if raw is None:
+            return None
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        expires_at, _, name = raw.partition("|")
+        try:
+            expires_at = float(expires_at)
+        except ValueError:
+            expires_at = 0
+        if expires_at <= now:
+            # Clé pas encore évincée par Redis (expiration à la seconde près)
+            with self._lock:
+                self.counters["expirations"] += 1
+            return None
+        return expires_at, name or None
+
+    def _redis_key(self, key):
+        return f"{self.redis_key}:{key}"
+
+    def _maybe_log_stats(self, misses):
+        if CONTACT_CACHE_STATS_EVERY and misses % CONTACT_CACHE_STATS_EVERY == 0:
+            log(f"📈 Cache contacts : {self.stats()}")
@@ -0,0 +1,204 @@
+"""Index des numéros normalisés de la table Contact.
+
+La table `Contact` appartient à la passerelle SMS : on n'y ajoute pas de
+colonne, on maintient à côté une table `ContactNumberIndex`
+(contactID → numéro normalisé, indexé) remplie par ce module.
+
+Migration / backfill (idempotent) :
+    python contact_index.py          # ajoute les contacts pas encore indexés
+    python contact_index.py --full   # réindexe tout et purge les contacts supprimés
+
+Hors du chemin de lecture, les workers tiennent l'index à jour en tâche de
+fond (`start_index_refresher`, dans le process principal une fois les
+process enfants lancés, avec son propre client Redis) : nouveaux contacts toutes les
+CONTACT_INDEX_BACKFILL_INTERVAL secondes, réindexation complète (numéros
+modifiés, contacts supprimés) toutes les CONTACT_INDEX_FULL_INTERVAL
+secondes, chaque passe par un seul process du cluster (verrou Redis).
+"""
+import os
+import time
+import threading
+import argparse
+from logger import log
+from phone import normalize_number
+
+BACKFILL_BATCH_SIZE = int(os.getenv("CONTACT_INDEX_BATCH_SIZE", "5000"))
+CONTACT_INDEX_BACKFILL_INTERVAL = int(os.getenv("CONTACT_INDEX_BACKFILL_INTERVAL", "60"))  # 0 : jamais
+CONTACT_INDEX_FULL_INTERVAL = int(os.getenv("CONTACT_INDEX_FULL_INTERVAL", "86400"))  # 0 : jamais
+INDEX_RECHECK_INTERVAL = 300
+REFRESH_LOCK_KEY = "contact_index:{}"
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS ContactNumberIndex (
+    contactID BIGINT NOT NULL PRIMARY KEY,
+    number_normalized VARCHAR(32) NOT NULL,
+    KEY idx_number_normalized (number_normalized)
+) DEFAULT CHARSET=utf8mb4
+"""
+
+LOOKUP_SQL = (
+    "SELECT c.name, c.number FROM ContactNumberIndex n "
+    "JOIN Contact c ON c.ID = n.contactID "
+    "WHERE n.number_normalized = %s AND c.name IS NOT NULL AND c.name <> '' LIMIT 1"
+)
+
+UPSERT_SQL = "REPLACE INTO ContactNumberIndex (contactID, number_normalized) VALUES (%s, %s)"
+
+# Table d'index absente : recherche directe (numéro brut ou déjà normalisé), sans index
+FALLBACK_LOOKUP_SQL = (
+    "SELECT name, number FROM Contact "
+    "WHERE number IN (%s, %s) AND name IS NOT NULL AND name <> '' LIMIT 1"
+)
+
+PURGE_SQL = (
+    "DELETE n FROM ContactNumberIndex n "
+    "LEFT JOIN Contact c ON c.ID = n.contactID WHERE c.ID IS NULL"
+)
+
+
+def index_contacts(cursor, after_id=None, batch_size=BACKFILL_BATCH_SIZE):
+    """Indexe les contacts d'ID > after_id (par défaut : le dernier déjà indexé).
+
+    Parcourt `Contact` par clé primaire, par lots. Retourne le nombre de lignes indexées.
+    """
+    if after_id is None:
+        cursor.execute("SELECT COALESCE(MAX(contactID), 0) AS last_id FROM ContactNumberIndex")
+        after_id = cursor.fetchone()["last_id"]
+
+    total = 0
+    while True:
+        cursor.execute(
+            "SELECT ID, number FROM Contact WHERE ID > %s ORDER BY ID LIMIT %s",
+            [after_id, batch_size],
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        values = []
+        for row in rows:
+            normalized = normalize_number(row["number"])
+            if normalized:
+                values.append((row["ID"], normalized))
+        if values:
+            cursor.executemany(UPSERT_SQL, values)
+        total += len(values)
+        after_id = rows[-1]["ID"]
+    return total
+
+
+def lookup_contact(cursor, number):
+    """Contact nommé correspondant au numéro, via une seule requête d'égalité indexée.
+
+    Lecture seule : un contact créé depuis la dernière passe du job
+    d'indexation n'est pas encore trouvé ici (la recherche API prend le relais).
+    """
+    normalized = normalize_number(number)
+    if not normalized:
+        return None
+    if not index_available(cursor):
+        cursor.execute(FALLBACK_LOOKUP_SQL, [str(number).strip(), normalized])
+        return cursor.fetchone()
+    cursor.execute(LOOKUP_SQL, [normalized])
+    return cursor.fetchone()
+
+
+_index_state = {"available": None, "checked_at": 0.0}
+
+
+def index_available(cursor):
+    """La table ContactNumberIndex existe-t-elle ? Vérifié une fois par process,
+    puis toutes les INDEX_RECHECK_INTERVAL secondes tant qu'elle manque"""
+    if _index_state["available"] or (
+            _index_state["available"] is False
+            and time.monotonic() - _index_state["checked_at"] < INDEX_RECHECK_INTERVAL):
+        return _index_state["available"]
+    try:
+        cursor.execute("SELECT 1 FROM ContactNumberIndex LIMIT 1")
+        cursor.fetchall()
+        available = True
+    except Exception as e:
+        if "ContactNumberIndex" not in str(e):
+            raise
+        available = False
+        log("❌ Table ContactNumberIndex absente : recherche des contacts sans index (lente, numéros "
+            "au format exact seulement). Lancer `python contact_index.py`.", level="ERROR")
+    _index_state.update(available=available, checked_at=time.monotonic())
+    return available
+
+
+def migrate(connection, full=False, batch_size=BACKFILL_BATCH_SIZE):
+    """Crée la table d'index puis la remplit (entièrement si `full`)"""
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        indexed = index_contacts(cursor, after_id=0 if full else None, batch_size=batch_size)
+        purged = 0
+        if full:
+            cursor.execute(PURGE_SQL)
+            purged = cursor.rowcount
+    log(f"🗂️ Index des numéros : {indexed} contacts indexés, {purged} purgés "
+        f"en {time.perf_counter() - start:.1f}s")
+    return indexed, purged
+
+
+def refresh(redis_conn, connect=None):
+    """Une passe du job d'indexation : réindexation complète si son intervalle est
+    écoulé, sinon backfill des nouveaux contacts ; le verrou (SET NX EX de la
+    durée de l'intervalle) garantit au plus une passe par intervalle dans le cluster"""
+    if connect is None:
+        from db_pool import connect_mysql as connect
+    for kind, interval in (("full", CONTACT_INDEX_FULL_INTERVAL), ("backfill", CONTACT_INDEX_BACKFILL_INTERVAL)):
+        if not interval or not redis_conn.set(REFRESH_LOCK_KEY.format(kind), os.getpid(), nx=True, ex=interval):
+            continue
+        connection = connect()
+        try:
+            return migrate(connection, full=kind == "full")
+        finally:
+            connection.close()
+    return None
+
+
+_refresher = {"thread": None, "stop": threading.Event()}
+
+
+def start_index_refresher(redis_conn=None):
+    """Thread du job d'indexation ; sans `redis_conn`, un client à une connexion, propre au thread"""
+    intervals = [i for i in (CONTACT_INDEX_BACKFILL_INTERVAL, CONTACT_INDEX_FULL_INTERVAL) if i]
+    if not intervals or _refresher["thread"] is not None:
+        return None
+    stop = _refresher["stop"]
+
+    def run():
+        from redis_client import create_redis
+
+        client = redis_conn if redis_conn is not None else create_redis(max_connections=1)
+        try:
+            while True:
+                try:
+                    refresh(client)
+                except Exception as e:
+                    log(f"❌ Indexation des numéros de contacts impossible : {e}", level="ERROR")
+                if stop.wait(min(intervals)):
+                    return
+        finally:
+            if redis_conn is None:
+                client.connection_pool.disconnect()
+
+    _refresher["thread"] = threading.Thread(target=run, name="contact-index", daemon=True)
+    _refresher["thread"].start()
+    return _refresher["thread"]
+
+
+def stop_index_refresher():
+    _refresher["stop"].set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Remplit la table ContactNumberIndex")
+    parser.add_argument("--full", action="store_true", help="réindexe tous les contacts")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from db_pool import get_pool
+    with get_pool().connection() as connection:
+        migrate(connection, full=args.full, batch_size=args.batch_size)
@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import threading
+from array import array
+from logger import log
+from phone import normalize_number
+
+# ⚙️ Mode "snapshot" : table Contact chargée en mémoire dans chaque worker
+CONTACT_SNAPSHOT = os.getenv("CONTACT_SNAPSHOT", "false").lower() == "true"
+CONTACT_SNAPSHOT_REFRESH = int(os.getenv("CONTACT_SNAPSHOT_REFRESH", "60"))
+CONTACT_SNAPSHOT_BATCH_SIZE = int(os.getenv("CONTACT_SNAPSHOT_BATCH_SIZE", "10000"))
+
+SELECT_SQL = (
+    "SELECT ID, name, number, contactsListID, subscribed FROM Contact "
+    "WHERE ID > %s ORDER BY ID LIMIT %s"
+)
+
+
+def number_key(number):
+    """Clé compacte : le numéro E.164 sous forme d'entier"""
+    normalized = normalize_number(number)
+    return int(normalized[1:]) if normalized else None
+
+
+class ContactSnapshot:
+    """Index en mémoire de la table Contact, clé = numéro normalisé.
+
+    Stockage en colonnes : un dict numéro → position, puis des `array`
+    pour ID / contactsListID / subscribed et une liste de noms internés.
+    Les ajouts sont rechargés par ID croissant ; une modification d'un
+    contact existant n'est vue qu'au prochain redémarrage du worker.
+    """
+
+    def __init__(self, pool, batch_size=CONTACT_SNAPSHOT_BATCH_SIZE):
+        self.pool = pool
+        self.batch_size = batch_size
+        self._slots = {}
+        self._ids = array("q")
+        self._list_ids = array("q")
+        self._subscribed = array("b")
+        self._names = []
+        self.max_id = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def lookup(self, number):
+        """Contact (dict) correspondant au numéro, sans aller-retour DB"""
+        key = number_key(number)
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        return {
+            "ID": self._ids[slot],
+            "name": self._names[slot],
+            "contactsListID": self._list_ids[slot],
+            "subscribed": bool(self._subscribed[slot]),
+        }
+
+    def lookup_name(self, number):
+        contact = self.lookup(number)
+        return contact["name"] if contact else None
+
+    def load(self):
+        """Chargement initial (ou rattrapage) par lots sur la clé primaire"""
+        start = time.perf_counter()
+        added = self.refresh()
+        log(f"📇 Snapshot contacts : {added} contacts chargés en {time.perf_counter() - start:.1f}s, "
+            f"{len(self._slots)} numéros, ~{self.memory_usage() // 1024} Kio (pid {os.getpid()})")
+        return added
+
+    def refresh(self):
+        """Ajoute les contacts d'ID > max_id. Retourne le nombre de lignes lues."""
+        total = 0
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                while True:
+                    cursor.execute(SELECT_SQL, [self.max_id, self.batch_size])
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    with self._lock:
+                        for row in rows:
+                            self._add(row)
+                        self.max_id = rows[-1]["ID"]
+                    total += len(rows)
+        return total
+
+    def start_refresher(self, interval=CONTACT_SNAPSHOT_REFRESH):
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    added = self.refresh()
+                    if added:
+                        log(f"📇 Snapshot contacts : +{added} contacts (max ID {self.max_id})")
+                except Exception as e:
+                    log(f"⚠️ Snapshot contacts : rafraîchissement impossible : {e}")
+
+        self._refresher = threading.Thread(target=run, name="contact-snapshot", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def memory_usage(self):
+        """Estimation en octets (index, colonnes et noms distincts)"""
+        names = {id(name): name for name in self._names if name is not None}
+        return (
+            sys.getsizeof(self._slots)
+            + sum(sys.getsizeof(key) for key in self._slots)
+            + self._ids.buffer_info()[1] * self._ids.itemsize
+            + self._list_ids.buffer_info()[1] * self._list_ids.itemsize
+            + self._subscribed.buffer_info()[1] * self._subscribed.itemsize
+            + sys.getsizeof(self._names)
+            + sum(sys.getsizeof(name) for name in names.values())
+        )
+
+    def _add(self, row):
+        key = number_key(row["number"])
+        if key is None:
+            return
+        name = sys.intern(row["name"]) if row["name"] else None
+        slot = self._slots.get(key)
+        if slot is not None:
+            # Doublon de numéro (plusieurs listes) : on garde le premier contact nommé
+            if self._names[slot] or not name:
+                return
+            self._names[slot] = name
+            self._ids[slot] = row["ID"]
+            self._list_ids[slot] = row["contactsListID"] or 0
+            self._subscribed[slot] = 1 if row["subscribed"] else 0
+            return
+        self._ids.append(row["ID"])
+        self._list_ids.append(row["contactsListID"] or 0)
+        self._subscribed.append(1 if row["subscribed"] else 0)
+        self._names.append(name)
+        # Position publiée en dernier : une lecture concurrente ne voit jamais de slot incomplet
+        self._slots[key] = len(self._ids) - 1
+
+
+_snapshot = None
+
+
+def init_snapshot(pool):
+    """Charge le snapshot du process courant si CONTACT_SNAPSHOT=true"""
+    global _snapshot
+    if not CONTACT_SNAPSHOT:
+        return None
+    snapshot = ContactSnapshot(pool)
+    try:
+        snapshot.load()
+    except Exception as e:
+        log(f"❌ Snapshot contacts : chargement impossible, retour aux requêtes DB : {e}")
+        return None
+    snapshot.start_refresher()
+    _snapshot = snapshot
+    return snapshot
+
+
+def get_snapshot():
+    return _snapshot
+
+
+def stop_snapshot():
+    global _snapshot
+    if _snapshot is not None:
+        _snapshot.stop()
+        _snapshot = None
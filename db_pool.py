@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from logger import log
+
+# ⚙️ Configuration du pool MySQL
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PING_INTERVAL = int(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+
+
+class PoolTimeout(Exception):
+    """Aucune connexion libérée avant l'expiration du délai d'attente"""
+
+
+def get_db_config():
+    """Paramètres de connexion depuis les variables d'environnement ou valeurs par défaut"""
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "user": os.getenv("DB_USER", "admin_a"),
+        "password": os.getenv("DB_PASS", "Metadjer12"),
+        "database": os.getenv("DB_NAME", "admin_a"),
+    }
+
+
+def connect_mysql():
+    import pymysql
+    # autocommit : une connexion réutilisée ne doit pas rester figée sur l'instantané d'une transaction
+    return pymysql.connect(
+        charset='utf8mb4',
+        autocommit=True,
+        cursorclass=pymysql.cursors.DictCursor,
+        **get_db_config()
+    )
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """Pool de connexions borné, thread-safe.
+
+    - `connect` : fabrique de connexions (pymysql par défaut, remplaçable par un faux driver)
+    - les connexions inactives depuis plus de `ping_interval` sont vérifiées par ping
+    - les connexions plus vieilles que `recycle` secondes sont recréées
+    - une connexion qui a levé une erreur pendant l'utilisation est jetée
+    """
+
+    def __init__(self, connect=connect_mysql, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 recycle=DB_POOL_RECYCLE, ping_interval=DB_POOL_PING_INTERVAL):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.counters = {
+            "checkouts": 0,
+            "created": 0,
+            "reconnects": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    @contextmanager
+    def connection(self):
+        pooled = self._checkout()
+        try:
+            yield pooled.conn
+        except Exception:
+            self._discard(pooled)
+            raise
+        else:
+            self._checkin(pooled)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close_quietly(pooled.conn)
+
+    def _checkout(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Pool MySQL épuisé ({self.max_size} connexions) après {self.timeout}s")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self.counters["checkouts"] += 1
+            self.counters["wait_time_total"] += waited
+            self.counters["wait_time_max"] = max(self.counters["wait_time_max"], waited)
+
+        try:
+            if pooled is None:
+                return self._create()
+            return self._ensure_healthy(pooled)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, pooled):
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def _discard(self, pooled):
+        self._close_quietly(pooled.conn)
+        with self._cond:
+            self._size -= 1
+            self.counters["discarded"] += 1
+            self._cond.notify()
+
+    def _create(self):
+        pooled = _PooledConnection(self._connect())
+        with self._cond:
+            self.counters["created"] += 1
+        return pooled
+
+    def _ensure_healthy(self, pooled):
+        now = time.monotonic()
+        if self.recycle and now - pooled.created_at > self.recycle:
+            self._close_quietly(pooled.conn)
+            return self._reconnect()
+        if now - pooled.last_used > self.ping_interval:
+            try:
+                pooled.conn.ping(reconnect=False)
+            except Exception as e:
+                log(f"⚠️ Connexion MySQL périmée, reconnexion : {e}")
+                self._close_quietly(pooled.conn)
+                return self._reconnect()
+        return pooled
+
+    def _reconnect(self):
+        pooled = self._create()
+        with self._cond:
+            self.counters["reconnects"] += 1
+        return pooled
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(**kwargs):
+    """Crée le pool du process courant.
+
+    Appelé au `worker_process_init` de Celery : le pool hérité du parent
+    (sockets partagées après fork) est abandonné sans être fermé.
+    """
+    global _pool
+    with _pool_lock:
+        _pool = ConnectionPool(**kwargs)
+    log(f"🛢️ Pool MySQL initialisé (max {_pool.max_size} connexions, pid {os.getpid()})")
+    return _pool
+
+
+def get_pool():
+    """Pool du process courant, créé à la demande hors worker Celery"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        log(f"🛢️ Fermeture du pool MySQL : {pool.stats()}")
+        pool.close()
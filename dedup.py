@@ -0,0 +1,389 @@
+"""Déduplication : messages déjà traités et numéros archivés.
+
+Disposition des clés Redis :
+- `processed:d:{AAAAMMJJ}` : set du jour, membres "{number}:{ID}", expire
+  après PROCESSED_RETENTION_DAYS (remplace les sets `processed:{number}`
+  qui n'expiraient jamais)
+- `processed:bloom:{AAAAMMJJ}` : filtre de Bloom optionnel du jour (chaîne
+  Redis utilisée comme tableau de bits), même expiration
+- `archived_numbers` : numéros archivés, permanent par défaut ; avec
+  ARCHIVE_RETENTION_DAYS > 0, sets du jour `archived:d:{AAAAMMJJ}` qui expirent,
+  et `archived_numbers` reste lu tant que la migration ne l'a pas vidé
+
+Migration et rapport mémoire :
+    python dedup.py migrate [--dry-run]
+    python dedup.py report
+"""
+import os
+import time
+import hashlib
+import argparse
+from datetime import datetime, timedelta, timezone
+from logger import log
+
+PROCESSED_RETENTION_DAYS = int(os.getenv("PROCESSED_RETENTION_DAYS", "7"))
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))  # 0 = archive permanente
+DEDUP_BLOOM = os.getenv("DEDUP_BLOOM", "false").lower() == "true"
+DEDUP_BLOOM_BITS = int(os.getenv("DEDUP_BLOOM_BITS", str(1 << 23)))  # 1 Mio par jour
+DEDUP_BLOOM_HASHES = int(os.getenv("DEDUP_BLOOM_HASHES", "7"))
+
+LEGACY_ARCHIVE_KEY = "archived_numbers"
+
+
+def _day(now, days_back=0):
+    return (datetime.fromtimestamp(now, timezone.utc) - timedelta(days=days_back)).strftime("%Y%m%d")
+
+
+def _bucket_expire_at(now, retention_days):
+    """Expiration d'un set du jour : fin du jour + rétention"""
+    day_start = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((day_start + timedelta(days=retention_days + 1)).timestamp())
+
+
+class DedupStore:
+    """Clés à utiliser pour un instant donné, partagées par le web, les scripts Lua et la migration"""
+
+    def __init__(self, retention_days=PROCESSED_RETENTION_DAYS, archive_retention_days=ARCHIVE_RETENTION_DAYS,
+                 bloom=DEDUP_BLOOM, bloom_bits=DEDUP_BLOOM_BITS, bloom_hashes=DEDUP_BLOOM_HASHES):
+        self.retention_days = max(1, retention_days)
+        self.archive_retention_days = archive_retention_days
+        self.bloom = bloom
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+
+    @staticmethod
+    def member(number, msg_id):
+        return f"{number}:{msg_id}"
+
+    def processed_keys(self, now=None):
+        """Sets encore conservés, du plus récent au plus ancien"""
+        now = now or time.time()
+        return [f"processed:d:{_day(now, i)}" for i in range(self.retention_days)]
+
+    def archive_keys(self, now=None):
+        """Sets à lire ; le premier est celui où l'on écrit.
+
+        Avec une rétention, l'ancien set permanent est lu en dernier : les
+        numéros archivés avant le changement de réglage restent archivés même
+        si `python dedup.py migrate` n'a pas encore tourné.
+        """
+        if self.archive_retention_days <= 0:
+            return [LEGACY_ARCHIVE_KEY]
+        now = now or time.time()
+        return [f"archived:d:{_day(now, i)}" for i in range(self.archive_retention_days)] + [LEGACY_ARCHIVE_KEY]
+
+    def processed_expire_at(self, now=None):
+        return _bucket_expire_at(now or time.time(), self.retention_days)
+
+    def archive_expire_at(self, now=None):
+        """0 si l'archive est permanente"""
+        if self.archive_retention_days <= 0:
+            return 0
+        return _bucket_expire_at(now or time.time(), self.archive_retention_days)
+
+    def bloom_keys(self, now=None):
+        now = now or time.time()
+        return [f"processed:bloom:{_day(now, i)}" for i in range(self.retention_days)]
+
+    def bloom_offsets(self, member):
+        """Positions des bits (double hachage sur un blake2b de 128 bits)"""
+        digest = hashlib.blake2b(member.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.bloom_bits for i in range(self.bloom_hashes)]
+
+    # Accès directs (hors scripts Lua)
+
+    def is_processed(self, redis_conn, number, msg_id):
+        member = self.member(number, msg_id)
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in self.processed_keys():
+            pipe.sismember(key, member)
+        return any(pipe.execute())
+
+    def mark_processed(self, redis_conn, number, msg_id):
+        now = time.time()
+        member = self.member(number, msg_id)
+        key = self.processed_keys(now)[0]
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.sadd(key, member)
+        pipe.expireat(key, self.processed_expire_at(now))
+        if self.bloom:
+            self._add_to_bloom(pipe, self.bloom_keys(now)[0], [member], self.processed_expire_at(now))
+        pipe.execute()
+
+    def is_archived(self, redis_conn, number):
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in self.archive_keys():
+            pipe.sismember(key, number)
+        return any(pipe.execute())
+
+    def archive(self, redis_conn, number):
+        now = time.time()
+        key = self.archive_keys(now)[0]
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.sadd(key, number)
+        if self.archive_expire_at(now):
+            pipe.expireat(key, self.archive_expire_at(now))
+        pipe.execute()
+
+    def _add_to_bloom(self, pipe, key, members, expire_at):
+        for member in members:
+            for offset in self.bloom_offsets(member):
+                pipe.setbit(key, offset, 1)
+        pipe.expireat(key, expire_at)
+
+    def processed_flags(self, redis_conn, members):
+        """Pour chaque membre : déjà traité ? (lot, nombre de commandes indépendant du lot)
+
+        Avec le filtre de Bloom, seuls les membres que le filtre signale
+        comme "peut-être présents" sont vérifiés dans les sets.
+        """
+        if not members:
+            return []
+        maybe = list(range(len(members)))
+        if self.bloom:
+            pipe = redis_conn.pipeline(transaction=False)
+            for key in self.bloom_keys():
+                bitfield = pipe.bitfield(key)
+                for member in members:
+                    for offset in self.bloom_offsets(member):
+                        bitfield.get("u1", offset)
+                bitfield.execute()
+            per_bucket = pipe.execute()
+            k = self.bloom_hashes
+            maybe = [
+                i for i in range(len(members))
+                if any(all(bits[i * k:(i + 1) * k]) for bits in per_bucket)
+            ]
+        flags = [False] * len(members)
+        if maybe:
+            pipe = redis_conn.pipeline(transaction=False)
+            for key in self.processed_keys():
+                pipe.smismember(key, [members[i] for i in maybe])
+            for bucket_flags in pipe.execute():
+                for i, flag in zip(maybe, bucket_flags):
+                    flags[i] = flags[i] or bool(flag)
+        return flags
+
+
+store = DedupStore()
+
+
+def filter_new_messages(redis_conn, messages, start=0, seen=None):
+    """Écarte, avant la mise en file, les messages que le worker ignorerait.
+
+    - numéro archivé : un SMISMEMBER par set d'archive
+    - message déjà traité : un SMISMEMBER par set du jour conservé
+      (précédé du filtre de Bloom si DEDUP_BLOOM=true)
+    - doublon (même numéro + ID) dans la même requête
+    - champs manquants (number / ID / deviceID)
+    Retourne ([(index, msg)], compteurs). Pour une requête lue par lots,
+    `start` décale les index et `seen` garde les doublons d'un lot à l'autre.
+    Le contrôle dans `process_message` reste la garde contre les courses.
+    """
+    candidates, skipped = _candidates(messages, start, seen)
+    if not candidates:
+        return [], skipped
+
+    numbers = list(dict.fromkeys(str(msg["number"]) for _, msg in candidates))
+    members = [store.member(msg["number"], msg["ID"]) for _, msg in candidates]
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in store.archive_keys():
+            pipe.smismember(key, numbers)
+        archived = {
+            number
+            for bucket_flags in pipe.execute()
+            for number, flag in zip(numbers, bucket_flags) if flag
+        }
+        processed_flags = store.processed_flags(redis_conn, members)
+    except Exception as e:
+        # Redis indisponible : on laisse passer, le worker refera les contrôles
+        log(f"⚠️ Filtrage anticipé impossible : {e}", level="WARNING")
+        return candidates, skipped
+    return _keep(candidates, archived, processed_flags, skipped), skipped
+
+
+async def filter_new_messages_async(redis_conn, messages, start=0, seen=None):
+    """`filter_new_messages` pour un client redis.asyncio.
+
+    Un seul aller-retour (archives et sets du jour dans le même pipeline),
+    sans le filtre de Bloom : les sets donnent directement la réponse exacte.
+    """
+    candidates, skipped = _candidates(messages, start, seen)
+    if not candidates:
+        return [], skipped
+
+    numbers = list(dict.fromkeys(str(msg["number"]) for _, msg in candidates))
+    members = [store.member(msg["number"], msg["ID"]) for _, msg in candidates]
+    archive_keys = store.archive_keys()
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in archive_keys:
+            pipe.smismember(key, numbers)
+        for key in store.processed_keys():
+            pipe.smismember(key, members)
+        replies = await pipe.execute()
+    except Exception as e:
+        log(f"⚠️ Filtrage anticipé impossible : {e}", level="WARNING")
+        return candidates, skipped
+    archived = {
+        number
+        for bucket_flags in replies[:len(archive_keys)]
+        for number, flag in zip(numbers, bucket_flags) if flag
+    }
+    processed_flags = [any(flags) for flags in zip(*replies[len(archive_keys):])]
+    return _keep(candidates, archived, processed_flags, skipped), skipped
+
+
+def _candidates(messages, start, seen):
+    """Messages complets et non dupliqués dans la requête, avec les compteurs d'écartés"""
+    skipped = {"archived": 0, "duplicate": 0, "invalid": 0}
+    candidates = []
+    seen = set() if seen is None else seen
+    for i, msg in enumerate(messages, start):
+        if not isinstance(msg, dict) or not msg.get("number") or not msg.get("ID") or not msg.get("deviceID"):
+            skipped["invalid"] += 1
+            continue
+        key = (str(msg["number"]), str(msg["ID"]))
+        if key in seen:
+            skipped["duplicate"] += 1
+            continue
+        seen.add(key)
+        candidates.append((i, msg))
+    return candidates, skipped
+
+
+def _keep(candidates, archived, processed_flags, skipped):
+    kept = []
+    for (i, msg), processed in zip(candidates, processed_flags):
+        if str(msg["number"]) in archived:
+            skipped["archived"] += 1
+        elif processed:
+            skipped["duplicate"] += 1
+        else:
+            kept.append((i, msg))
+    return kept
+
+
+# 🔁 Migration depuis les sets `processed:{number}` et rapport mémoire
+
+def _legacy_processed_keys(redis_conn):
+    for key in redis_conn.scan_iter(match="processed:*", count=1000):
+        name = key.decode() if isinstance(key, bytes) else key
+        if not name.startswith(("processed:d:", "processed:bloom:")):
+            yield name
+
+
+def migrate(redis_conn, dry_run=False, batch_size=500):
+    """Déplace les anciens sets dans le set du jour (qui expirera normalement)"""
+    now = time.time()
+    bucket = store.processed_keys(now)[0]
+    expire_at = store.processed_expire_at(now)
+    moved_keys = moved_members = 0
+    batch = []
+
+    def flush(batch):
+        pipe = redis_conn.pipeline(transaction=False)
+        for name in batch:
+            pipe.smembers(name)
+        contents = pipe.execute()
+        members = [store.member(name[len("processed:"):], (m.decode() if isinstance(m, bytes) else m))
+                   for name, ids in zip(batch, contents) for m in ids]
+        if not dry_run:
+            pipe = redis_conn.pipeline(transaction=False)
+            if members:
+                pipe.sadd(bucket, *members)
+                pipe.expireat(bucket, expire_at)
+                if store.bloom:
+                    store._add_to_bloom(pipe, store.bloom_keys(now)[0], members, expire_at)
+            pipe.delete(*batch)
+            pipe.execute()
+        return len(members)
+
+    for name in _legacy_processed_keys(redis_conn):
+        batch.append(name)
+        if len(batch) >= batch_size:
+            moved_members += flush(batch)
+            moved_keys += len(batch)
+            batch = []
+    if batch:
+        moved_members += flush(batch)
+        moved_keys += len(batch)
+
+    archived_moved = 0
+    if store.archive_retention_days > 0 and not dry_run:
+        archive_bucket = store.archive_keys(now)[0]
+        archive_expire_at = store.archive_expire_at(now)
+        numbers = []
+
+        def flush_archive(numbers):
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.sadd(archive_bucket, *numbers)
+            pipe.expireat(archive_bucket, archive_expire_at)
+            pipe.execute()
+            return len(numbers)
+
+        for number in redis_conn.sscan_iter(LEGACY_ARCHIVE_KEY, count=1000):
+            numbers.append(number)
+            if len(numbers) >= batch_size:
+                archived_moved += flush_archive(numbers)
+                numbers = []
+        if numbers:
+            archived_moved += flush_archive(numbers)
+        # Tous les lots sont copiés : l'ancien set peut disparaître (sinon il reste lu et la migration se rejoue)
+        redis_conn.delete(LEGACY_ARCHIVE_KEY)
+
+    action = "à migrer" if dry_run else "migrés"
+    log(f"🔁 Dédup : {moved_keys} sets processed:{{number}} ({moved_members} IDs) {action} vers {bucket}, "
+        f"{archived_moved} numéros archivés déplacés")
+    return moved_keys, moved_members
+
+
+def _memory_usage(redis_conn, key):
+    try:
+        return redis_conn.memory_usage(key, samples=0) or 0
+    except Exception:
+        return 0
+
+
+def memory_report(redis_conn, sample_size=1000):
+    """Compare l'empreinte des anciens sets (estimée par échantillon) et des nouvelles clés"""
+    legacy_count = 0
+    sampled = []
+    for name in _legacy_processed_keys(redis_conn):
+        legacy_count += 1
+        if len(sampled) < sample_size:
+            sampled.append(_memory_usage(redis_conn, name))
+    legacy_bytes = int(sum(sampled) / len(sampled) * legacy_count) if sampled else 0
+
+    new_keys = store.processed_keys() + (store.bloom_keys() if store.bloom else [])
+    if store.archive_retention_days > 0:
+        new_keys += store.archive_keys()[:-1]
+    new_bytes = sum(_memory_usage(redis_conn, key) for key in new_keys)
+
+    report = {
+        "legacy_processed_keys": legacy_count,
+        "legacy_processed_bytes_estimate": legacy_bytes,
+        "archived_numbers_bytes": _memory_usage(redis_conn, LEGACY_ARCHIVE_KEY),
+        "bucket_keys": len(new_keys),
+        "bucket_bytes": new_bytes,
+    }
+    for name, value in report.items():
+        print(f"{name:<34} {value:>14,}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migration et rapport mémoire des clés de déduplication")
+    parser.add_argument("command", choices=["migrate", "report"])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    from redis_client import get_redis
+    redis_conn = get_redis()
+    if args.command == "migrate":
+        memory_report(redis_conn)
+        migrate(redis_conn, dry_run=args.dry_run)
+    memory_report(redis_conn)
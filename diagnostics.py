@@ -0,0 +1,195 @@
+"""Diagnostics manuels, autrefois lancés à l'import de `tasks.py`.
+
+    python diagnostics.py config          # configuration (secrets masqués) et connectivité
+    python diagnostics.py contacts-db     # affiche la table Contact (--limit N)
+    python diagnostics.py contacts-api    # teste les endpoints de contacts de la passerelle
+"""
+import os
+import json
+import argparse
+from http_client import get_client
+from db_pool import get_db_config, get_pool
+from endpoint_discovery import get_contact_endpoints_to_test
+
+SERVER = os.getenv("SERVER")
+API_KEY = os.getenv("API_KEY")
+SECOND_MESSAGE_LINK = os.getenv("SECOND_MESSAGE_LINK")
+
+
+def mask(secret):
+    """Ne montre que les 4 premiers caractères d'un secret"""
+    if not secret:
+        return "None"
+    return f"{secret[:4]}…({len(secret)} car.)"
+
+
+def masked_params(params):
+    if not params:
+        return params
+    return {k: mask(v) if k == 'key' else v for k, v in params.items()}
+
+
+def check_config():
+    """Configuration effective et connectivité Redis / MySQL"""
+    from redis_client import REDIS_URL, create_redis
+
+    db_config = get_db_config()
+    print(f"SERVER: {SERVER}")
+    print(f"API_KEY: {mask(API_KEY)}")
+    print(f"SECOND_MESSAGE_LINK: {SECOND_MESSAGE_LINK}")
+    print(f"DB: {db_config['user']}@{db_config['host']}/{db_config['database']} (mot de passe {mask(db_config['password'])})")
+
+    try:
+        create_redis(REDIS_URL, max_connections=1).ping()
+        print("✅ Redis joignable")
+    except Exception as e:
+        print(f"❌ Redis : {e}")
+    try:
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) AS n FROM Contact")
+                print(f"✅ MySQL joignable : {cursor.fetchone()['n']} contacts")
+    except Exception as e:
+        print(f"❌ MySQL : {e}")
+
+
+# 🧪 Fonction de test pour récupérer tous les contacts
+# 
+# ⚠️ NOTE: Si aucun endpoint ne fonctionne, vérifiez dans votre dashboard noname-sms.com:
+#   1. Allez sur https://noname-sms.com/dashboard.php
+#   2. Cherchez une section "API" ou "Documentation"
+#   3. Vérifiez s'il y a un endpoint spécifique pour récupérer les contacts
+#   4. Il est possible que l'API ne permette pas de récupérer les contacts directement
+#      Dans ce cas, vous devrez peut-être stocker les contacts localement ou utiliser une autre méthode
+#
+def test_get_all_contacts():
+    """Test pour récupérer tous les contacts et les afficher"""
+    import requests
+    http = get_client()
+    print(f"\n{'='*60}")
+    print("🧪 TEST: Récupération de TOUS les contacts")
+    print(f"{'='*60}")
+    print(f"SERVER: {SERVER}")
+    print(f"API_KEY: {mask(API_KEY)}")
+    
+    endpoints_to_test = get_contact_endpoints_to_test()
+    
+    for endpoint, method, params in endpoints_to_test:
+        try:
+            print(f"\n🔍 Test endpoint: {endpoint.replace(API_KEY, mask(API_KEY)) if API_KEY else endpoint}")
+            print(f"   Méthode: {method}, Params: {masked_params(params)}")
+            
+            if method == "POST":
+                if params:
+                    response = http.post(endpoint, data=params, idempotent=True)
+                else:
+                    response = http.post(endpoint, idempotent=True)
+            else:  # GET
+                if params:
+                    response = http.get(endpoint, params=params)
+                else:
+                    response = http.get(endpoint)
+            
+            print(f"📡 Status Code: {response.status_code}")
+            print(f"📡 URL finale: {response.url.replace(API_KEY, mask(API_KEY)) if API_KEY else response.url}")
+            
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                    print(f"\n✅ SUCCÈS! RÉPONSE JSON:")
+                    print(json.dumps(data, indent=2, ensure_ascii=False))
+                    
+                    contacts = data.get("data") or data.get("contacts") or data.get("result") or data
+                    print(f"\n📋 CONTACTS EXTRACTÉS:")
+                    print(f"Type: {type(contacts)}")
+                    
+                    if isinstance(contacts, list):
+                        print(f"✅ Nombre de contacts: {len(contacts)}")
+                        for idx, contact in enumerate(contacts, 1):
+                            print(f"\n  Contact #{idx}:")
+                            print(json.dumps(contact, indent=4, ensure_ascii=False))
+                    elif isinstance(contacts, dict):
+                        print(f"✅ Contact unique (dict):")
+                        print(json.dumps(contacts, indent=4, ensure_ascii=False))
+                    else:
+                        print(f"Contenu: {contacts}")
+                    
+                    print(f"\n{'='*60}\n")
+                    print(f"🎉 ENDPOINT TROUVÉ: {endpoint} avec méthode {method}")
+                    return data
+                except json.JSONDecodeError:
+                    print(f"⚠️ Réponse n'est pas du JSON")
+                    print(f"Contenu (premiers 500 chars): {response.text[:500]}")
+            elif response.status_code == 404:
+                print(f"❌ 404 - Endpoint non trouvé")
+            else:
+                print(f"❌ Erreur HTTP {response.status_code}")
+                print(f"Réponse (premiers 500 chars): {response.text[:500]}")
+        except requests.exceptions.Timeout:
+            print(f"⏱️ Timeout - endpoint ne répond pas")
+        except Exception as e:
+            print(f"❌ Exception: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    print(f"\n{'='*60}")
+    print("❌ Aucun endpoint valide trouvé pour récupérer les contacts")
+    print(f"{'='*60}\n")
+    return None
+
+def test_get_all_contacts_from_db(limit=None):
+    """Test pour récupérer tous les contacts depuis la base de données MySQL"""
+    try:
+        db_config = get_db_config()
+        
+        print(f"\n{'='*60}")
+        print("🧪 TEST: Récupération de TOUS les contacts depuis la BASE DE DONNÉES")
+        print(f"{'='*60}")
+        print(f"Host: {db_config['host']}")
+        print(f"User: {db_config['user']}")
+        print(f"Database: {db_config['database']}")
+        
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                # Récupérer tous les contacts
+                sql = "SELECT name, number, contactsListID, subscribed, ID FROM Contact ORDER BY number"
+                if limit:
+                    sql += f" LIMIT {int(limit)}"
+                cursor.execute(sql)
+                all_contacts = cursor.fetchall()
+                
+                print(f"\n✅ Nombre total de contacts: {len(all_contacts)}")
+                print(f"\n📋 TOUS LES CONTACTS:")
+                print(f"{'='*60}")
+                
+                for idx, contact in enumerate(all_contacts, 1):
+                    print(f"\n  Contact #{idx}:")
+                    print(f"    ID: {contact.get('ID')}")
+                    print(f"    Nom: {contact.get('name') or '(sans nom)'}")
+                    print(f"    Numéro: {contact.get('number')}")
+                    print(f"    Liste ID: {contact.get('contactsListID')}")
+                    print(f"    Abonné: {contact.get('subscribed')}")
+                
+                print(f"\n{'='*60}\n")
+            
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Diagnostics manuels (contacts, configuration)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("config", help="configuration et connectivité")
+    db_parser = sub.add_parser("contacts-db", help="affiche les contacts de la base MySQL")
+    db_parser.add_argument("--limit", type=int, default=None)
+    sub.add_parser("contacts-api", help="teste les endpoints de contacts de l'API")
+    args = parser.parse_args()
+
+    if args.command == "config":
+        check_config()
+    elif args.command == "contacts-db":
+        test_get_all_contacts_from_db(limit=args.limit)
+    else:
+        test_get_all_contacts()
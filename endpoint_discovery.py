@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import threading
+from logger import log
+from phone import normalize_number
+from http_client import get_client
+
+SERVER = os.getenv("SERVER")
+API_KEY = os.getenv("API_KEY")
+
+# ⚙️ Mémorisation de l'endpoint de contacts qui fonctionne
+DISCOVERY_TTL = int(os.getenv("DISCOVERY_TTL", "86400"))
+DISCOVERY_NONE_TTL = int(os.getenv("DISCOVERY_NONE_TTL", "3600"))
+DISCOVERY_MAX_FAILURES = int(os.getenv("DISCOVERY_MAX_FAILURES", "3"))
+CONTACT_LIST_TTL = int(os.getenv("CONTACT_LIST_TTL", "900"))
+DISCOVERY_PROBE_WAIT = float(os.getenv("DISCOVERY_PROBE_WAIT", "15"))  # attente de la sonde d'un autre process
+PROBE_LOCK_TTL = 300
+
+DISCOVERY_KEY = "contacts:endpoint"
+PROBE_LOCK_KEY = "contacts:endpoint:probing"
+CONTACT_LIST_KEY = "contacts:all"
+LOADED_FIELD = "__loaded__"
+
+
+# 🧪 Fonction helper pour obtenir la liste des endpoints à tester
+def get_contact_endpoints_to_test():
+    """Retourne une liste de tuples (endpoint, method, params) à tester"""
+    return [
+        # Format /services/...
+        (f"{SERVER}/services/contact.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/services/contacts.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/services/get_contact.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/services/get_contacts.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/services/contact_list.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/services/list_contacts.php", "POST", {'key': API_KEY}),
+        # Format /api/...
+        (f"{SERVER}/api/contact.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/api/contacts.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/api/get_contacts.php", "POST", {'key': API_KEY}),
+        # Format avec action
+        (f"{SERVER}/api.php", "POST", {'key': API_KEY, 'action': 'contacts'}),
+        (f"{SERVER}/api.php", "POST", {'key': API_KEY, 'action': 'get_contacts'}),
+        (f"{SERVER}/api.php", "POST", {'key': API_KEY, 'action': 'list_contacts'}),
+        (f"{SERVER}/services/api.php", "POST", {'key': API_KEY, 'action': 'contacts'}),
+        # Format GET
+        (f"{SERVER}/services/contacts.php", "GET", {'key': API_KEY}),
+        (f"{SERVER}/api/contacts.php", "GET", {'key': API_KEY}),
+        (f"{SERVER}/api.php", "GET", {'key': API_KEY, 'action': 'contacts'}),
+        # Format dashboard
+        (f"{SERVER}/dashboard/api/contacts.php", "POST", {'key': API_KEY}),
+        (f"{SERVER}/dashboard/services/contacts.php", "POST", {'key': API_KEY}),
+    ]
+
+
+def extract_contacts(data):
+    """Liste de contacts, contact unique (dict) ou None selon la forme de la réponse"""
+    if isinstance(data, list):
+        return data
+    if not isinstance(data, dict):
+        return None
+    contacts = data.get("data") or data.get("contacts") or data.get("result") or data
+    if isinstance(contacts, list):
+        return contacts
+    if isinstance(contacts, dict) and (contact_name(contacts) or contact_number(contacts)):
+        return contacts
+    return None
+
+
+def contact_number(contact):
+    return str(contact.get("number") or contact.get("mobile") or contact.get("phone") or "").strip()
+
+
+def contact_name(contact):
+    return contact.get("name") or contact.get("contact_name") or ""
+
+
+def find_name(contacts, number):
+    if isinstance(contacts, dict):
+        return contact_name(contacts) or None
+    target = normalize_number(number)
+    for contact in contacts:
+        if isinstance(contact, dict) and normalize_number(contact_number(contact)) == target:
+            name = contact_name(contact)
+            if name:
+                return name
+    return None
+
+
+def mask_key(text):
+    """Texte loggable : la clé d'API (URL, message d'erreur de requests) est masquée"""
+    text = str(text)
+    return text.replace(API_KEY, "***") if API_KEY else text
+
+
+class EndpointFailure(Exception):
+    """L'endpoint mémorisé ne répond plus comme attendu"""
+
+
+class EndpointDiscovery:
+    """Sonde une fois les 18 endpoints candidats, puis n'appelle que celui qui marche.
+
+    Le résultat (endpoint, méthode, mode "by_number" ou "all") est gardé dans
+    Redis (`contacts:endpoint`) avec un TTL, y compris "aucun endpoint" (TTL
+    plus court). Après DISCOVERY_MAX_FAILURES échecs consécutifs de l'endpoint
+    mémorisé, un seul process relance la sonde en arrière-plan. La première
+    sonde est elle aussi réservée à un process (`contacts:endpoint:probing`) :
+    les autres attendent son résultat jusqu'à DISCOVERY_PROBE_WAIT secondes.
+    La clé d'API n'est jamais mémorisée : seuls les autres paramètres le sont.
+    En mode "all", la liste complète téléchargée est gardée dans le hash
+    `contacts:all` (numéro normalisé → nom) pendant CONTACT_LIST_TTL.
+    """
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self.failures = 0
+        self._local = None  # (record, expiration monotonic)
+
+    def lookup_name(self, number):
+        record = self.known_endpoint()
+        if record is None:
+            record = self._first_probe(number)
+        if record.get("none"):
+            return None
+        try:
+            if record["mode"] == "all":
+                name = self._name_from_contact_list(record, number)
+            else:
+                name = find_name(self._call(record, number), number)
+        except Exception as e:
+            self._on_failure(record, e)
+            # échec de l'appel, pas une absence de nom : l'appelant ne la met pas en cache
+            raise EndpointFailure(mask_key(e)) from e
+        self.failures = 0
+        return name
+
+    def known_endpoint(self):
+        if self._local and self._local[1] > time.monotonic():
+            return self._local[0]
+        raw = self.redis_conn.get(DISCOVERY_KEY)
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        if "key=" in record.get("url", ""):
+            return None  # ancien enregistrement avec la clé dans l'URL : nouvelle sonde
+        self._local = (record, time.monotonic() + 30)
+        return record
+
+    def _first_probe(self, number):
+        """Sonde sous verrou ; sans le verrou, attend l'endpoint trouvé par un autre process"""
+        if self.redis_conn.set(PROBE_LOCK_KEY, os.getpid(), nx=True, ex=PROBE_LOCK_TTL):
+            try:
+                return self.probe(number)
+            finally:
+                self.redis_conn.delete(PROBE_LOCK_KEY)
+        deadline = time.monotonic() + DISCOVERY_PROBE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            record = self.known_endpoint()
+            if record is not None:
+                return record
+        raise EndpointFailure("découverte de l'endpoint en cours dans un autre process")
+
+    def probe(self, number=None):
+        """Teste les endpoints (avec puis sans numéro) et mémorise le premier qui répond"""
+        log("🧭 Découverte de l'endpoint de contacts…")
+        http = get_client()
+        attempts = []
+        if number is not None:
+            attempts += [(candidate, "by_number") for candidate in get_contact_endpoints_to_test()]
+        attempts += [(candidate, "all") for candidate in get_contact_endpoints_to_test()]
+
+        for (endpoint, method, base_params), mode in attempts:
+            params = dict(base_params) if base_params else {'key': API_KEY}
+            if mode == "by_number":
+                params['number'] = number
+            try:
+                if method == "POST":
+                    response = http.post(endpoint, data=params, idempotent=True)
+                else:
+                    response = http.get(endpoint, params=params)
+                if response.status_code != 200:
+                    continue
+                contacts = extract_contacts(response.json())
+            except Exception:
+                continue
+            if contacts is None or (mode == "all" and not isinstance(contacts, list)):
+                continue
+            # Une liste renvoyée malgré le numéro : l'endpoint ignore le filtre
+            if isinstance(contacts, list):
+                mode = "all"
+            record = {
+                "url": endpoint,
+                "method": method,
+                "params": {k: v for k, v in (base_params or {}).items() if k != 'key'},
+                "keyed": base_params is not None,
+                "mode": mode,
+            }
+            log(f"🧭 Endpoint de contacts retenu : {method} {mask_key(endpoint)} (mode {mode})")
+            self._save(record, DISCOVERY_TTL)
+            return record
+
+        log("🧭 Aucun endpoint de contacts ne fonctionne", level="WARNING")
+        record = {"none": True}
+        self._save(record, DISCOVERY_NONE_TTL)
+        return record
+
+    def reprobe_async(self):
+        """Nouvelle découverte en arrière-plan, par un seul process à la fois"""
+        if not self.redis_conn.set(PROBE_LOCK_KEY, os.getpid(), nx=True, ex=PROBE_LOCK_TTL):
+            return False
+
+        def run():
+            try:
+                self.probe()
+                self.failures = 0
+            except Exception as e:
+                log(f"⚠️ Découverte de l'endpoint impossible : {mask_key(e)}", level="WARNING")
+            finally:
+                self.redis_conn.delete(PROBE_LOCK_KEY)
+
+        threading.Thread(target=run, name="endpoint-discovery", daemon=True).start()
+        return True
+
+    def _save(self, record, ttl):
+        record["found_at"] = int(time.time())
+        self.redis_conn.set(DISCOVERY_KEY, json.dumps(record), ex=ttl)
+        self.redis_conn.delete(CONTACT_LIST_KEY)
+        self._local = (record, time.monotonic() + 30)
+
+    def _call(self, record, number=None):
+        params = dict(record["params"])
+        if record["keyed"]:
+            params['key'] = API_KEY
+        if number is not None:
+            params['number'] = number
+        http = get_client()
+        if record["method"] == "POST":
+            response = http.post(record["url"], data=params, idempotent=True)
+        else:
+            response = http.get(record["url"], params=params or None)
+        if response.status_code != 200:
+            raise EndpointFailure(f"HTTP {response.status_code}")
+        contacts = extract_contacts(response.json())
+        if contacts is None:
+            raise EndpointFailure("réponse sans contacts")
+        return contacts
+
+    def _name_from_contact_list(self, record, number):
+        target = normalize_number(number)
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.hget(CONTACT_LIST_KEY, target)
+        pipe.hexists(CONTACT_LIST_KEY, LOADED_FIELD)
+        name, loaded = pipe.execute()
+        if loaded:
+            return name.decode() if isinstance(name, bytes) else name
+
+        contacts = self._call(record)
+        mapping = {}
+        for contact in contacts:
+            if isinstance(contact, dict):
+                key, name = normalize_number(contact_number(contact)), contact_name(contact)
+                if key and name:
+                    mapping.setdefault(key, name)
+        mapping[LOADED_FIELD] = int(time.time())
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.delete(CONTACT_LIST_KEY)
+        pipe.hset(CONTACT_LIST_KEY, mapping=mapping)
+        pipe.expire(CONTACT_LIST_KEY, CONTACT_LIST_TTL)
+        pipe.execute()
+        log(f"📋 Liste de contacts téléchargée et mise en cache : {len(mapping) - 1} numéros")
+        return mapping.get(target)
+
+    def _on_failure(self, record, error):
+        self.failures += 1
+        log(f"⚠️ Endpoint de contacts {mask_key(record.get('url'))} en échec ({self.failures}) : "
+            f"{mask_key(error)}", level="WARNING")
+        if self.failures >= DISCOVERY_MAX_FAILURES and self.reprobe_async():
+            log("🧭 Nouvelle découverte de l'endpoint lancée en arrière-plan")
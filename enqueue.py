@@ -0,0 +1,109 @@
+import time
+import base64
+from kombu import serialization
+from kombu.utils.json import dumps as kombu_dumps, loads as kombu_loads
+from kombu.utils.uuid import uuid
+from celery_worker import celery
+from scheduler import delayed_key, scheduler_enabled, scheduler_enabled_async
+
+
+def build_task_message(task_name, args=(), kwargs=None, countdown=None, queue=None, headers=None):
+    """Message de tâche Celery (protocole 2) tel que le transport Redis de kombu le pousse.
+
+    Retourne (task_id, queue, message JSON). Le message est identique à celui
+    produit par `apply_async` : le worker le consomme sans distinction.
+    """
+    task_id = uuid()
+    queue = queue or celery.conf.task_default_queue
+    task = celery.amqp.create_task_message(task_id, task_name, args, kwargs, countdown=countdown)
+    content_type, content_encoding, body = serialization.dumps(
+        task.body, serializer=celery.conf.task_serializer)
+    if isinstance(body, str):
+        body = body.encode(content_encoding or "utf-8")
+    message = {
+        "body": base64.b64encode(body).decode("ascii"),
+        "content-encoding": content_encoding,
+        "content-type": content_type,
+        "headers": {**task.headers, **(headers or {})},
+        "properties": {
+            **task.properties,
+            "delivery_mode": 2,
+            "delivery_info": {"exchange": "", "routing_key": queue},
+            "priority": 0,
+            "body_encoding": "base64",
+            "delivery_tag": uuid(),
+        },
+    }
+    return task_id, queue, kombu_dumps(message)
+
+
+def decode_task_message(raw):
+    """Inverse de `build_task_message` : (en-têtes, args, kwargs) d'un message lu dans la file"""
+    message = kombu_loads(raw)
+    body = message["body"]
+    if message.get("properties", {}).get("body_encoding") == "base64":
+        body = base64.b64decode(body)
+    args, kwargs, _embed = serialization.loads(
+        body, message["content-type"], message["content-encoding"], accept=serialization.prepare_accept_content(celery.conf.accept_content))
+    return message["headers"], args, kwargs
+
+
+def enqueue_batch(redis_conn, task_name, jobs, queue=None, headers=None):
+    """Publie toutes les tâches d'une requête en un seul pipeline Redis.
+
+    `jobs` : liste de (args, countdown). `headers` (ex. request_id) est ajouté
+    à chaque message.
+    Retourne une liste alignée sur `jobs` de (task_id, erreur) ; erreur vaut
+    None si le message est en file. Si l'ordonnanceur est actif, les tâches
+    différées vont dans `delayed:{file}` (sans ETA) au lieu de la file.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    delayed = any(countdown for _, countdown in jobs) and scheduler_enabled(redis_conn)
+    results, pushed = _stage_jobs(pipe, task_name, jobs, queue, headers, delayed)
+    if pushed:
+        try:
+            replies = pipe.execute(raise_on_error=False)
+        except Exception as e:
+            # Connexion perdue : aucun message du lot n'est garanti en file
+            replies = [e] * len(pushed)
+        _collect(results, pushed, replies)
+    return results
+
+
+async def enqueue_batch_async(redis_conn, task_name, jobs, queue=None, headers=None):
+    """`enqueue_batch` pour un client redis.asyncio (même format, même retour)"""
+    pipe = redis_conn.pipeline(transaction=False)
+    delayed = any(countdown for _, countdown in jobs) and await scheduler_enabled_async(redis_conn)
+    results, pushed = _stage_jobs(pipe, task_name, jobs, queue, headers, delayed)
+    if pushed:
+        try:
+            replies = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            replies = [e] * len(pushed)
+        _collect(results, pushed, replies)
+    return results
+
+
+def _stage_jobs(pipe, task_name, jobs, queue, headers, delayed):
+    """Ajoute les messages au pipeline ; retourne (résultats partiels, [(index, task_id)] ajoutés)"""
+    results = [None] * len(jobs)
+    pushed = []
+    now = time.time()
+    for i, (args, countdown) in enumerate(jobs):
+        try:
+            if delayed and countdown:
+                task_id, target, message = build_task_message(task_name, args, queue=queue, headers=headers)
+                pipe.zadd(delayed_key(target), {message: now + countdown})
+            else:
+                task_id, target, message = build_task_message(task_name, args, countdown=countdown, queue=queue, headers=headers)
+                pipe.lpush(target, message)
+        except Exception as e:
+            results[i] = (None, e)
+            continue
+        pushed.append((i, task_id))
+    return results, pushed
+
+
+def _collect(results, pushed, replies):
+    for (i, task_id), reply in zip(pushed, replies):
+        results[i] = (None, reply) if isinstance(reply, Exception) else (task_id, None)
@@ -0,0 +1,17 @@
+from logger import shutdown_logging
+from startup import STARTUP_MODE, warm_up
+
+# 🚀 Mode eager : connexion Redis ouverte avant la première requête
+def post_worker_init(worker):
+    if STARTUP_MODE == "eager":
+        from app import redis_conn
+        warm_up(redis_conn, db=False, http=False)
+
+# 📈 Métriques multiprocess : les jauges d'un worker gunicorn mort ne comptent plus
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+# 🧹 Vider la file de logs quand un worker gunicorn s'arrête
+def worker_exit(server, worker):
+    shutdown_logging()
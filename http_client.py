@@ -0,0 +1,139 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from urllib.parse import urlsplit
+from logger import log
+from metrics import HTTP_REQUEST_LATENCY
+
+# ⚙️ Configuration des appels HTTP sortants (passerelle SMS)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.3"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+RETRY_STATUSES = {502, 503, 504}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class LatencyHistogram:
+    """Histogramme cumulatif (bornes supérieures en secondes), à la Prometheus"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def snapshot(self):
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        return {"count": self.count, "sum": round(self.total, 3), "errors": self.errors, "buckets": cumulative}
+
+
+class HttpClient:
+    """Session requests partagée : connexions keep-alive, timeouts, retries bornés.
+
+    Les retries (backoff exponentiel) ne s'appliquent qu'aux appels
+    idempotents : GET/HEAD par défaut, ou `idempotent=True` pour un POST de
+    lecture. L'envoi de SMS n'est jamais rejoué.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pid = os.getpid()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        import requests
+
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD")
+        kwargs.setdefault("timeout", self.timeout)
+        attempts = 1 + (self.retries if idempotent else 0)
+        endpoint = f"{method} {urlsplit(url).path or '/'}"
+
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._observe(endpoint, time.perf_counter() - start, error=True)
+                if attempt + 1 >= attempts:
+                    raise
+            else:
+                failed = response.status_code >= 500
+                self._observe(endpoint, time.perf_counter() - start, error=failed)
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    return response
+            delay = self.backoff * (2 ** attempt)
+            log(f"🔁 {endpoint} : nouvel essai {attempt + 2}/{attempts} dans {delay:.2f}s", level="WARNING")
+            time.sleep(delay)
+
+    def stats(self):
+        """Histogrammes de latence par endpoint ("MÉTHODE /chemin")"""
+        with self._lock:
+            return {endpoint: histogram.snapshot() for endpoint, histogram in self._histograms.items()}
+
+    def close(self):
+        self.session.close()
+
+    def _observe(self, endpoint, seconds, error=False):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = LatencyHistogram()
+            histogram.observe(seconds, error)
+        HTTP_REQUEST_LATENCY.labels(endpoint, "true" if error else "false").observe(seconds)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Client du process courant (recréé après un fork : pas de socket partagée)"""
+    global _client
+    client = _client
+    if client is None or client.pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client.pid != os.getpid():
+                _client = HttpClient()
+            client = _client
+    return client
+
+
+def close_client():
+    global _client
+    client, _client = _client, None
+    if client is not None and client.pid == os.getpid():
+        log(f"🌐 Latences HTTP : {client.stats()}")
+        client.close()
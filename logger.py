@@ -1,13 +1,338 @@
 import os
+import sys
+import time
+import queue
+import fcntl
+import atexit
+import bisect
+import threading
+from collections import deque
 from datetime import datetime, timezone
 
 LOG_FILE = "/tmp/log.txt"
 
-def log(text):
+# 🗂️ Rotation par taille + index latéral horodatage → offset (log.txt.idx)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_INDEX_EVERY = int(os.getenv("LOG_INDEX_EVERY", str(64 * 1024)))
+
+# ⚙️ Configuration de l'écriture asynchrone
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()  # INFO en production pour couper les dumps de payload
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")  # "drop" ou "block" quand la file est pleine
+LOG_BLOCK_TIMEOUT = float(os.getenv("LOG_BLOCK_TIMEOUT", "1"))
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "true").lower() == "true"
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+_min_level = LEVELS.get(LOG_LEVEL, LEVELS["DEBUG"])
+
+_STOP = object()
+
+
+class _AsyncWriter:
+    """Thread d'écriture : regroupe les lignes et les écrit par lots.
+
+    Un lot part dès que LOG_BATCH_SIZE lignes sont en attente ou, au plus
+    tard, LOG_FLUSH_INTERVAL secondes après sa première ligne.
+    """
+
+    def __init__(self, path=LOG_FILE):
+        self.path = path
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, line):
+        try:
+            if LOG_QUEUE_POLICY == "block":
+                self.queue.put(line, timeout=LOG_BLOCK_TIMEOUT)
+            else:
+                self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout=2.0):
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [line for line in batch if line is not _STOP]
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+            self._write(batch)
+
+    def _write(self, batch):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            batch.append(_format(f"⚠️ {dropped} lignes de log perdues (file pleine)", "WARNING"))
+        if not batch:
+            return
+        chunk = "".join(batch)
+        try:
+            if LOG_CONSOLE:
+                sys.stdout.write(chunk)
+                sys.stdout.flush()
+            _append(self.path, chunk.encode("utf-8"), _line_epoch(batch[0]))
+        except Exception as e:
+            print(f"❌ Écriture du log impossible : {e}")
+
+
+def _index_path(path):
+    return f"{path}.idx"
+
+
+def _append(path, data, epoch):
+    """Ajoute un lot au fichier, avec rotation et entrée d'index si besoin.
+
+    Plusieurs process (gunicorn, workers Celery) écrivent dans le même
+    fichier : écriture et rotation se font sous un verrou fcntl.
+    """
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            offset = os.path.getsize(path)
+        except FileNotFoundError:
+            offset = 0
+        if offset and offset + len(data) > LOG_MAX_BYTES:
+            _rotate(path)
+            offset = 0
+        with open(path, 'ab') as f:
+            f.write(data)
+        # Une entrée d'index à chaque fois qu'un lot franchit une frontière de LOG_INDEX_EVERY octets
+        if epoch is not None and (offset == 0 or offset // LOG_INDEX_EVERY != (offset + len(data)) // LOG_INDEX_EVERY):
+            with open(_index_path(path), 'a', encoding='utf-8') as idx:
+                idx.write(f"{epoch:.3f} {offset}\n")
+
+
+def _rotate(path):
+    """log.txt → log.txt.1 → … → log.txt.N (N = LOG_BACKUP_COUNT), index compris"""
+    for i in range(LOG_BACKUP_COUNT, 0, -1):
+        src = path if i == 1 else f"{path}.{i - 1}"
+        dst = f"{path}.{i}"
+        for src_file, dst_file in ((src, dst), (_index_path(src), _index_path(dst))):
+            if os.path.exists(src_file):
+                os.replace(src_file, dst_file)
+    for leftover in (path, _index_path(path)):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    writer = _writer
+    if writer is None or writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = _AsyncWriter()
+            writer = _writer
+    return writer
+
+
+def _reset_after_fork():
+    # Le thread d'écriture n'existe pas dans l'enfant : il sera recréé au premier log
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _format(text, level):
     now = datetime.now(timezone.utc).isoformat()
     prefix = f"[{os.getenv('REQUEST_ID', 'worker')}]"  # Permet d’identifier d’où ça vient
-    line = f"{now} {prefix} {text}\n"
-    print(line.strip())  # Toujours visible dans console
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(line)
-        f.flush()  # ✅ Forcer écriture immédiate
+    if level != "INFO":
+        prefix = f"{prefix} [{level}]"
+    return f"{now} {prefix} {text}\n"
+
+
+def log(text, level="INFO"):
+    if LEVELS.get(level, LEVELS["INFO"]) < _min_level:
+        return
+    _get_writer().submit(_format(text, level))
+
+
+def shutdown_logging(timeout=2.0):
+    """Vide la file et arrête le thread d'écriture du process courant"""
+    global _writer
+    writer = _writer
+    if writer is not None and writer.pid == os.getpid():
+        _writer = None
+        writer.stop(timeout)
+
+
+atexit.register(shutdown_logging)
+
+
+# 🔎 Lecture : fichiers conservés, tail, filtres par date et request_id
+
+def _line_epoch(line):
+    try:
+        return datetime.fromisoformat(line.split(" ", 1)[0]).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_since(value):
+    """Horodatage epoch (secondes) ou ISO 8601 → epoch"""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def log_files(path=LOG_FILE):
+    """Fichiers de log existants, du plus ancien au plus récent"""
+    files = [f"{path}.{i}" for i in range(LOG_BACKUP_COUNT, 0, -1)] + [path]
+    return [f for f in files if os.path.exists(f)]
+
+
+def _read_index(path):
+    entries = []
+    try:
+        with open(_index_path(path), 'r', encoding='utf-8') as idx:
+            for entry in idx:
+                epoch, _, offset = entry.partition(" ")
+                try:
+                    entries.append((float(epoch), int(offset)))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _forward_lines(path, offset=0):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            yield line.decode('utf-8', 'replace')
+
+
+def _reverse_lines(path, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        remainder = b""
+        while pos > 0:
+            size = min(chunk_size, pos)
+            pos -= size
+            f.seek(pos)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode('utf-8', 'replace') + "\n"
+        if remainder:
+            yield remainder.decode('utf-8', 'replace') + "\n"
+
+
+def _matches(record, epoch, since, request_id):
+    if since is not None and epoch < since:
+        return False
+    return request_id is None or any(f"[{request_id}]" in line for line in record)
+
+
+def _filtered(lines, since, request_id):
+    """Les lignes sans horodatage (suite d'un message multi-ligne) suivent la précédente"""
+    keep = False
+    record = []
+    for line in lines:
+        epoch = _line_epoch(line)
+        if epoch is None:
+            if keep:
+                yield line
+            elif request_id is not None and f"[{request_id}]" in line and record:
+                keep = True
+                yield from record
+                yield line
+            continue
+        record = [line]
+        keep = _matches(record, epoch, since, request_id)
+        if keep:
+            yield line
+
+
+def _reverse_records(files):
+    """(epoch, lignes) du plus récent au plus ancien, en lisant les fichiers à rebours"""
+    pending = []
+    for log_path in reversed(files):
+        for line in _reverse_lines(log_path):
+            epoch = _line_epoch(line)
+            if epoch is None:
+                pending.append(line)
+                continue
+            record, pending = [line] + pending[::-1], []
+            yield epoch, record
+
+
+def iter_logs(since=None, request_id=None, tail=None, path=LOG_FILE):
+    """Générateur de lignes de log, sans charger les fichiers en mémoire.
+
+    - `tail` : N dernières lignes (lecture à rebours depuis la fin)
+    - `since` : epoch ; le point de départ est trouvé via l'index latéral
+    - `request_id` : lignes contenant "[<request_id>]"
+    """
+    # Les lots de process différents s'entrelacent : marge sur l'ordre des horodatages
+    slack = 2 * LOG_FLUSH_INTERVAL + 1
+    files = log_files(path)
+
+    if tail is not None:
+        records = deque()
+        count = 0
+        for epoch, record in _reverse_records(files):
+            if count >= tail or (since is not None and epoch < since - slack):
+                break
+            if _matches(record, epoch, since, request_id):
+                records.appendleft(record)
+                count += len(record)
+        lines = [line for record in records for line in record]
+        yield from lines[len(lines) - tail:] if tail else []
+        return
+
+    start = 0
+    if since is not None:
+        # On saute les fichiers dont le successeur commence déjà avant `since`
+        for i in range(len(files) - 1):
+            newer = _read_index(files[i + 1])
+            if newer and newer[0][0] < since - slack:
+                start = i + 1
+    for log_path in files[start:]:
+        offset = 0
+        if since is not None:
+            entries = _read_index(log_path)
+            pos = bisect.bisect_right([epoch for epoch, _ in entries], since - slack) - 1
+            if pos >= 0:
+                offset = entries[pos][1]
+        yield from _filtered(_forward_lines(log_path, offset), since, request_id)
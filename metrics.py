@@ -0,0 +1,123 @@
+"""Métriques Prometheus partagées entre les process gunicorn, Celery et le worker async.
+
+Mode multiprocess de prometheus_client : chaque process écrit ses valeurs
+dans PROMETHEUS_MULTIPROC_DIR, et l'export (route `/metrics` de l'app,
+protégée par METRICS_TOKEN en `Authorization: Bearer`, par défaut
+ADMIN_TOKEN ; exporteur HTTP du worker sur WORKER_METRICS_PORT) additionne tous les
+fichiers. Le dossier doit être vidé au déploiement (un conteneur neuf part
+d'un /tmp vide) ; les process qui s'arrêtent sont marqués morts via
+`mark_process_dead`.
+"""
+import os
+import time
+from contextlib import contextmanager
+from tracing import span
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402  (le dossier doit exister avant l'import)
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9191"))  # 0 : pas d'exporteur
+
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+WEBHOOK_LATENCY = Histogram(
+    "sms_webhook_latency_seconds", "Durée de traitement de /sms_auto_reply")
+WEBHOOK_BATCH_SIZE = Histogram(
+    "sms_webhook_batch_size", "Messages reçus par requête /sms_auto_reply", buckets=BATCH_BUCKETS)
+WEBHOOK_MESSAGES = Counter(
+    "sms_webhook_messages_total", "Messages reçus par le webhook, par issue", ["outcome"])
+ENQUEUE_FAILURES = Counter(
+    "sms_enqueue_failures_total", "Messages qui n'ont pas pu être mis en file")
+
+PROCESS_STAGE = Histogram(
+    "sms_process_stage_seconds", "Durée de chaque étape de process_message", ["stage"], buckets=STAGE_BUCKETS)
+PROCESS_MESSAGES = Counter(
+    "sms_process_messages_total", "Messages traités par process_message, par statut", ["status"])
+
+CONTACT_CACHE_LOOKUPS = Counter(
+    "sms_contact_cache_lookups_total", "Recherches dans le cache des noms de contacts", ["result"])
+HTTP_REQUEST_LATENCY = Histogram(
+    "sms_http_request_seconds", "Appels HTTP sortants vers la passerelle", ["endpoint", "error"])
+
+# livesum : total des pools Redis des process vivants, à comparer au maxclients de l'hébergeur
+REDIS_POOL_CONNECTIONS = Gauge(
+    "sms_redis_pool_connections", "Connexions des pools Redis, par état", ["state"], multiprocess_mode="livesum")
+REDIS_POOL_MAX = Gauge(
+    "sms_redis_pool_max_connections", "Plafond cumulé des pools Redis", multiprocess_mode="livesum")
+REDIS_POOL_TIMEOUTS = Counter(
+    "sms_redis_pool_timeouts_total", "Attentes d'une connexion Redis libre expirées (pool plein)")
+
+
+@contextmanager
+def stage(name):
+    """Chronomètre une étape de process_message (histogramme + span de la trace courante)"""
+    start = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        PROCESS_STAGE.labels(name).observe(time.perf_counter() - start)
+
+
+class QueueDepthCollector:
+    """Profondeur des files et retard de l'ordonnanceur, lus dans Redis à chaque collecte"""
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+
+    def collect(self):
+        from scheduler import queue_stats
+
+        ready = GaugeMetricFamily("sms_queue_ready", "Messages prêts dans la file de travail", labels=["queue"])
+        delayed = GaugeMetricFamily("sms_queue_delayed", "Messages différés (ZSET de l'ordonnanceur)", labels=["queue"])
+        due = GaugeMetricFamily("sms_queue_due", "Messages dus pas encore livrés", labels=["queue"])
+        lag = GaugeMetricFamily("sms_scheduler_lag_seconds", "Retard du plus ancien message dû", labels=["queue"])
+        try:
+            stats = queue_stats(self.redis_conn)
+        except Exception:
+            return []
+        for queue, values in stats.items():
+            ready.add_metric([queue], values["ready"])
+            delayed.add_metric([queue], values["delayed"])
+            due.add_metric([queue], values["due"])
+            lag.add_metric([queue], values["lag_seconds"])
+        return [ready, delayed, due, lag]
+
+
+def build_registry(redis_conn=None):
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if redis_conn is not None:
+        registry.register(QueueDepthCollector(redis_conn))
+    return registry
+
+
+def render(redis_conn=None):
+    """(corps, content-type) de l'exposition texte, tous process confondus"""
+    return generate_latest(build_registry(redis_conn)), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port=WORKER_METRICS_PORT, redis_conn=None):
+    """Exporteur HTTP côté worker (thread du process principal)"""
+    if not port:
+        return None
+    from prometheus_client import start_http_server
+    from logger import log
+
+    try:
+        server = start_http_server(port, registry=build_registry(redis_conn))
+    except OSError as e:
+        log(f"⚠️ Exporteur de métriques indisponible sur le port {port} : {e}", level="WARNING")
+        return None
+    log(f"📈 Métriques exposées sur :{port}/metrics")
+    return server
+
+
+def mark_process_dead(pid=None):
+    multiprocess.mark_process_dead(os.getpid() if pid is None else pid)
@@ -0,0 +1,36 @@
+import os
+import re
+
+# 🌍 Indicatif utilisé pour les numéros nationaux (ex: 06 12 34 56 78 → +33612345678)
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "33")
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_number(number):
+    """Forme canonique (style E.164) d'un numéro : '+' suivi des seuls chiffres.
+
+    - "+33 6 12-34-56-78" → "+33612345678"
+    - "0033612345678"     → "+33612345678"
+    - "0612345678"        → "+33612345678" (indicatif DEFAULT_COUNTRY_CODE)
+    - "33612345678"       → "+33612345678" (indicatif supposé déjà présent)
+
+    Retourne None si le numéro ne contient aucun chiffre.
+    Utilisé pour la recherche des noms (index ContactNumberIndex, cache des
+    noms, liste de contacts de la passerelle). Les clés de déduplication et de
+    réservation (dedup.py, claim.py) gardent le numéro brut, tel que reçu de la
+    passerelle.
+    """
+    if number is None:
+        return None
+    raw = str(number).strip()
+    digits = _NON_DIGITS.sub("", raw)
+    if not digits:
+        return None
+    if raw.startswith("+"):
+        return f"+{digits}"
+    if digits.startswith("00"):
+        return f"+{digits[2:]}"
+    if digits.startswith("0") and DEFAULT_COUNTRY_CODE:
+        return f"+{DEFAULT_COUNTRY_CODE}{digits[1:]}"
+    return f"+{digits}"
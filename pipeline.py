@@ -0,0 +1,228 @@
+"""process_message découpé en étapes chaînées, une file Celery par étape.
+
+    validate → resolve → send → commit
+
+- validate : JSON, réservation du numéro (claim), nom en cache ? → send, sinon → resolve
+- resolve  : nom du contact (MySQL puis API) — la seule étape lente
+- send     : envoi de la réponse à la passerelle
+- commit   : message traité, numéro archivé, réservation levée
+
+Une recherche de nom lente n'occupe qu'un slot du worker `resolve` : les
+messages dont le nom est en cache passent directement de validate à send.
+Chaque file a son worker, donc sa concurrence (PIPELINE_{ÉTAPE}_CONCURRENCY,
+voir le Procfile) et sa politique de nouvel essai (PIPELINE_{ÉTAPE}_RETRIES,
+erreurs Redis uniquement).
+
+Passage de relais idempotent : l'avancement de chaque réservation est noté
+dans `pipeline:{jeton}` par un script Lua (compare-and-set sur l'étape, sous
+réserve que `claim:{numéro}` porte toujours le jeton). Une tâche livrée deux
+fois, ou rejouée après un crash entre son travail et la mise en file de la
+suivante, retrouve l'étape déjà franchie et se contente de repasser le relais ;
+la réponse n'est envoyée qu'une fois. Réservation perdue (CLAIM_TTL dépassé)
+avant l'envoi : le message repart de validate.
+
+Activé par STAGED_PIPELINE=true (le webhook publie alors sur la file validate).
+"""
+import os
+from celery import Task
+from redis.exceptions import RedisError
+from logger import log
+from enqueue import enqueue_batch
+from claim import CLAIM_TTL
+from metrics import PROCESS_MESSAGES, stage
+from tracing import trace, annotate
+from profiler import profiled
+from startup import Lazy
+from celery_worker import celery, PIPELINE_QUEUES, PIPELINE_STAGES, STAGED_PIPELINE
+import tasks
+
+STAGE_RETRIES = {
+    "validate": int(os.getenv("PIPELINE_VALIDATE_RETRIES", "3")),
+    "resolve": int(os.getenv("PIPELINE_RESOLVE_RETRIES", "3")),
+    "send": int(os.getenv("PIPELINE_SEND_RETRIES", "3")),  # rejeu sans risque : voir `send`
+    "commit": int(os.getenv("PIPELINE_COMMIT_RETRIES", "5")),
+}
+PIPELINE_KEY = "pipeline:{}"
+
+# KEYS : claim:{number}, pipeline:{token} — ARGV : jeton, étape attendue, étape suivante, ttl
+# Retourne {'ok', suivante} / {'skip', étape actuelle} / {'lost', ''} (réservation perdue)
+ADVANCE_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return {'lost', ''}
+end
+local current = redis.call('HGET', KEYS[2], 'stage') or 'claimed'
+if current ~= ARGV[2] then
+    return {'skip', current}
+end
+redis.call('HSET', KEYS[2], 'stage', ARGV[3])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[4]))
+return {'ok', ARGV[3]}
+"""
+
+class StageProgress:
+    """Avancement d'une réservation dans le pipeline (`pipeline:{jeton}`, expire avec CLAIM_TTL)"""
+
+    def __init__(self, redis_conn, ttl=CLAIM_TTL):
+        self.ttl = ttl
+        self._advance = redis_conn.register_script(ADVANCE_LUA)
+
+    def advance(self, job, expected, following):
+        """Fait passer la réservation de `expected` à `following` ; retourne (statut, étape actuelle)"""
+        status, current = self._advance(keys=[f"claim:{job['number']}", PIPELINE_KEY.format(job["token"])],
+                                        args=[job["token"], expected, following, self.ttl])
+        status = status.decode() if isinstance(status, bytes) else status
+        current = current.decode() if isinstance(current, bytes) else current
+        return status, current
+
+
+progress = Lazy(lambda: StageProgress(tasks.redis_conn))
+
+
+def hand_off(stage_name, args, request_id=None, countdown=None):
+    """Publie l'étape suivante ; une erreur Redis remonte et fait rejouer l'étape courante"""
+    _, error = enqueue_batch(tasks.redis_conn, STAGE_TASKS[stage_name], [(args, countdown)],
+                             queue=PIPELINE_QUEUES[stage_name],
+                             headers={"request_id": request_id} if request_id else None)[0]
+    if error is not None:
+        raise error
+
+
+def restart(job, request_id):
+    """Réservation perdue avant l'envoi : on repart de validate (qui re-réserve ou écarte)"""
+    log(f"⌛ [{tasks.short_id(job['msg_id'])}] Réservation expirée, message renvoyé en validation", level="WARNING")
+    hand_off("validate", tasks.task_args(job["number"], job["msg_id"], job["device_id"]), request_id)
+
+
+class StageTask(Task):
+    """Échec définitif d'une étape : la réservation est libérée, comme dans process_message,
+    sauf si la réponse est peut-être partie (elle expirera avec CLAIM_TTL)"""
+    autoretry_for = (RedisError,)
+    retry_backoff = True
+    retry_backoff_max = 60
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        job = args[0] if args else None
+        if not isinstance(job, dict) or not job.get("token"):
+            return
+        PROCESS_MESSAGES.labels("error").inc()
+        log(f"💥 [{tasks.short_id(job.get('msg_id'))}] Étape {self.name} en échec : {exc}", level="ERROR")
+        try:
+            current = tasks.redis_conn.hget(PIPELINE_KEY.format(job["token"]), "stage")
+            if current in (b"sending", b"sent"):
+                return
+            tasks.claims.release(job["number"], job["token"])
+        except Exception as e:
+            log(f"⚠️ Libération de la réservation impossible : {e}", level="WARNING")
+
+
+def _stage_task(stage_name):
+    return celery.task(name=f"pipeline.{stage_name}", base=StageTask, bind=True,
+                       queue=PIPELINE_QUEUES[stage_name], max_retries=STAGE_RETRIES[stage_name])
+
+
+@_stage_task("validate")
+def validate(self, number, msg_id=None, device_id=None):
+    request_id = tasks.task_request_id(self.request)
+    with trace("pipeline.validate", tasks.redis_conn, request_id=request_id), profiled("pipeline.validate"):
+        parsed = tasks.parse_message(number, msg_id, device_id)
+        if parsed is None:
+            return
+        number, msg_id, device_id = parsed
+        msg_id_short = tasks.short_id(msg_id)
+
+        with stage("claim"):
+            status, step, token = tasks.claims.claim(number, msg_id, device_id)
+        if status != "ok":
+            PROCESS_MESSAGES.labels(status).inc()
+        if status == "archived":
+            log(f"🗃️ [{msg_id_short}] Numéro archivé, ignoré.")
+            return
+        if status == "processed":
+            log(f"🔁 [{msg_id_short}] Message déjà traité, ignoré.")
+            return
+        if status == "claimed":
+            log(f"🔒 [{msg_id_short}] Numéro en cours de traitement, nouvel essai dans {tasks.CLAIM_RETRY_DELAY}s.")
+            hand_off("validate", tasks.task_args(number, msg_id, device_id), request_id,
+                     countdown=tasks.CLAIM_RETRY_DELAY)
+            return
+
+        job = {"number": number, "msg_id": msg_id, "device_id": device_id, "token": token}
+        try:
+            if step != 0:
+                log(f"🗃️ [{msg_id_short}] Conversation déjà traitée, ignoré.")
+                PROCESS_MESSAGES.labels("already_handled").inc()
+                tasks.claims.release(number, token)
+                return
+            # 🧠 Nom déjà en cache : pas de passage par resolve
+            found, name = tasks.contact_cache.get(number)
+            if not found:
+                hand_off("resolve", [job], request_id)
+                return
+            progress.advance(job, "claimed", "resolved")
+            hand_off("send", [{**job, "name": name}], request_id)
+        except Exception:
+            # La réservation n'a pas encore quitté cette étape : on la rend avant de rejouer
+            tasks.claims.release(number, token)
+            raise
+
+
+@_stage_task("resolve")
+def resolve(self, job):
+    request_id = tasks.task_request_id(self.request)
+    with trace("pipeline.resolve", tasks.redis_conn, request_id=request_id), profiled("pipeline.resolve"):
+        annotate(number=job["number"], msg_id=job["msg_id"])
+        # Rejouée après coup, la recherche retombe sur le cache
+        with stage("contact_lookup"):
+            name = tasks.get_contact_name(job["number"])
+        status, current = progress.advance(job, "claimed", "resolved")
+        if status == "lost":
+            restart(job, request_id)
+        elif status == "ok" or current == "resolved":
+            hand_off("send", [{**job, "name": name}], request_id)
+        else:
+            log(f"🔁 [{tasks.short_id(job['msg_id'])}] resolve livré deux fois (étape {current}), ignoré.", level="DEBUG")
+
+
+@_stage_task("send")
+def send(self, job):
+    request_id = tasks.task_request_id(self.request)
+    with trace("pipeline.send", tasks.redis_conn, request_id=request_id), profiled("pipeline.send"):
+        annotate(number=job["number"], msg_id=job["msg_id"])
+        msg_id_short = tasks.short_id(job["msg_id"])
+        # 'sending' est posé avant l'appel : un rejeu ne renvoie jamais la réponse
+        status, current = progress.advance(job, "resolved", "sending")
+        if status == "lost":
+            restart(job, request_id)
+            return
+        if status == "skip":
+            if current == "sending":
+                log(f"⚠️ [{msg_id_short}] Envoi interrompu, issue inconnue : pas de renvoi", level="WARNING")
+            elif current != "sent":
+                return
+            hand_off("commit", [job], request_id)
+            return
+
+        with stage("send"):
+            tasks.send_single_message(job["number"], tasks.build_reply(job.get("name") or "default"), job["device_id"])
+        progress.advance(job, "sending", "sent")
+        hand_off("commit", [job], request_id)
+
+
+@_stage_task("commit")
+def commit(self, job):
+    request_id = tasks.task_request_id(self.request)
+    with trace("pipeline.commit", tasks.redis_conn, request_id=request_id), profiled("pipeline.commit"):
+        annotate(number=job["number"], msg_id=job["msg_id"])
+        # Idempotent : rejoué, le script ne fait que re-marquer le message et le numéro
+        with stage("commit"):
+            tasks.claims.commit(job["number"], job["msg_id"], job["token"])
+        tasks.redis_conn.delete(PIPELINE_KEY.format(job["token"]))
+        PROCESS_MESSAGES.labels("sent").inc()
+        log(f"✅ [{tasks.short_id(job['msg_id'])}] Réponse envoyée et conversation archivée.")
+
+
+STAGE_TASKS = {stage_name: f"pipeline.{stage_name}" for stage_name in PIPELINE_STAGES}
+
+# Point d'entrée du webhook selon STAGED_PIPELINE
+ENTRY_TASK = validate if STAGED_PIPELINE else tasks.process_message
+ENTRY_QUEUE = PIPELINE_QUEUES["validate"] if STAGED_PIPELINE else None
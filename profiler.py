@@ -0,0 +1,362 @@
+"""Profilage par échantillonnage, à la demande, de process_message et de /sms_auto_reply.
+
+Activation sans redéploiement, de deux façons :
+- PROFILE_ENABLED=true : chaque process ouvre une session au démarrage
+  (id `env`), pour PROFILE_SECONDS secondes et/ou PROFILE_INVOCATIONS appels
+- route admin `POST /admin/profile` de l'app (en-tête X-Admin-Token) : la
+  session est publiée dans Redis (`profiler:session`) et chaque process
+  (gunicorn, Celery) la découvre en moins de PROFILE_POLL_INTERVAL secondes
+
+Pendant une session, un thread relève toutes les PROFILE_INTERVAL_MS la pile
+des threads qui sont dans une section `profiled(nom)` et compte les piles au
+format « collapsed » (flamegraph.pl, speedscope) : un fichier par process
+dans PROFILE_DIR, recopié dans Redis (`profiler:{session}:stacks`, un champ
+par process) pour le téléchargement via `GET /admin/profile/download`.
+La limite d'appels s'entend par process.
+
+Une pile de thread ne dit pas quelle coroutine elle sert : une section ouverte
+dans une boucle asyncio (async_app, worker async) n'est pas échantillonnée.
+
+Hors session, une section coûte un appel de fonction et la lecture d'un
+attribut (benchmarks/bench_profiler.py) : Redis est interrogé toutes les
+PROFILE_POLL_INTERVAL secondes par un thread de fond, jamais par l'appel.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import socket
+import asyncio
+import functools
+import threading
+from collections import Counter
+from logger import log
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "60"))  # 0 : pas de limite de durée
+PROFILE_INVOCATIONS = int(os.getenv("PROFILE_INVOCATIONS", "0"))  # 0 : pas de limite d'appels
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+PROFILE_POLL_INTERVAL = float(os.getenv("PROFILE_POLL_INTERVAL", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_RESULT_TTL = int(os.getenv("PROFILE_RESULT_TTL", str(7 * 86400)))
+
+SESSION_KEY = "profiler:session"
+LAST_SESSION_KEY = "profiler:last"
+STACKS_KEY = "profiler:{}:stacks"
+MAX_STACK_DEPTH = 128
+
+
+def process_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Profiler:
+    """Sessions d'échantillonnage du process courant.
+
+    `enabled()` est le seul appel du chemin chaud hors session ; il démarre
+    au premier appel le thread qui lit la session dans Redis. L'état est remis
+    à zéro dans l'enfant d'un fork (les threads ne survivent pas au fork).
+    """
+
+    def __init__(self, redis_conn=None, interval=PROFILE_INTERVAL, poll_interval=PROFILE_POLL_INTERVAL,
+                 directory=PROFILE_DIR):
+        self._redis_conn = redis_conn  # None : client partagé de redis_client
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.directory = directory
+        self._labels = {}
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()  # un verrou hérité du parent peut rester pris
+        self.session = None
+        self.deadline = math.inf
+        self.remaining = None
+        self.samples = 0
+        self.stacks = Counter()
+        self._active = {}  # thread → [section, profondeur, frame d'entrée]
+        self._finished = set()
+        self._poller = None
+        self._stop = threading.Event()
+
+    @property
+    def redis_conn(self):
+        if self._redis_conn is None:
+            from redis_client import get_redis
+            return get_redis()
+        return self._redis_conn
+
+    # --- Chemin chaud -------------------------------------------------------
+
+    def enabled(self):
+        if self._poller is None:
+            self._start_poller()
+        return self.session is not None
+
+    def enter(self, name, frame):
+        """Inscrit le thread courant ; False si la limite d'appels est atteinte ou dans une boucle asyncio"""
+        if asyncio._get_running_loop() is not None:
+            return False  # la pile du thread mélange les coroutines en cours : rien d'attribuable
+        thread_id = threading.get_ident()
+        with self._lock:
+            if self.session is None:
+                return False
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return False
+                self.remaining -= 1
+            entry = self._active.get(thread_id)
+            if entry is None:
+                self._active[thread_id] = [name, 1, frame]
+            else:
+                entry[1] += 1  # section imbriquée
+        return True
+
+    def leave(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            entry = self._active.get(thread_id)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._active[thread_id]
+            exhausted = self.session is not None and self.remaining == 0 and not self._active
+        if exhausted:
+            self.finish()
+
+    # --- Sessions -----------------------------------------------------------
+
+    def _start_poller(self):
+        with self._lock:
+            if self._poller is not None:
+                return
+            poller = self._poller = threading.Thread(target=self._watch, name="profiler-poll", daemon=True)
+        if PROFILE_ENABLED:  # ouverte avant de rendre la main : le premier appel est profilé
+            self.start({"id": "env", "seconds": PROFILE_SECONDS, "invocations": PROFILE_INVOCATIONS})
+        poller.start()
+
+    def _watch(self):
+        """Thread de fond : relit la session toutes les PROFILE_POLL_INTERVAL secondes"""
+        while True:
+            try:
+                self._poll()
+            except Exception as e:
+                log(f"⚠️ Profilage : lecture de la session impossible : {e}", level="WARNING")
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        try:
+            raw = self.redis_conn.get(SESSION_KEY)
+        except Exception as e:
+            log(f"⚠️ Profilage : session illisible dans Redis : {e}", level="DEBUG")
+            return
+        session = json.loads(raw) if raw else None
+        current = self.session
+        if session is None:
+            if current is not None and current.get("remote"):
+                self.finish()  # session arrêtée par la route admin
+            return
+        seconds = session["until"] - time.time()
+        if current is None and seconds > 0 and session["id"] not in self._finished:
+            self.start({**session, "seconds": seconds, "remote": True})
+
+    def start(self, session):
+        seconds = session.get("seconds") or 0
+        with self._lock:
+            if self.session is not None:
+                return False
+            self.session = session
+            self.deadline = time.monotonic() + seconds if seconds > 0 else math.inf
+            self.remaining = session.get("invocations") or None
+            self.samples = 0
+            self.stacks = Counter()
+            self._stop = threading.Event()
+            sampler = threading.Thread(target=self._run, args=(self._stop,), name="profiler", daemon=True)
+        sampler.start()
+        log(f"🔥 Profilage {session['id']} démarré (pid {os.getpid()}, "
+            f"{f'{seconds:.0f}s' if seconds > 0 else 'sans limite de durée'}, "
+            f"{self.remaining or 'tous les'} appels)")
+        return True
+
+    def finish(self):
+        with self._lock:
+            session, self.session = self.session, None
+            if session is None:
+                return None
+            self._finished.add(session["id"])
+            self._stop.set()
+        path = self.flush(session)
+        log(f"🔥 Profilage {session['id']} terminé : {self.samples} échantillons → {path}")
+        return path
+
+    def _run(self, stop):
+        next_flush = time.monotonic() + self.poll_interval
+        while not stop.wait(self.interval):
+            now = time.monotonic()
+            if now >= self.deadline:
+                self.finish()
+                return
+            self.sample()
+            if now >= next_flush:
+                next_flush = now + self.poll_interval
+                self.flush(self.session)  # résultats partiels téléchargeables pendant la session
+
+    # --- Échantillons -------------------------------------------------------
+
+    def sample(self):
+        with self._lock:
+            active = [(thread_id, entry[0], entry[2]) for thread_id, entry in self._active.items()]
+        if not active:
+            return
+        frames = sys._current_frames()
+        for thread_id, name, entry_frame in active:
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(frame.f_code))
+                if frame is entry_frame:
+                    break  # rien au-dessus de la section (Celery, Flask, gunicorn)
+                frame = frame.f_back
+            if stack:
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            for prefix in sorted(sys.path, key=len, reverse=True):
+                if prefix and path.startswith(prefix + os.sep):
+                    path = path[len(prefix) + 1:]
+                    break
+            label = self._labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})"
+        return label
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def flush(self, session):
+        """Écrit le fichier du process et le recopie dans Redis ; retourne le chemin du fichier"""
+        if session is None:
+            return None
+        text = self.collapsed()
+        name = process_name()
+        path = os.path.join(self.directory, f"{session['id']}-{name}.collapsed")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log(f"⚠️ Profilage : écriture de {path} impossible : {e}", level="WARNING")
+        try:
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.hset(STACKS_KEY.format(session["id"]), name, text)
+            pipe.expire(STACKS_KEY.format(session["id"]), PROFILE_RESULT_TTL)
+            pipe.execute()
+        except Exception as e:
+            log(f"⚠️ Profilage : copie du profil dans Redis impossible : {e}", level="WARNING")
+        return path
+
+
+profiler = Profiler()
+
+
+class profiled:
+    """Section profilée, en décorateur ou en bloc `with` :
+
+        @profiled("sms_auto_reply")
+        def sms_auto_reply(): ...
+
+        with profiled("process_message"):
+            ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._entered = False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled():
+                return func(*args, **kwargs)
+            with profiled(name):  # un état par appel : le décorateur sert plusieurs threads
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        if profiler.enabled():
+            self._entered = profiler.enter(self.name, sys._getframe(1))
+        return self
+
+    def __exit__(self, *exc):
+        if self._entered:
+            profiler.leave()
+        return False
+
+
+# --- Route admin : pilotage des sessions via Redis -----------------------------
+
+def start_session(redis_conn, seconds=PROFILE_SECONDS, invocations=PROFILE_INVOCATIONS):
+    """Publie une session pour tous les process ; `seconds` est obligatoire (la clé expire avec)"""
+    if seconds <= 0:
+        raise ValueError("durée de session requise")
+    session = {"id": uuid.uuid4().hex[:8], "until": time.time() + seconds, "invocations": invocations}
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.set(SESSION_KEY, json.dumps(session), ex=math.ceil(seconds))
+    pipe.set(LAST_SESSION_KEY, session["id"], ex=PROFILE_RESULT_TTL)
+    pipe.execute()
+    return session
+
+
+def stop_session(redis_conn):
+    return bool(redis_conn.delete(SESSION_KEY))
+
+
+def current_session(redis_conn):
+    raw = redis_conn.get(SESSION_KEY)
+    return json.loads(raw) if raw else None
+
+
+def last_session_id(redis_conn):
+    session_id = redis_conn.get(LAST_SESSION_KEY)
+    return session_id.decode() if isinstance(session_id, bytes) else session_id
+
+
+def session_processes(redis_conn, session_id):
+    """{process : nombre d'échantillons} des profils déjà recopiés dans Redis"""
+    return {
+        (name.decode() if isinstance(name, bytes) else name): _sample_count(text)
+        for name, text in redis_conn.hgetall(STACKS_KEY.format(session_id)).items()
+    }
+
+
+def collapsed_stacks(redis_conn, session_id, process=None):
+    """Profil d'un process, ou somme de tous les process de la session (None si inconnu)"""
+    key = STACKS_KEY.format(session_id)
+    if process:
+        text = redis_conn.hget(key, process)
+        return text.decode() if isinstance(text, bytes) else text
+    profiles = redis_conn.hvals(key)
+    if not profiles:
+        return None
+    merged = Counter()
+    for text in profiles:
+        text = text.decode() if isinstance(text, bytes) else text
+        for line in text.splitlines():
+            stack, _, count = line.rpartition(" ")
+            merged[stack] += int(count)
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(merged.items()))
+
+
+def _sample_count(text):
+    text = text.decode() if isinstance(text, bytes) else text
+    return sum(int(line.rpartition(" ")[2]) for line in text.splitlines())
@@ -0,0 +1,208 @@
+"""Fabrique unique des clients Redis (app, tâches, worker async, scripts, Celery).
+
+- un pool borné par process (REDIS_MAX_CONNECTIONS), partagé par tous les
+  clients du process ; au-delà, on attend REDIS_POOL_TIMEOUT secondes une
+  connexion libre au lieu d'en ouvrir une de plus
+- après un fork (worker Celery prefork, gunicorn --preload) : `get_redis()`
+  compare le pid et reconstruit le client ; les proxys `Lazy(get_redis)`
+  (app, tasks) oublient leur client dans l'enfant (`os.register_at_fork`)
+  et repassent donc par `get_redis()`. Un client gardé ailleurs reste sûr
+  grâce à redis-py : chaque pool vérifie le pid à l'emprunt d'une connexion
+  (`_checkpid`) et se vide dans l'enfant, sans fermer les sockets du parent
+- mêmes options SSL (rediss://), timeouts, health checks et nouveaux essais
+  pour redis-py et pour le broker / backend de Celery (`celery_settings`)
+- occupation du pool partagé de chaque process (`get_redis()`) exposée dans
+  /metrics (somme sur les process vivants, à comparer au `maxclients` de
+  l'hébergeur) et dans `pool_stats()` ; les pools éphémères de
+  `create_redis()` (scripts, diagnostics) ne touchent pas aux jauges
+"""
+import os
+import time
+import threading
+from logger import log
+
+# ⚙️ Configuration des connexions Redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "10"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", "2"))
+REDIS_SSL_CERT_REQS = os.getenv("REDIS_SSL_CERT_REQS", "none")  # Upstash : aucun certificat requis
+
+
+def ssl_options(url=REDIS_URL):
+    """Options SSL de redis-py / kombu pour une URL rediss:// ({} sinon)"""
+    if not url.startswith("rediss://"):
+        return {}
+    return {"ssl_cert_reqs": REDIS_SSL_CERT_REQS}
+
+
+def connection_kwargs(url=REDIS_URL, asynchronous=False):
+    """Timeouts, keepalive, health check et nouveaux essais communs à tous les clients.
+
+    Seules les erreurs de connexion sont rejouées (backoff exponentiel) : un
+    timeout de lecture peut suivre une commande déjà exécutée par Redis.
+    """
+    from redis.backoff import ExponentialBackoff
+    from redis.exceptions import ConnectionError
+    if asynchronous:
+        from redis.asyncio.retry import Retry
+    else:
+        from redis.retry import Retry
+
+    return {
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "retry": Retry(ExponentialBackoff(cap=1, base=0.05), REDIS_RETRIES),
+        "retry_on_error": [ConnectionError],
+        **ssl_options(url),
+    }
+
+
+def celery_settings(url=REDIS_URL, transport_options=None):
+    """Réglages `celery.conf` équivalents pour le broker (kombu) et le backend de résultats"""
+    use_ssl = ssl_options(url) or None
+    return {
+        "broker_use_ssl": use_ssl,
+        "redis_backend_use_ssl": use_ssl,
+        "broker_transport_options": {
+            **(transport_options or {}),
+            "max_connections": REDIS_MAX_CONNECTIONS,
+            "socket_timeout": REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+            "socket_keepalive": True,
+            "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        },
+        "redis_max_connections": REDIS_MAX_CONNECTIONS,
+        "redis_socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "redis_socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "redis_socket_keepalive": True,
+        "redis_backend_health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def _pool_class():
+    from redis import BlockingConnectionPool
+    from redis.exceptions import ConnectionError
+    from metrics import REDIS_POOL_CONNECTIONS, REDIS_POOL_MAX, REDIS_POOL_TIMEOUTS
+
+    open_gauge = REDIS_POOL_CONNECTIONS.labels("open")
+    in_use_gauge = REDIS_POOL_CONNECTIONS.labels("in_use")
+
+    class InstrumentedPool(BlockingConnectionPool):
+        """Pool bloquant qui compte ses connexions ouvertes / empruntées et ses attentes.
+
+        `reset()` est appelé par redis-py à la construction et, dans un process
+        enfant, au premier usage après le fork : compteurs et jauges repartent
+        de zéro avec le nouveau pid.
+        """
+
+        def reset(self):
+            self._borrowed = set()
+            self.counters = {"checkouts": 0, "timeouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+            super().reset()
+            REDIS_POOL_MAX.set(self.max_connections)
+            self._publish()
+
+        def make_connection(self):
+            connection = super().make_connection()
+            self._publish()
+            return connection
+
+        def get_connection(self, command_name, *keys, **options):
+            start = time.monotonic()
+            try:
+                connection = super().get_connection(command_name, *keys, **options)
+            except ConnectionError as e:
+                if str(e) == "No connection available.":
+                    self.counters["timeouts"] += 1
+                    REDIS_POOL_TIMEOUTS.inc()
+                raise
+            waited = time.monotonic() - start
+            self._borrowed.add(connection)
+            self.counters["checkouts"] += 1
+            self.counters["wait_time_total"] += waited
+            self.counters["wait_time_max"] = max(self.counters["wait_time_max"], waited)
+            self._publish()
+            return connection
+
+        def release(self, connection):
+            super().release(connection)
+            self._borrowed.discard(connection)
+            self._publish()
+
+        def stats(self):
+            stats = dict(self.counters)
+            stats["open"] = len(self._connections)
+            stats["in_use"] = len(self._borrowed)
+            stats["idle"] = stats["open"] - stats["in_use"]
+            stats["max_connections"] = self.max_connections
+            checkouts = stats["checkouts"]
+            stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+            return stats
+
+        def _publish(self):
+            open_gauge.set(len(self._connections))
+            in_use_gauge.set(len(self._borrowed))
+
+    return InstrumentedPool
+
+
+def create_redis(url=REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, instrumented=False, **kwargs):
+    """Nouveau client avec son propre pool (scripts, outils) ; les services utilisent `get_redis()`.
+
+    `instrumented` : pool publié dans les jauges du process (réservé au client partagé).
+    """
+    from redis import BlockingConnectionPool, Redis
+
+    pool_class = _pool_class() if instrumented else BlockingConnectionPool
+    pool = pool_class.from_url(url, max_connections=max_connections, timeout=REDIS_POOL_TIMEOUT,
+                               **{**connection_kwargs(url), **kwargs})
+    return Redis(connection_pool=pool)
+
+
+def create_async_redis(url=REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, **kwargs):
+    """Client redis.asyncio (pool bloquant borné) à créer dans la boucle qui l'utilise"""
+    from redis.asyncio import BlockingConnectionPool, Redis
+
+    pool = BlockingConnectionPool.from_url(url, max_connections=max_connections, timeout=REDIS_POOL_TIMEOUT,
+                                           **{**connection_kwargs(url, asynchronous=True), **kwargs})
+    return Redis(connection_pool=pool)
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Client partagé du process courant, reconstruit au premier appel après un fork"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = create_redis(instrumented=True)
+                _client_pid = os.getpid()
+                log(f"🔌 Pool Redis initialisé (max {REDIS_MAX_CONNECTIONS} connexions, pid {_client_pid})",
+                    level="DEBUG")
+    return _client
+
+
+def pool_stats():
+    """Occupation du pool partagé du process courant (None s'il n'a pas encore servi)"""
+    if _client is None or _client_pid != os.getpid():
+        return None
+    return _client.connection_pool.stats()
+
+
+def close_redis():
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None and _client_pid == os.getpid():
+        log(f"🔌 Fermeture du pool Redis : {client.connection_pool.stats()}")
+        client.connection_pool.disconnect()
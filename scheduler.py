@@ -0,0 +1,211 @@
+"""Ordonnanceur des tâches différées : un ZSET Redis par file, trié par heure d'exécution.
+
+Avec le broker Redis, une tâche `countdown` (ETA) est livrée tout de suite
+au worker, qui la garde en mémoire jusqu'à son échéance : RSS qui gonfle,
+conflits avec visibility_timeout, tâches perdues au redémarrage. Ici les
+messages différés (déjà au format kombu, sans ETA) attendent dans
+`delayed:{file}` ; ce process les pousse dans la file de travail une fois dus,
+par lots, avec un script Lua (ZRANGEBYSCORE + LPUSH + ZREM atomiques : deux
+ordonnanceurs en parallèle ne livrent jamais un message deux fois).
+
+    python scheduler.py          # boucle de livraison
+    python scheduler.py stats    # profondeur des files et retard
+"""
+import os
+import sys
+import time
+import json
+import signal
+from logger import log, shutdown_logging
+from celery_worker import celery, PIPELINE_QUEUES, STAGED_PIPELINE
+
+# auto : ZSET seulement si un ordonnanceur est vivant (sinon ETA Celery, comme avant)
+DELAY_SCHEDULER = os.getenv("DELAY_SCHEDULER", "auto").lower()
+SCHEDULER_QUEUES = [q for q in os.getenv("SCHEDULER_QUEUES", "").split(",") if q] or (
+    [celery.conf.task_default_queue] + ([PIPELINE_QUEUES["validate"]] if STAGED_PIPELINE else []))
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "0.5"))
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+SCHEDULER_REPORT_INTERVAL = float(os.getenv("SCHEDULER_REPORT_INTERVAL", "60"))
+
+DELAYED_KEY = "delayed:{}"
+ALIVE_KEY = "scheduler:alive"
+STATS_KEY = "scheduler:stats"
+ALIVE_TTL = 30
+ALIVE_CHECK_INTERVAL = 10
+
+# KEYS : delayed:{file}, file de travail — ARGV : maintenant, taille du lot
+# Retourne {nombre déplacé, échéance la plus ancienne du lot (retard)}
+MOVE_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+if #due == 0 then
+    return {0, ''}
+end
+local messages = {}
+for i = 1, #due, 2 do
+    messages[#messages + 1] = due[i]
+end
+redis.call('LPUSH', KEYS[2], unpack(messages))
+redis.call('ZREM', KEYS[1], unpack(messages))
+return {#messages, due[2]}
+"""
+
+# KEYS : scheduler:alive — ARGV : pid ; ne supprime que notre propre battement de cœur
+RELEASE_ALIVE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_alive = {"checked_at": 0.0, "value": False}
+
+
+def delayed_key(queue):
+    return DELAYED_KEY.format(queue)
+
+
+def scheduler_enabled(redis_conn):
+    """Les tâches différées passent-elles par le ZSET ? (vérifié au plus toutes les 10 s)"""
+    if DELAY_SCHEDULER in ("true", "1", "yes"):
+        return True
+    if DELAY_SCHEDULER != "auto":
+        return False
+    now = time.monotonic()
+    if now - _alive["checked_at"] >= ALIVE_CHECK_INTERVAL:
+        try:
+            _alive["value"] = bool(redis_conn.exists(ALIVE_KEY))
+        except Exception:
+            _alive["value"] = False
+        _alive["checked_at"] = now
+    return _alive["value"]
+
+
+async def scheduler_enabled_async(redis_conn):
+    """`scheduler_enabled` pour un client redis.asyncio (même cache de 10 s)"""
+    if DELAY_SCHEDULER != "auto":
+        return DELAY_SCHEDULER in ("true", "1", "yes")
+    now = time.monotonic()
+    if now - _alive["checked_at"] >= ALIVE_CHECK_INTERVAL:
+        try:
+            _alive["value"] = bool(await redis_conn.exists(ALIVE_KEY))
+        except Exception:
+            _alive["value"] = False
+        _alive["checked_at"] = now
+    return _alive["value"]
+
+
+def queue_stats(redis_conn, queues=None):
+    """Par file : messages différés, dus mais pas encore livrés, prêts, retard du plus ancien dû"""
+    queues = queues or SCHEDULER_QUEUES
+    now = time.time()
+    pipe = redis_conn.pipeline(transaction=False)
+    for queue in queues:
+        pipe.zcard(delayed_key(queue))
+        pipe.zcount(delayed_key(queue), "-inf", now)
+        pipe.zrange(delayed_key(queue), 0, 0, withscores=True)
+        pipe.llen(queue)
+    replies = pipe.execute()
+    stats = {}
+    for i, queue in enumerate(queues):
+        delayed, due, oldest, ready = replies[4 * i:4 * i + 4]
+        lag = max(0.0, now - oldest[0][1]) if oldest else 0.0
+        stats[queue] = {"delayed": delayed, "due": due, "ready": ready, "lag_seconds": round(lag, 3)}
+    return stats
+
+
+class DelayScheduler:
+    """Boucle de livraison des messages différés dus vers leur file de travail"""
+
+    def __init__(self, redis_conn, queues=None, batch_size=SCHEDULER_BATCH_SIZE,
+                 poll_interval=SCHEDULER_POLL_INTERVAL):
+        self.redis_conn = redis_conn
+        self.queues = queues or SCHEDULER_QUEUES
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._move_due = redis_conn.register_script(MOVE_DUE_LUA)
+        self.running = False
+        self.moved = 0
+        self.max_lag = 0.0
+
+    def tick(self, now=None):
+        """Un passage sur chaque file ; retourne le nombre de messages livrés"""
+        now = time.time() if now is None else now
+        total = 0
+        for queue in self.queues:
+            moved, oldest = self._move_due(keys=[delayed_key(queue), queue], args=[now, self.batch_size])
+            if moved:
+                total += moved
+                self.max_lag = max(self.max_lag, now - float(oldest))
+        self.moved += total
+        return total
+
+    def run(self):
+        self.running = True
+        log(f"⏰ Ordonnanceur démarré : files {self.queues}, lots de {self.batch_size}")
+        next_beat = next_report = 0.0
+        while self.running:
+            now = time.monotonic()
+            if now >= next_beat:
+                next_beat = now + ALIVE_TTL / 3
+                try:
+                    self.redis_conn.set(ALIVE_KEY, os.getpid(), ex=ALIVE_TTL)
+                except Exception as e:
+                    log(f"⚠️ Ordonnanceur : battement de cœur impossible : {e}", level="WARNING")
+            if now >= next_report:
+                self.report()
+                next_report = now + SCHEDULER_REPORT_INTERVAL
+            try:
+                moved = self.tick()
+            except Exception as e:
+                log(f"❌ Ordonnanceur : livraison impossible : {e}", level="ERROR")
+                moved = 0
+                time.sleep(1)
+            # Lot plein : il en reste, on enchaîne sans attendre
+            if moved < self.batch_size:
+                time.sleep(self.poll_interval)
+        self.report()
+        log("⏰ Ordonnanceur arrêté")
+
+    def stop(self, *args):
+        self.running = False
+
+    def release(self):
+        """Retire le battement de cœur s'il est encore le nôtre (un autre ordonnanceur a pu prendre le relais)"""
+        try:
+            self.redis_conn.register_script(RELEASE_ALIVE_LUA)(keys=[ALIVE_KEY], args=[os.getpid()])
+        except Exception as e:
+            log(f"⚠️ Ordonnanceur : battement de cœur non retiré : {e}", level="WARNING")
+
+    def report(self):
+        try:
+            stats = queue_stats(self.redis_conn, self.queues)
+        except Exception as e:
+            log(f"⚠️ Statistiques de l'ordonnanceur indisponibles : {e}", level="WARNING")
+            return None
+        summary = {"moved_total": self.moved, "max_lag_seconds": round(self.max_lag, 3),
+                   "updated_at": int(time.time()), "queues": stats}
+        try:
+            self.redis_conn.set(STATS_KEY, json.dumps(summary))
+        except Exception as e:
+            log(f"⚠️ Statistiques de l'ordonnanceur non publiées : {e}", level="WARNING")
+        log(f"⏰ Ordonnanceur : {summary}")
+        self.max_lag = 0.0
+        return summary
+
+
+if __name__ == '__main__':
+    from redis_client import get_redis
+
+    redis_conn = get_redis()
+    if sys.argv[1:] == ["stats"]:
+        print(json.dumps(queue_stats(redis_conn), indent=2))
+        sys.exit(0)
+
+    scheduler = DelayScheduler(redis_conn)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    try:
+        scheduler.run()
+    finally:
+        scheduler.release()
+        shutdown_logging()
@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+from logger import log
+
+# 🚀 Profil de démarrage : "lazy" (connexions au premier usage) ou "eager" (ouvertes dès le démarrage du worker)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy").lower()
+
+
+class Lazy:
+    """Objet construit au premier accès à un de ses attributs.
+
+    Permet de déclarer les clients (Redis, services qui en dépendent) au
+    niveau du module sans rien créer à l'import : l'import de `tasks` ou de
+    `app` ne touche ni au réseau ni aux variables d'environnement manquantes.
+    Dans l'enfant d'un fork, l'objet est oublié et reconstruit au premier
+    accès : pas de client (pool Redis, sockets) partagé avec le parent.
+    """
+
+    __slots__ = ("_factory", "_instance", "_lock")
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        self._forget()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self):
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, "_instance", self._factory())
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __repr__(self):
+        state = repr(self._instance) if self._instance is not None else "non initialisé"
+        return f"<Lazy {state}>"
+
+
+def warm_up(redis_conn=None, db=True, http=True):
+    """Mode eager : ouvre Redis, une connexion MySQL du pool et la session HTTP.
+
+    Les échecs sont journalisés sans bloquer le démarrage ; le client
+    concerné sera de toute façon retenté au premier usage.
+    """
+    timings = {}
+    if redis_conn is not None:
+        timings["redis"] = _timed(redis_conn.ping)
+    if db:
+        from db_pool import get_pool
+
+        def checkout():
+            with get_pool().connection():
+                pass
+        timings["mysql"] = _timed(checkout)
+    if http:
+        from http_client import get_client
+        timings["http"] = _timed(get_client)
+    log(f"🚀 Démarrage eager : {timings}")
+    return timings
+
+
+def _timed(func):
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        log(f"⚠️ Préchauffage impossible : {e}", level="WARNING")
+        return None
+    return round((time.perf_counter() - start) * 1000, 1)
@@ -1,443 +1,169 @@
 import os
 import json
-from redis import Redis
 from logger import log
+from claim import ConversationClaims
+from contact_cache import ContactNameCache
+from contact_index import lookup_contact, start_index_refresher, stop_index_refresher
+from contact_snapshot import get_snapshot, init_snapshot, stop_snapshot
+from enqueue import enqueue_batch
+from metrics import PROCESS_MESSAGES, stage, mark_process_dead
+from tracing import trace, traced, span, annotate
+from profiler import profiled
+from endpoint_discovery import EndpointDiscovery
+from http_client import get_client, close_client
+from db_pool import get_pool, init_pool, close_pool
+from startup import Lazy, STARTUP_MODE, warm_up
+from redis_client import get_redis, close_redis
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_ready, worker_shutdown
 from celery_worker import celery  # 🔁 Import du Celery app
 
 SERVER = os.getenv("SERVER")
 API_KEY = os.getenv("API_KEY")
 SECOND_MESSAGE_LINK = os.getenv("SECOND_MESSAGE_LINK")
 
-print(SERVER, API_KEY, SECOND_MESSAGE_LINK)
-
-# 🧪 Fonction helper pour obtenir la liste des endpoints à tester
-def get_contact_endpoints_to_test():
-    """Retourne une liste de tuples (endpoint, method, params) à tester"""
-    return [
-        # Format /services/...
-        (f"{SERVER}/services/contact.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/services/contacts.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/services/get_contact.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/services/get_contacts.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/services/contact_list.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/services/list_contacts.php", "POST", {'key': API_KEY}),
-        # Format /api/...
-        (f"{SERVER}/api/contact.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/api/contacts.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/api/get_contacts.php", "POST", {'key': API_KEY}),
-        # Format avec action
-        (f"{SERVER}/api.php", "POST", {'key': API_KEY, 'action': 'contacts'}),
-        (f"{SERVER}/api.php", "POST", {'key': API_KEY, 'action': 'get_contacts'}),
-        (f"{SERVER}/api.php", "POST", {'key': API_KEY, 'action': 'list_contacts'}),
-        (f"{SERVER}/services/api.php", "POST", {'key': API_KEY, 'action': 'contacts'}),
-        # Format GET
-        (f"{SERVER}/services/contacts.php", "GET", {'key': API_KEY}),
-        (f"{SERVER}/api/contacts.php", "GET", {'key': API_KEY}),
-        (f"{SERVER}/api.php?key={API_KEY}&action=contacts", "GET", None),
-        # Format dashboard
-        (f"{SERVER}/dashboard/api/contacts.php", "POST", {'key': API_KEY}),
-        (f"{SERVER}/dashboard/services/contacts.php", "POST", {'key': API_KEY}),
-    ]
-
-# 🧪 Fonction de test pour récupérer tous les contacts
-# 
-# ⚠️ NOTE: Si aucun endpoint ne fonctionne, vérifiez dans votre dashboard noname-sms.com:
-#   1. Allez sur https://noname-sms.com/dashboard.php
-#   2. Cherchez une section "API" ou "Documentation"
-#   3. Vérifiez s'il y a un endpoint spécifique pour récupérer les contacts
-#   4. Il est possible que l'API ne permette pas de récupérer les contacts directement
-#      Dans ce cas, vous devrez peut-être stocker les contacts localement ou utiliser une autre méthode
-#
-def test_get_all_contacts():
-    """Test pour récupérer tous les contacts et les afficher"""
-    import requests
-    print(f"\n{'='*60}")
-    print("🧪 TEST: Récupération de TOUS les contacts")
-    print(f"{'='*60}")
-    print(f"SERVER: {SERVER}")
-    print(f"API_KEY: {API_KEY[:20]}..." if API_KEY else "API_KEY: None")
-    
-    endpoints_to_test = get_contact_endpoints_to_test()
-    
-    for endpoint, method, params in endpoints_to_test:
-        try:
-            print(f"\n🔍 Test endpoint: {endpoint}")
-            print(f"   Méthode: {method}, Params: {params}")
-            
-            if method == "POST":
-                if params:
-                    response = requests.post(endpoint, data=params, timeout=10)
-                else:
-                    response = requests.post(endpoint, timeout=10)
-            else:  # GET
-                if params:
-                    response = requests.get(endpoint, params=params, timeout=10)
-                else:
-                    response = requests.get(endpoint, timeout=10)
-            
-            print(f"📡 Status Code: {response.status_code}")
-            print(f"📡 URL finale: {response.url}")
-            
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    print(f"\n✅ SUCCÈS! RÉPONSE JSON:")
-                    print(json.dumps(data, indent=2, ensure_ascii=False))
-                    
-                    contacts = data.get("data") or data.get("contacts") or data.get("result") or data
-                    print(f"\n📋 CONTACTS EXTRACTÉS:")
-                    print(f"Type: {type(contacts)}")
-                    
-                    if isinstance(contacts, list):
-                        print(f"✅ Nombre de contacts: {len(contacts)}")
-                        for idx, contact in enumerate(contacts, 1):
-                            print(f"\n  Contact #{idx}:")
-                            print(json.dumps(contact, indent=4, ensure_ascii=False))
-                    elif isinstance(contacts, dict):
-                        print(f"✅ Contact unique (dict):")
-                        print(json.dumps(contacts, indent=4, ensure_ascii=False))
-                    else:
-                        print(f"Contenu: {contacts}")
-                    
-                    print(f"\n{'='*60}\n")
-                    print(f"🎉 ENDPOINT TROUVÉ: {endpoint} avec méthode {method}")
-                    return data
-                except json.JSONDecodeError:
-                    print(f"⚠️ Réponse n'est pas du JSON")
-                    print(f"Contenu (premiers 500 chars): {response.text[:500]}")
-            elif response.status_code == 404:
-                print(f"❌ 404 - Endpoint non trouvé")
-            else:
-                print(f"❌ Erreur HTTP {response.status_code}")
-                print(f"Réponse (premiers 500 chars): {response.text[:500]}")
-        except requests.exceptions.Timeout:
-            print(f"⏱️ Timeout - endpoint ne répond pas")
-        except Exception as e:
-            print(f"❌ Exception: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    print(f"\n{'='*60}")
-    print("❌ Aucun endpoint valide trouvé pour récupérer les contacts")
-    print(f"{'='*60}\n")
-    return None
+# 🩺 Diagnostics (liste des contacts DB / API) : python diagnostics.py, plus rien à l'import
 
-def test_get_all_contacts_from_db():
-    """Test pour récupérer tous les contacts depuis la base de données MySQL"""
-    try:
-        import pymysql
-        
-        # Configuration de la base de données
-        db_host = os.getenv("DB_HOST", "localhost")
-        db_user = os.getenv("DB_USER", "admin_a")
-        db_pass = os.getenv("DB_PASS", "Metadjer12")
-        db_name = os.getenv("DB_NAME", "admin_a")
-        
-        print(f"\n{'='*60}")
-        print("🧪 TEST: Récupération de TOUS les contacts depuis la BASE DE DONNÉES")
-        print(f"{'='*60}")
-        print(f"Host: {db_host}")
-        print(f"User: {db_user}")
-        print(f"Database: {db_name}")
-        
-        # Connexion à la base de données
-        connection = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_pass,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        
-        try:
-            with connection.cursor() as cursor:
-                # Récupérer tous les contacts
-                cursor.execute("SELECT name, number, contactsListID, subscribed, ID FROM Contact ORDER BY number")
-                all_contacts = cursor.fetchall()
-                
-                print(f"\n✅ Nombre total de contacts: {len(all_contacts)}")
-                print(f"\n📋 TOUS LES CONTACTS:")
-                print(f"{'='*60}")
-                
-                for idx, contact in enumerate(all_contacts, 1):
-                    print(f"\n  Contact #{idx}:")
-                    print(f"    ID: {contact.get('ID')}")
-                    print(f"    Nom: {contact.get('name') or '(sans nom)'}")
-                    print(f"    Numéro: {contact.get('number')}")
-                    print(f"    Liste ID: {contact.get('contactsListID')}")
-                    print(f"    Abonné: {contact.get('subscribed')}")
-                
-                print(f"\n{'='*60}\n")
-                
-        finally:
-            connection.close()
-            
-    except Exception as e:
-        print(f"❌ Erreur: {e}")
-        import traceback
-        traceback.print_exc()
+# ✅ Connexion Redis (pool partagé du process, créé au premier usage)
+redis_conn = Lazy(get_redis)
+
+# 🧠 Cache des noms de contacts (LRU local + hash Redis partagé)
+contact_cache = Lazy(lambda: ContactNameCache(redis_conn))
+
+# 🔒 Réservation / validation atomiques par numéro (scripts Lua)
+claims = Lazy(lambda: ConversationClaims(redis_conn))
+
+# 🧭 Endpoint de contacts de la passerelle, découvert une fois puis mémorisé
+contact_endpoint = Lazy(lambda: EndpointDiscovery(redis_conn))
+CLAIM_RETRY_DELAY = int(os.getenv("CLAIM_RETRY_DELAY", "30"))
 
-# Décommenter la ligne suivante pour tester au démarrage
-# test_get_all_contacts()  # Test API (ne fonctionne probablement pas)
-test_get_all_contacts_from_db()  # Test Base de données (devrait fonctionner)
 
-# ✅ Connexion Redis
-REDIS_URL = os.getenv("REDIS_URL")
-redis_conn = Redis.from_url(REDIS_URL)
+class ContactLookupFailed(Exception):
+    """Source de noms indisponible : l'absence de nom n'est pas certaine, donc pas mise en cache"""
 
-def get_conversation_key(number):
-    return f"conv:{number}"
+# 📦 Arguments de tâche compacts (numéro, ID, device) au lieu du message JSON
+# complet ; false le temps qu'aucun worker de l'ancienne version ne consomme plus
+COMPACT_TASK_ARGS = os.getenv("COMPACT_TASK_ARGS", "true").lower() == "true"
 
-def is_archived(number):
-    return redis_conn.sismember("archived_numbers", number)
+# 🛢️ Un pool MySQL par process worker (créé après le fork)
+@worker_process_init.connect
+def _init_worker_db_pool(**kwargs):
+    pool = init_pool()
+    init_snapshot(pool)  # 📇 seulement si CONTACT_SNAPSHOT=true
+    if STARTUP_MODE == "eager":
+        warm_up(redis_conn)
 
-def archive_number(number):
-    redis_conn.sadd("archived_numbers", number)
+@worker_process_shutdown.connect
+def _close_worker_clients(**kwargs):
+    stop_snapshot()
+    close_pool()
+    close_client()
+    close_redis()
+    mark_process_dead()
 
-def mark_message_processed(number, msg_id):
-    redis_conn.sadd(f"processed:{number}", msg_id)
+# 🧵 Pool `threads` (profil low-memory) : pas de process enfant, donc pas de
+# worker_process_init/shutdown — le process principal s'initialise lui-même
+def _uses_threads_pool(worker):
+    pool_cls = getattr(worker, "pool_cls", "")
+    name = pool_cls if isinstance(pool_cls, str) else pool_cls.__module__
+    return "thread" in name
 
-def is_message_processed(number, msg_id):
-    return redis_conn.sismember(f"processed:{number}", msg_id)
+@worker_init.connect
+def _init_threads_worker(sender=None, **kwargs):
+    if _uses_threads_pool(sender):
+        _init_worker_db_pool()
 
+@worker_shutdown.connect
+def _close_threads_worker(sender=None, **kwargs):
+    if _uses_threads_pool(sender):
+        _close_worker_clients()
+
+# 🗂️ Index des numéros de contacts tenu à jour hors du chemin de lecture : process
+# principal, après le fork des process enfants, avec son propre client Redis
+@worker_ready.connect
+def _start_contact_index_refresh(**kwargs):
+    start_index_refresher()
+
+@worker_shutdown.connect
+def _stop_contact_index_refresh(**kwargs):
+    stop_index_refresher()
+
+@traced()
 def send_request(url, post_data):
-    import requests
-    log(f"🌐 Requête POST → {url} | data: {post_data}")
+    log(f"🌐 Requête POST → {url} | data: {post_data}", level="DEBUG")
     try:
-        response = requests.post(url, data=post_data)
+        response = get_client().post(url, data=post_data)
         data = response.json()
-        log(f"📨 Réponse reçue : {data}")
+        log(f"📨 Réponse reçue : {data}", level="DEBUG")
         return data.get("data")
     except Exception as e:
-        log(f"❌ Erreur POST : {e}")
+        log(f"❌ Erreur POST : {e}", level="ERROR")
         return None
 
+@traced()
 def get_contact_name_from_db(number):
     """Récupère le nom du contact depuis la base de données MySQL"""
+    # Mode snapshot : table Contact déjà en mémoire, aucun aller-retour DB
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        name = snapshot.lookup_name(number)
+        log(f"📇 Snapshot contacts : {number} → {name}", level="DEBUG")
+        return name
+
     try:
-        import pymysql
-        
-        # Configuration de la base de données depuis les variables d'environnement ou valeurs par défaut
-        db_host = os.getenv("DB_HOST", "localhost")
-        db_user = os.getenv("DB_USER", "admin_a")
-        db_pass = os.getenv("DB_PASS", "Metadjer12")
-        db_name = os.getenv("DB_NAME", "admin_a")
-        
-        print(f"\n{'#'*60}")
-        print(f"🔍 Connexion à la base de données MySQL")
-        print(f"   Host: {db_host}")
-        print(f"   User: {db_user}")
-        print(f"   Database: {db_name}")
-        print(f"   Recherche du numéro: {number}")
-        print(f"{'#'*60}\n")
-        
-        # Connexion à la base de données
-        connection = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_pass,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        
-        try:
+        with get_pool().connection() as connection:
             with connection.cursor() as cursor:
-                # Rechercher le contact par numéro
-                # Normaliser le numéro pour la recherche (enlever espaces, +, etc.)
-                normalized_number = str(number).strip().replace("+", "").replace(" ", "").replace("-", "")
-                
-                # Essayer plusieurs formats de recherche
-                queries = [
-                    ("SELECT name, number FROM Contact WHERE number = %s LIMIT 1", [number]),
-                    ("SELECT name, number FROM Contact WHERE number = %s LIMIT 1", [normalized_number]),
-                    ("SELECT name, number FROM Contact WHERE REPLACE(REPLACE(REPLACE(number, '+', ''), ' ', ''), '-', '') = %s LIMIT 1", [normalized_number]),
-                    ("SELECT name, number FROM Contact WHERE number LIKE %s LIMIT 1", [f"%{normalized_number}%"]),
-                ]
-                
-                for query, params in queries:
-                    cursor.execute(query, params)
-                    result = cursor.fetchone()
-                    if result:
-                        name = result.get('name')
-                        contact_number = result.get('number')
-                        print(f"✅ Contact trouvé dans la DB:")
-                        print(f"   Nom: {name}")
-                        print(f"   Numéro: {contact_number}")
-                        if name:
-                            return name
-                
-                # Si aucun contact trouvé, afficher tous les contacts pour debug
-                print(f"\n📋 Aucun contact trouvé pour {number}. Affichage de TOUS les contacts:")
-                cursor.execute("SELECT name, number, contactsListID, subscribed FROM Contact ORDER BY number LIMIT 100")
-                all_contacts = cursor.fetchall()
-                print(f"   Nombre total de contacts (premiers 100): {len(all_contacts)}")
-                for idx, contact in enumerate(all_contacts, 1):
-                    print(f"   Contact #{idx}: name='{contact.get('name')}', number='{contact.get('number')}', listID={contact.get('contactsListID')}, subscribed={contact.get('subscribed')}")
-                
-        finally:
-            connection.close()
-            
+                # Recherche par numéro normalisé (table ContactNumberIndex, requête indexée)
+                result = lookup_contact(cursor, number)
+                if result:
+                    log(f"✅ Contact trouvé dans la DB : {number} → {result.get('name')}", level="DEBUG")
+                    return result.get('name')
     except Exception as e:
-        print(f"❌ Erreur lors de la récupération depuis la DB: {e}")
-        import traceback
-        traceback.print_exc()
-    
+        log(f"❌ Erreur lors de la récupération depuis la DB : {e}", level="ERROR")
+        raise ContactLookupFailed(f"DB : {e}") from e
+
+    log(f"📋 Aucun contact en base pour {number}", level="DEBUG")
     return None
 
+@traced()
 def get_contact_name(number):
-    """Récupère le nom du contact depuis la base de données MySQL ou l'API"""
+    """Récupère le nom du contact via le cache, sinon via la DB / l'API"""
+    found, name = contact_cache.get(number)
+    if found:
+        log(f"🧠 Nom en cache pour {number} : {name}")
+        return name
+
+    name, complete = resolve_contact_name(number)
+    # Pas de cache négatif si une source a échoué : on réessaiera au prochain message
+    if name or complete:
+        contact_cache.set(number, name)
+    return name
+
+def resolve_contact_name(number):
+    """Récupère le nom du contact depuis la base de données MySQL ou l'API.
+
+    Retourne (nom, complet) : `complet` est faux si la DB ou l'API a échoué.
+    """
     # D'abord essayer la base de données (plus rapide et fiable)
-    name = get_contact_name_from_db(number)
+    complete = True
+    try:
+        name = get_contact_name_from_db(number)
+    except ContactLookupFailed:
+        name, complete = None, False
     if name:
-        return name
-    
-    # Si pas trouvé dans la DB, essayer l'API (méthode de fallback)
-    import requests
-    print(f"\n{'#'*60}")
-    print(f"🔍 get_contact_name() appelée pour le numéro: {number}")
-    print(f"🔍 SERVER: {SERVER}")
-    print(f"🔍 API_KEY: {API_KEY[:20]}..." if API_KEY else "🔍 API_KEY: None")
-    print(f"{'#'*60}\n")
+        return name, True
+
+    # Si pas trouvé dans la DB, essayer l'API : seul l'endpoint découvert est appelé
     try:
-        # Essayer différents endpoints possibles pour récupérer les contacts
-        endpoints_to_test = get_contact_endpoints_to_test()
-        
-        for endpoint, method, base_params in endpoints_to_test:
-            try:
-                print(f"\n{'='*60}")
-                print(f"🔍 Tentative de récupération du contact pour {number} via {endpoint}")
-                print(f"{'='*60}")
-                log(f"🔍 Tentative de récupération du contact pour {number} via {endpoint}")
-                
-                # Ajouter le numéro aux paramètres
-                if base_params is None:
-                    params = {'number': number, 'key': API_KEY}
-                else:
-                    params = base_params.copy()
-                    params['number'] = number
-                
-                if method == "POST":
-                    response = requests.post(endpoint, data=params, timeout=10)
-                else:  # GET
-                    response = requests.get(endpoint, params=params, timeout=10)
-                
-                print(f"📡 Status Code: {response.status_code}")
-                print(f"📡 URL: {endpoint}")
-                print(f"📡 Request Data: key={API_KEY[:10]}..., number={number}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"\n📋 RÉPONSE BRUTE DE L'API:")
-                    print(f"{json.dumps(data, indent=2, ensure_ascii=False)}")
-                    log(f"📋 Réponse contacts : {data}")
-                    
-                    # Essayer différents formats de réponse
-                    contacts = data.get("data") or data.get("contacts") or data
-                    print(f"\n📋 CONTACTS EXTRACTÉS:")
-                    print(f"Type: {type(contacts)}")
-                    print(f"Contenu: {contacts}")
-                    
-                    if isinstance(contacts, list):
-                        print(f"\n📋 TOUS LES CONTACTS ({len(contacts)} contacts):")
-                        for idx, contact in enumerate(contacts, 1):
-                            print(f"\n  Contact #{idx}:")
-                            print(f"    {json.dumps(contact, indent=4, ensure_ascii=False)}")
-                        print(f"\n{'='*60}\n")
-                        
-                        # Chercher le contact avec le numéro correspondant
-                        for contact in contacts:
-                            contact_number = str(contact.get("number") or contact.get("mobile") or contact.get("phone") or "").strip()
-                            print(f"🔍 Comparaison: contact_number='{contact_number}' vs number='{number}'")
-                            if contact_number == str(number).strip():
-                                name = contact.get("name") or contact.get("contact_name") or ""
-                                if name:
-                                    print(f"✅ Nom trouvé pour {number} : {name}")
-                                    log(f"✅ Nom trouvé pour {number} : {name}")
-                                    return name
-                    elif isinstance(contacts, dict):
-                        # Si c'est un seul contact retourné directement
-                        name = contacts.get("name") or contacts.get("contact_name") or ""
-                        if name:
-                            log(f"✅ Nom trouvé pour {number} : {name}")
-                            return name
-                    
-                    # Si on a une liste de contacts, chercher par numéro
-                    if isinstance(contacts, list):
-                        for contact in contacts:
-                            contact_number = str(contact.get("number") or contact.get("mobile") or contact.get("phone") or "").strip()
-                            # Normaliser les numéros (enlever espaces, +, etc.)
-                            normalized_number = str(number).strip().replace("+", "").replace(" ", "")
-                            normalized_contact = contact_number.replace("+", "").replace(" ", "")
-                            if normalized_contact == normalized_number or contact_number == str(number).strip():
-                                name = contact.get("name") or contact.get("contact_name") or ""
-                                if name:
-                                    log(f"✅ Nom trouvé pour {number} : {name}")
-                                    return name
-            except Exception as e:
-                log(f"⚠️ Erreur avec endpoint {endpoint} : {e}")
-                continue
-        
-        # Si aucun endpoint n'a fonctionné, essayer de récupérer tous les contacts (sans filtre number)
-        endpoints_to_test_all = get_contact_endpoints_to_test()
-        for endpoint, method, base_params in endpoints_to_test_all:
-            try:
-                print(f"\n{'='*60}")
-                print(f"🔍 Tentative de récupération de TOUS les contacts (sans filtre) via {endpoint}")
-                print(f"{'='*60}")
-                log(f"🔍 Tentative de récupération de tous les contacts via {endpoint}")
-                
-                # Ne pas ajouter 'number' pour récupérer tous les contacts
-                if base_params is None:
-                    params = {'key': API_KEY}
-                else:
-                    params = base_params.copy()
-                
-                if method == "POST":
-                    response = requests.post(endpoint, data=params, timeout=10)
-                else:  # GET
-                    response = requests.get(endpoint, params=params, timeout=10)
-                
-                print(f"📡 Status Code: {response.status_code}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"\n📋 RÉPONSE BRUTE (tous contacts):")
-                    print(f"{json.dumps(data, indent=2, ensure_ascii=False)}")
-                    
-                    contacts = data.get("data") or data.get("contacts") or []
-                    print(f"\n📋 CONTACTS EXTRACTÉS (tous):")
-                    print(f"Type: {type(contacts)}")
-                    print(f"Nombre: {len(contacts) if isinstance(contacts, list) else 'N/A'}")
-                    
-                    if isinstance(contacts, list):
-                        print(f"\n📋 TOUS LES CONTACTS ({len(contacts)} contacts):")
-                        for idx, contact in enumerate(contacts, 1):
-                            print(f"\n  Contact #{idx}:")
-                            print(f"    {json.dumps(contact, indent=4, ensure_ascii=False)}")
-                        print(f"\n{'='*60}\n")
-                        
-                        for contact in contacts:
-                            contact_number = str(contact.get("number") or contact.get("mobile") or contact.get("phone") or "").strip()
-                            normalized_number = str(number).strip().replace("+", "").replace(" ", "")
-                            normalized_contact = contact_number.replace("+", "").replace(" ", "")
-                            if normalized_contact == normalized_number or contact_number == str(number).strip():
-                                name = contact.get("name") or contact.get("contact_name") or ""
-                                if name:
-                                    print(f"✅ Nom trouvé pour {number} : {name}")
-                                    log(f"✅ Nom trouvé pour {number} : {name}")
-                                    return name
-            except Exception as e:
-                print(f"⚠️ Erreur avec endpoint {endpoint}: {e}")
-                continue
-        
-        log(f"⚠️ Aucun nom trouvé pour le numéro {number}")
-        return None
-        
+        with span("contact_api"):
+            name = contact_endpoint.lookup_name(number)
     except Exception as e:
-        log(f"❌ Erreur lors de la récupération du contact : {e}")
-        return None
+        log(f"❌ Erreur lors de la récupération du contact : {e}", level="ERROR")
+        return None, False
+    if name:
+        log(f"✅ Nom trouvé pour {number} : {name}")
+        return name, True
+    log(f"⚠️ Aucun nom trouvé pour le numéro {number}")
+    return None, complete
 
 def send_single_message(number, message, device_slot):
     log(f"📦 Envoi à {number} via SIM {device_slot}")
@@ -450,59 +176,113 @@ def send_single_message(number, message, device_slot):
         'key': API_KEY,
     })
 
-@celery.task(name="process_message")
-def process_message(msg_json):
-    log("🔧 Début de process_message")
-    log(f"🛎️ Job brut reçu : {msg_json}")
+def build_reply(name_value):
+    return f"Pardon, j’étais en tournée et je n’avais pas vu votre message. Il faut effectuer la demande via : https://{name_value}.{SECOND_MESSAGE_LINK}\n merci"
 
-    try:
-        msg = json.loads(msg_json)
-        log(f"🧩 JSON décodé : {msg}")
-    except Exception as e:
-        log(f"❌ Erreur JSON : {e}")
-        return
+def task_request_id(request):
+    """request_id du webhook, transmis dans les en-têtes de la tâche"""
+    return getattr(request, "request_id", None) or (request.headers or {}).get("request_id")
 
-    number = msg.get("number")
-    msg_id = msg.get("ID")
-    device_id = msg.get("deviceID")
+def task_args(number, msg_id, device_id):
+    """Arguments de process_message : (numéro, ID, device), ou le message JSON si COMPACT_TASK_ARGS=false"""
+    if COMPACT_TASK_ARGS:
+        return [number, msg_id, device_id]
+    return [json.dumps({"ID": msg_id, "number": number, "deviceID": device_id})]
 
-    msg_id_short = str(msg_id)[-5:] if msg_id else "?????"
+@celery.task(name="process_message")
+def process_message(number, msg_id=None, device_id=None):
+    """Arguments compacts (numéro, ID, device) ; un seul argument : ancien format, le message en JSON"""
+    # 🔗 request_id du webhook, transmis dans les en-têtes de la tâche
+    request_id = task_request_id(process_message.request)
+    with trace("process_message", redis_conn, request_id=request_id), profiled("process_message"):
+        handle_message(number, msg_id, device_id, request_id=request_id)
+
+def parse_message(number, msg_id=None, device_id=None):
+    """(numéro, ID, device) du job, ou None si le JSON est invalide ou les champs incomplets"""
+    if msg_id is None and device_id is None:
+        # Ancien format (messages encore en file d'une version précédente)
+        try:
+            msg = json.loads(number)
+            number, msg_id, device_id = msg.get("number"), msg.get("ID"), msg.get("deviceID")
+        except Exception as e:
+            log(f"❌ Erreur JSON : {e} | job : {number}", level="ERROR")
+            PROCESS_MESSAGES.labels("invalid").inc()
+            return None
+    log(f"🛎️ Job reçu : number={number}, ID={msg_id}, device={device_id}", level="DEBUG")
 
     if not number or not msg_id or not device_id:
-        log(f"⛔️ [{msg_id_short}] Champs manquants : number={number}, ID={msg_id}, device={device_id}")
+        log(f"⛔️ [{short_id(msg_id)}] Champs manquants : number={number}, ID={msg_id}, device={device_id}")
+        PROCESS_MESSAGES.labels("invalid").inc()
+        return None
+    annotate(number=number, msg_id=msg_id)
+    return number, msg_id, device_id
+
+def short_id(msg_id):
+    return str(msg_id)[-5:] if msg_id else "?????"
+
+def handle_message(*args, request_id=None):
+    log("🔧 Début de process_message")
+    parsed = parse_message(*args)
+    if parsed is None:
         return
+    number, msg_id, device_id = parsed
+    msg_id_short = short_id(msg_id)
 
+    # 🔒 Réservation atomique du numéro (archivé ? déjà traité ? déjà en cours ?)
+    token = None
     try:
-        if is_archived(number):
+        with stage("claim"):
+            status, step, token = claims.claim(number, msg_id, device_id)
+        if status != "ok":
+            PROCESS_MESSAGES.labels(status).inc()
+        if status == "archived":
             log(f"🗃️ [{msg_id_short}] Numéro archivé, ignoré.")
             return
-        if is_message_processed(number, msg_id):
+        if status == "processed":
             log(f"🔁 [{msg_id_short}] Message déjà traité, ignoré.")
             return
-
-        conv_key = get_conversation_key(number)
-        step = int(redis_conn.hget(conv_key, "step") or 0)
-        redis_conn.hset(conv_key, "device", device_id)
+        if status == "claimed":
+            # Un autre message du même numéro est en cours : on repasse plus tard,
+            # le numéro sera alors archivé (réponse envoyée) ou libéré (échec)
+            token = None
+            log(f"🔒 [{msg_id_short}] Numéro en cours de traitement, nouvel essai dans {CLAIM_RETRY_DELAY}s.")
+            _, error = enqueue_batch(redis_conn, process_message.name,
+                                     [(task_args(number, msg_id, device_id), CLAIM_RETRY_DELAY)],
+                                     headers={"request_id": request_id} if request_id else None)[0]
+            if error is not None:
+                raise error
+            return
 
         log(f"📊 [{msg_id_short}] Étape actuelle : {step}")
 
         if step == 0:
             # Récupérer le nom du contact depuis l'API
-            contact_name = get_contact_name(number)
+            with stage("contact_lookup"):
+                contact_name = get_contact_name(number)
             # Si aucun nom n'est trouvé, utiliser une valeur par défaut
             name_value = contact_name if contact_name else "default"
             
-            reply = f"Pardon, j’étais en tournée et je n’avais pas vu votre message. Il faut effectuer la demande via : https://{name_value}.{SECOND_MESSAGE_LINK}\n merci"
-            send_single_message(number, reply, device_id)
-            mark_message_processed(number, msg_id)
-            archive_number(number)
-            redis_conn.delete(conv_key)
+            reply = build_reply(name_value)
+            with stage("send"):
+                send_single_message(number, reply, device_id)
+            with stage("commit"):
+                claims.commit(number, msg_id, token)
+            token = None
+            PROCESS_MESSAGES.labels("sent").inc()
             log(f"✅ [{msg_id_short}] Réponse envoyée et conversation archivée.")
         else:
             log(f"🗃️ [{msg_id_short}] Conversation déjà traitée, ignoré.")
+            PROCESS_MESSAGES.labels("already_handled").inc()
             return
 
         log(f"🏁 [{msg_id_short}] Fin du traitement de ce message")
 
     except Exception as e:
-        log(f"💥 [{msg_id_short}] Erreur interne : {e}")
+        log(f"💥 [{msg_id_short}] Erreur interne : {e}", level="ERROR")
+        PROCESS_MESSAGES.labels("error").inc()
+    finally:
+        if token is not None:
+            try:
+                claims.release(number, token)
+            except Exception as e:
+                log(f"⚠️ [{msg_id_short}] Libération de la réservation impossible : {e}", level="WARNING")
@@ -0,0 +1,155 @@
+"""Traces légères de process_message : une trace par message, un span par étape.
+
+Le `request_id` du webhook voyage dans les en-têtes de la tâche Celery. Les
+spans s'accrochent à la trace courante (contextvars : un contexte par thread
+et par tâche asyncio) ; sans trace en cours, `span` ne fait rien. Toute trace
+plus longue que TRACE_SLOW_THRESHOLD secondes est gardée avec le détail de
+ses spans dans une liste Redis bornée (`traces:slow`, TRACE_BUFFER_SIZE
+entrées), consultable via la route `/traces` de l'app.
+"""
+import os
+import json
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+from logger import log
+
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "5"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+TRACE_KEY = "traces:slow"
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("name", "request_id", "attrs", "started_at", "_start", "duration", "spans", "error", "_depth")
+
+    def __init__(self, name, request_id=None, **attrs):
+        self.name = name
+        self.request_id = request_id
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.error = None
+        self._depth = 0
+
+    @property
+    def slow(self):
+        return self.duration is not None and self.duration >= TRACE_SLOW_THRESHOLD
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "request_id": self.request_id,
+            "attrs": self.attrs,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round((self.duration or 0) * 1000, 1),
+            "error": self.error,
+            "spans": self.spans,
+        }
+
+
+def current_trace():
+    return _current.get()
+
+
+def annotate(**attrs):
+    """Ajoute des attributs à la trace courante (numéro, ID du message…)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+@contextmanager
+def trace(name, redis_conn=None, request_id=None, **attrs):
+    """Ouvre une trace ; si `redis_conn` est fourni, la garde dans le tampon si elle est lente"""
+    current = Trace(name, request_id, **attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        current.duration = time.perf_counter() - current._start
+        if redis_conn is not None and current.slow:
+            save(redis_conn, current)
+
+
+@contextmanager
+def span(name, **attrs):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    entry = {"name": name, "depth": trace._depth, "start_ms": round((start - trace._start) * 1000, 1)}
+    if attrs:
+        entry["attrs"] = attrs
+    trace.spans.append(entry)
+    trace._depth += 1
+    try:
+        yield
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace._depth -= 1
+        entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def traced(name=None):
+    """Décorateur : un span autour de chaque appel de la fonction"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def save(redis_conn, trace):
+    """LPUSH + LTRIM : les TRACE_BUFFER_SIZE traces lentes les plus récentes"""
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.lpush(TRACE_KEY, json.dumps(trace.to_dict(), ensure_ascii=False))
+        pipe.ltrim(TRACE_KEY, 0, TRACE_BUFFER_SIZE - 1)
+        pipe.execute()
+    except Exception as e:
+        log(f"⚠️ Trace lente non enregistrée : {e}", level="WARNING")
+        return
+    log(f"🐢 Message lent ({trace.to_dict()['duration_ms']} ms, requête {trace.request_id}) : "
+        f"{[(s['name'], s.get('duration_ms')) for s in trace.spans]}", level="WARNING")
+
+
+async def save_async(redis_conn, trace):
+    """`save` pour un client redis.asyncio"""
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.lpush(TRACE_KEY, json.dumps(trace.to_dict(), ensure_ascii=False))
+        pipe.ltrim(TRACE_KEY, 0, TRACE_BUFFER_SIZE - 1)
+        await pipe.execute()
+    except Exception as e:
+        log(f"⚠️ Trace lente non enregistrée : {e}", level="WARNING")
+
+
+def recent_traces(redis_conn, limit=50, request_id=None, min_duration_ms=None):
+    """Traces lentes les plus récentes d'abord, filtrées par requête ou durée minimale"""
+    traces = []
+    for raw in redis_conn.lrange(TRACE_KEY, 0, TRACE_BUFFER_SIZE - 1):
+        entry = json.loads(raw)
+        if request_id and entry.get("request_id") != request_id:
+            continue
+        if min_duration_ms is not None and entry.get("duration_ms", 0) < min_duration_ms:
+            continue
+        traces.append(entry)
+        if len(traces) >= limit:
+            break
+    return traces
@@ -0,0 +1,247 @@
+"""Lecture en flux du corps du webhook, sans copie complète du payload en mémoire.
+
+`FormFieldDecoder` extrait d'un corps application/x-www-form-urlencoded,
+morceau par morceau, les octets décodés d'un champ (`messages`).
+`JsonArrayParser` découpe un tableau JSON élément par élément au fil des
+morceaux reçus ; seul l'élément en cours de lecture est gardé en tampon.
+`SignedFieldReader` assemble les deux pour le webhook, quel que soit le
+serveur (Flask synchrone ou aiohttp) qui lit le corps.
+"""
+import re
+import hmac
+import json
+import base64
+import codecs
+import hashlib
+import tempfile
+from urllib.parse import unquote_plus, unquote_to_bytes
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9eE+\-.]*")
+_COMPACT_AT = 64 * 1024
+
+
+class FormFieldDecoder:
+    """Décodeur incrémental d'un champ de formulaire URL-encodé (première occurrence)"""
+
+    def __init__(self, field):
+        self.field = field
+        self.found = False
+        self._name = b""
+        self._in_value = False
+        self._target = False
+        self._done = False
+        self._carry = b""
+
+    def feed(self, chunk):
+        """Retourne la liste des morceaux décodés du champ présents dans `chunk`"""
+        data = self._carry + chunk
+        self._carry = b""
+        out = []
+        i = 0
+        while i < len(data):
+            if not self._in_value:
+                j = _find_any(data, i, b"=&")
+                if j < 0:
+                    self._name += data[i:]
+                    break
+                self._name += data[i:j]
+                if data[j:j + 1] == b"=":
+                    name = unquote_plus(self._name.decode("latin-1"))
+                    self._target = name == self.field and not self._done
+                    self._in_value = True
+                    if self._target:
+                        self.found = True
+                self._name = b""
+                i = j + 1
+                continue
+
+            j = data.find(b"&", i)
+            end = len(data) if j < 0 else j
+            if self._target:
+                segment = data[i:end]
+                if j < 0:
+                    # Échappement %XX coupé entre deux morceaux : on le garde pour la suite
+                    cut = segment.rfind(b"%", max(0, len(segment) - 2))
+                    if cut >= 0:
+                        self._carry, segment = segment[cut:], segment[:cut]
+                if segment:
+                    out.append(unquote_to_bytes(segment.replace(b"+", b" ")))
+            if j < 0:
+                break
+            if self._target:
+                self._done = True
+            self._in_value = self._target = False
+            i = j + 1
+        return out
+
+    def close(self):
+        out = []
+        if self._target and self._carry:
+            out.append(unquote_to_bytes(self._carry.replace(b"+", b" ")))
+        self._carry = b""
+        return out
+
+
+def _find_any(data, start, chars):
+    positions = [p for p in (data.find(c, start) for c in (chars[:1], chars[1:])) if p >= 0]
+    return min(positions) if positions else -1
+
+
+class NotAnArray(ValueError):
+    """Le document JSON n'est pas un tableau"""
+
+
+class JsonArrayParser:
+    """Parseur incrémental d'un tableau JSON : `feed(octets)` rend les éléments complets"""
+
+    def __init__(self, max_item_size=1024 * 1024):
+        self.max_item_size = max_item_size
+        self.count = 0
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"
+
+    def feed(self, data):
+        self._buf += self._utf8.decode(data)
+        return self._parse(final=False)
+
+    def close(self):
+        self._buf += self._utf8.decode(b"", final=True)
+        items = self._parse(final=True)
+        if self._state != "done":
+            raise ValueError("tableau JSON incomplet")
+        return items
+
+    def _parse(self, final):
+        items = []
+        buf, pos = self._buf, self._pos
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            char = buf[pos]
+            if self._state == "start":
+                if char != "[":
+                    raise NotAnArray("Liste attendue")
+                self._state = "first"
+                pos += 1
+            elif self._state in ("first", "value"):
+                if self._state == "first" and char == "]":
+                    self._state = "done"
+                    pos += 1
+                    continue
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    if final or len(buf) - pos > self.max_item_size:
+                        raise ValueError(f"JSON invalide : {e}") from None
+                    break
+                if not final and (end == len(buf) or (
+                        isinstance(item, (int, float)) and _NUMBER_TAIL.fullmatch(buf, end))):
+                    break  # un nombre peut continuer dans le morceau suivant
+                items.append(item)
+                self.count += 1
+                self._state = "separator"
+                pos = end
+            elif self._state == "separator":
+                if char == ",":
+                    self._state = "value"
+                elif char == "]":
+                    self._state = "done"
+                else:
+                    raise ValueError(f"JSON invalide : ',' ou ']' attendu en position {pos}")
+                pos += 1
+            else:
+                raise ValueError("JSON invalide : données après la fin du tableau")
+        if pos > _COMPACT_AT:
+            buf, pos = buf[pos:], 0
+        self._buf, self._pos = buf, pos
+        return items
+
+
+class SignedFieldReader:
+    """Champ d'un webhook lu en flux : décodé, haché (HMAC-SHA256), validé et recopié dans un tampon.
+
+    `feed` prend les morceaux d'un corps x-www-form-urlencoded, `feed_value`
+    une valeur déjà extraite (autre type de contenu). Le tampon reste en
+    mémoire jusqu'à `spool_memory` octets, sur disque au-delà ; il n'est relu
+    (`batches`) qu'une fois la signature vérifiée et le JSON validé.
+    """
+
+    def __init__(self, field, key=None, spool_memory=1024 * 1024):
+        self.digest = hmac.new(key.encode(), digestmod=hashlib.sha256) if key is not None else None
+        self.decoder = FormFieldDecoder(field)
+        self.validator = JsonArrayParser()
+        self.spool = tempfile.SpooledTemporaryFile(max_size=spool_memory)
+        self.json_error = None
+        self._value_fed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.spool.close()
+
+    def feed(self, chunk):
+        self._absorb(self.decoder.feed(chunk))
+
+    def close(self):
+        self._absorb(self.decoder.close())
+
+    def feed_value(self, value):
+        self._value_fed = True
+        self._absorb([value])
+
+    @property
+    def size(self):
+        return self.spool.tell()
+
+    @property
+    def empty(self):
+        return not (self.decoder.found or self._value_fed) or self.size == 0
+
+    def verify(self, signature):
+        """Signature base64 attendue dans X-SG-SIGNATURE (toujours vrai sans clé)"""
+        if self.digest is None:
+            return True
+        expected = base64.b64encode(self.digest.digest()).decode()
+        return hmac.compare_digest(signature or "", expected)
+
+    def validate(self):
+        """Nombre d'éléments du tableau ; NotAnArray ou ValueError si le JSON ne convient pas"""
+        if self.json_error is None:
+            try:
+                self.validator.close()
+            except ValueError as e:
+                self.json_error = e
+        if self.json_error is not None:
+            raise self.json_error
+        return self.validator.count
+
+    def batches(self, size, read_size=64 * 1024):
+        """Relit le tampon et rend les éléments par listes de `size`"""
+        self.spool.seek(0)
+        parser = JsonArrayParser()
+        batch = []
+        for chunk in iter(lambda: self.spool.read(read_size), b""):
+            batch.extend(parser.feed(chunk))
+            while len(batch) >= size:
+                yield batch[:size]
+                del batch[:size]
+        batch.extend(parser.close())
+        if batch:
+            yield batch
+
+    def _absorb(self, pieces):
+        for piece in pieces:
+            if self.digest is not None:
+                self.digest.update(piece)
+            self.spool.write(piece)
+            if self.json_error is None:
+                try:
+                    self.validator.feed(piece)
+                except ValueError as e:
+                    self.json_error = e